@@ -0,0 +1,128 @@
+"""
+    Benchmark of our cache format against pickle, which dogpile's redis backend used on its own.
+
+    Builds values shaped like the ones our dogpile regions cache: a day's list of tracebacks (with
+    their raw text left out, like get_tracebacks does) and a list of jira issues with long
+    descriptions and comments. For each value and each format we report the encoded size, and the
+    median time to encode and decode it.
+
+    Needs no ES or redis. Run from the repo root, with the usual environment variables loaded:
+        PYTHONPATH=src python scripts/benchmarks/cache_serializer.py --tracebacks 100 --repeat 50
+"""
+import argparse
+import datetime
+import pickle
+import random
+import statistics
+import time
+
+from common_util import cache_serializer
+from lib.jira.jira_issue import JiraIssue
+from lib.traceback.traceback import Traceback
+
+
+FIRST_ID = 900000000000000000
+
+WORDS = (
+    'campaign account keyword report budget bid group adwords bing social grader engine manager '
+    'load save fetch sync update render handle process parse'
+).split()
+
+
+def generate_traceback_text(rand):
+    frames = []
+    for _ in range(rand.randint(2, 8)):
+        module, function, variable = rand.sample(WORDS, 3)
+        frames.append('  File "/opt/wordstream/%s/%s.py", line %s, in %s_%s' % (
+            module, function, rand.randint(1, 2000), function, variable
+        ))
+        frames.append('    %s = self.%s(%s)' % (variable, function, module))
+    return 'Traceback (most recent call last):\n%s\nKeyError: %r' % (
+        '\n'.join(frames), '%s_id' % rand.choice(WORDS)
+    )
+
+
+def generate_tracebacks(rand, num_tracebacks):
+    start = datetime.datetime(2018, 1, 1, tzinfo=datetime.timezone.utc)
+    res = []
+    for i in range(num_tracebacks):
+        text = generate_traceback_text(rand)
+        context = '\n'.join(' '.join(rand.sample(WORDS, 8)) for _ in range(5))
+        res.append(Traceback(
+            text, context + '\n' + text, None, None,
+            FIRST_ID + i,
+            start + datetime.timedelta(seconds=i * 60),
+            'i-%08x' % rand.randrange(16 ** 8),
+            'aws1.engine.server',
+            'profile_%s' % rand.randrange(100),
+            None,
+            unloaded_fields=('raw_traceback_text', 'raw_full_text'),
+        ))
+    return res
+
+
+def generate_jira_issues(rand, num_jira_issues):
+    created = datetime.datetime(2018, 1, 1, 12, 0, 0, 123000, tzinfo=datetime.timezone.utc)
+    res = []
+    for i in range(num_jira_issues):
+        description = 'we saw this on focus=%s\n%s' % (
+            FIRST_ID + i, generate_traceback_text(rand)
+        )
+        comments = '\n\n'.join(generate_traceback_text(rand) for _ in range(rand.randint(0, 5)))
+        res.append(JiraIssue(
+            'PPC-%s' % i, 'https://jira.example.com/browse/PPC-%s' % i,
+            ' '.join(rand.sample(WORDS, 6)),
+            description, description, comments, comments,
+            'Bug', 'someone', 'Open', created, created, ['traceback'],
+        ))
+    return res
+
+
+def time_format(dumps, loads, value, repeat):
+    dump_times = []
+    load_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = dumps(value)
+        dump_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        loads(data)
+        load_times.append(time.perf_counter() - start)
+    return len(data), statistics.median(dump_times) * 1000, statistics.median(load_times) * 1000
+
+
+def run(name, value, repeat):
+    print(name)
+    formats = (
+        ('pickle', lambda v: pickle.dumps(v, pickle.HIGHEST_PROTOCOL), pickle.loads),
+        ('cache_serializer', cache_serializer.dumps, cache_serializer.loads),
+    )
+    pickle_size = None
+    for format_name, dumps, loads in formats:
+        size, dump_ms, load_ms = time_format(dumps, loads, value, repeat)
+        if pickle_size is None:
+            pickle_size = size
+        print('  %-18s %9d bytes (%5.1f%% of pickle)  encode=%7.2fms  decode=%7.2fms' % (
+            format_name, size, 100.0 * size / pickle_size, dump_ms, load_ms
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tracebacks', type=int, default=100)
+    parser.add_argument('--jira-issues', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=50, help='times to encode each value')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rand = random.Random(args.seed)
+    run('%s tracebacks' % args.tracebacks, generate_tracebacks(rand, args.tracebacks), args.repeat)
+    run(
+        '%s jira issues' % args.jira_issues,
+        generate_jira_issues(rand, args.jira_issues),
+        args.repeat,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+    Benchmark of our two ways of finding exact traceback matches.
+
+    Compares the phrase query over the analyzed traceback_text (how EXACT_MATCH used to work) with
+    the term query over the keyword traceback_signature field. Each query is run against the same
+    sample of traceback texts, and we report ES's own 'took' time plus the round trip time.
+
+    Run from the repo root, with the usual environment variables loaded:
+        PYTHONPATH=src python scripts/benchmarks/exact_match_latency.py --days 3 --repeat 5
+"""
+import argparse
+import datetime
+import statistics
+import time
+
+import opentracing
+
+from common_util import (
+    elasticsearch_config,
+    es_util,
+)
+from lib.traceback import (
+    traceback_db,
+)
+from lib.traceback.traceback import generate_signature
+
+
+def run_query(es, body, num_matches):
+    start = time.time()
+    res = es.search(
+        index=traceback_db.INDEX,
+        doc_type=traceback_db.DOC_TYPE,
+        body=body,
+        sort='origin_timestamp:desc',
+        size=num_matches,
+        request_cache=False,
+    )
+    round_trip_ms = (time.time() - start) * 1000
+    return res['took'], round_trip_ms, res['hits']['total']
+
+
+def p95(values):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * 0.95))]
+
+
+def summarize(name, timings):
+    took = [t[0] for t in timings]
+    round_trip = [t[1] for t in timings]
+    print('%-10s n=%-5d took median=%6.1fms p95=%6.1fms | round trip median=%6.1fms p95=%6.1fms' % (
+        name,
+        len(timings),
+        statistics.median(took),
+        p95(took),
+        statistics.median(round_trip),
+        p95(round_trip),
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=int, default=1, help='days of tracebacks to sample from')
+    parser.add_argument('--repeat', type=int, default=3, help='times to run each query')
+    parser.add_argument('--num-matches', type=int, default=100, help='size of each query')
+    args = parser.parse_args()
+
+    es = elasticsearch_config.get_db()
+    today = datetime.date.today()
+    tracebacks = traceback_db.get_tracebacks(
+        es, opentracing.tracer, today - datetime.timedelta(days=args.days), today, 1000
+    )
+    texts = sorted(set(tb.traceback_text for tb in tracebacks))
+    print('sampled %s distinct traceback texts from %s tracebacks' % (len(texts), len(tracebacks)))
+
+    phrase_timings = []
+    term_timings = []
+    mismatched_counts = 0
+    for _ in range(args.repeat):
+        for text in texts:
+            phrase_body = es_util.generate_text_match_payload(
+                text, ["traceback_text"], es_util.EXACT_MATCH
+            )
+            term_body = {"query": {"term": {"traceback_signature": generate_signature(text)}}}
+            phrase_result = run_query(es, phrase_body, args.num_matches)
+            term_result = run_query(es, term_body, args.num_matches)
+            phrase_timings.append(phrase_result)
+            term_timings.append(term_result)
+            if phrase_result[2] != term_result[2]:
+                mismatched_counts += 1
+
+    summarize('phrase', phrase_timings)
+    summarize('term', term_timings)
+    print('queries where the two approaches found a different number of hits: %s of %s' % (
+        mismatched_counts, len(term_timings)
+    ))
+
+
+if __name__ == '__main__':
+    main()
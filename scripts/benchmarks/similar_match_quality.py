@@ -0,0 +1,153 @@
+"""
+    Benchmark of our two ways of finding SIMILAR_MATCH tracebacks and jira issues.
+
+    Compares the phrase query that drops the last word of the traceback text (how SIMILAR_MATCH
+    used to work) with the minhash band key lookup. Each approach is run against the same sample
+    of traceback texts. We report latency, plus the recall of the minhash lookup: the fraction of
+    the phrase query's matches it also finds. Matches only the minhash lookup finds are counted
+    separately; those are the near-duplicates the phrase query misses.
+
+    Tracebacks are compared by signature (so each similar traceback group counts once), jira
+    issues by key.
+
+    The traceback groups and jira issues must have their minhashes. Rebuild the traceback groups
+    first if they were saved before we had them.
+
+    Run from the repo root, with the usual environment variables loaded:
+        PYTHONPATH=src python scripts/benchmarks/similar_match_quality.py --days 3
+"""
+import argparse
+import datetime
+import statistics
+import time
+
+import opentracing
+
+from common_util import (
+    elasticsearch_config,
+    es_util,
+)
+from lib.jira import (
+    jira_issue_db,
+)
+from lib.traceback import (
+    traceback_db,
+    traceback_group_db,
+    traceback_minhash,
+)
+from lib.traceback.traceback import generate_signature
+
+
+MAX_MATCHES = 1000
+
+
+def phrase_traceback_signatures(es, text):
+    body = es_util.generate_text_match_payload(
+        text, ["traceback_text"], es_util.SIMILAR_MATCH
+    )
+    body['aggs'] = {
+        "signatures": {"terms": {"field": "traceback_signature", "size": MAX_MATCHES}}
+    }
+    res = es.search(
+        index=traceback_db.INDEX,
+        doc_type=traceback_db.DOC_TYPE,
+        body=body,
+        size=0,
+        request_cache=False,
+    )
+    return set(bucket['key'] for bucket in res['aggregations']['signatures']['buckets'])
+
+
+def minhash_traceback_signatures(es, text):
+    similar = traceback_group_db.find_similar_groups(
+        es, opentracing.tracer, [traceback_minhash.generate_minhash(text)]
+    )
+    return set(similar) | {generate_signature(text)}
+
+
+def phrase_jira_issue_keys(es, text):
+    body = es_util.generate_text_match_payload(
+        text, jira_issue_db.MATCH_FIELDS, es_util.SIMILAR_MATCH
+    )
+    body['_source'] = False
+    res = es.search(
+        index=jira_issue_db.INDEX,
+        doc_type=jira_issue_db.DOC_TYPE,
+        body=body,
+        size=MAX_MATCHES,
+        request_cache=False,
+    )
+    return set(hit['_id'] for hit in res['hits']['hits'])
+
+
+def minhash_jira_issue_keys(es, text):
+    # call the wrapped function, so the dogpile cache doesn't skew the timing
+    return set(
+        jira_issue.key for jira_issue in jira_issue_db.get_matching_jira_issues.original(
+            es, opentracing.tracer, text, es_util.SIMILAR_MATCH
+        )
+    )
+
+
+def timed(func, *args):
+    start = time.time()
+    res = func(*args)
+    return res, (time.time() - start) * 1000
+
+
+def p95(values):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * 0.95))]
+
+
+def compare(name, es, texts, old_func, new_func):
+    old_timings = []
+    new_timings = []
+    found = 0
+    missed = 0
+    extra = 0
+    for text in texts:
+        old_matches, old_ms = timed(old_func, es, text)
+        new_matches, new_ms = timed(new_func, es, text)
+        old_timings.append(old_ms)
+        new_timings.append(new_ms)
+        found += len(old_matches & new_matches)
+        missed += len(old_matches - new_matches)
+        extra += len(new_matches - old_matches)
+
+    for approach, timings in (('phrase', old_timings), ('minhash', new_timings)):
+        print('%-12s %-8s n=%-5d round trip median=%6.1fms p95=%6.1fms' % (
+            name, approach, len(timings), statistics.median(timings), p95(timings)
+        ))
+    recall = found / (found + missed) if found + missed else 1.0
+    print('%-12s recall of the phrase matches: %.3f (%s found, %s missed)' % (
+        name, recall, found, missed
+    ))
+    print('%-12s matches only found by minhash: %s' % (name, extra))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=int, default=1, help='days of tracebacks to sample from')
+    args = parser.parse_args()
+
+    es = elasticsearch_config.get_db()
+    today = datetime.date.today()
+    tracebacks = traceback_db.get_tracebacks(
+        es, opentracing.tracer, today - datetime.timedelta(days=args.days), today, 1000
+    )
+    texts = sorted(set(tb.traceback_text for tb in tracebacks))
+    print('sampled %s distinct traceback texts from %s tracebacks' % (len(texts), len(tracebacks)))
+
+    start = time.time()
+    for text in texts:
+        traceback_minhash.generate_minhash(text)
+    elapsed_ms = (time.time() - start) * 1000
+    print('minhash generation: %.2fms per text' % (elapsed_ms / max(1, len(texts))))
+
+    compare('tracebacks', es, texts, phrase_traceback_signatures, minhash_traceback_signatures)
+    compare('jira issues', es, texts, phrase_jira_issue_keys, minhash_jira_issue_keys)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+    Benchmark of ingest and query latency across our storage backends.
+
+    Generates a synthetic set of tracebacks (a few hundred distinct stacks, with varying exception
+    messages) and jira issues that quote some of them. Each backend ingests them in batches, like
+    our log parser does, and then runs the same queries. We report documents per second for
+    ingest, and median and p95 latency for each kind of query.
+
+    The sqlite backend writes to a temporary file. The elasticsearch backend writes to the cluster
+    at ES_ADDRESS: only run it against a dev cluster, since the synthetic documents are saved like
+    any others.
+
+    Run from the repo root, with the usual environment variables loaded:
+        PYTHONPATH=src python scripts/benchmarks/storage_backends.py --backends sqlite elasticsearch
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from common_util import (
+    elasticsearch_config,
+    es_util,
+)
+from lib.jira.jira_issue import JiraIssue
+from lib.storage.elasticsearch_backend import ElasticsearchBackend
+from lib.storage.sqlite_backend import SqliteBackend
+from lib.traceback.traceback import Traceback
+
+
+FIRST_ID = 900000000000000000
+"""
+    Synthetic tracebacks get ids from here up, well past the papertrail ids we've seen
+"""
+
+WORDS = (
+    'campaign account keyword report budget bid group adwords bing social grader engine manager '
+    'load save fetch sync update render handle process parse'
+).split()
+
+
+def generate_stacks(rand, num_stacks):
+    stacks = []
+    for _ in range(num_stacks):
+        frames = []
+        for _ in range(rand.randint(2, 8)):
+            module, function, variable = rand.sample(WORDS, 3)
+            frames.append('  File "/opt/wordstream/%s/%s.py", line %s, in %s_%s' % (
+                module, function, rand.randint(1, 2000), function, variable
+            ))
+            frames.append('    %s = self.%s(%s)' % (variable, function, module))
+        stacks.append(frames)
+    return stacks
+
+
+def generate_traceback_text(rand, frames):
+    return 'Traceback (most recent call last):\n%s\nKeyError: %r' % (
+        '\n'.join(frames), '%s_id' % rand.choice(WORDS)
+    )
+
+
+def generate_tracebacks(rand, stacks, num_tracebacks, num_days):
+    start = datetime.datetime(2018, 1, 1, tzinfo=datetime.timezone.utc)
+    seconds_apart = num_days * 24 * 60 * 60 / num_tracebacks
+    for i in range(num_tracebacks):
+        text = generate_traceback_text(rand, rand.choice(stacks))
+        yield Traceback(
+            text, text, text, text,
+            FIRST_ID + i,
+            start + datetime.timedelta(seconds=int(i * seconds_apart)),
+            'i-%08x' % rand.randrange(16 ** 8),
+            'aws1.engine.server',
+        )
+
+
+def generate_jira_issues(rand, stacks, num_jira_issues):
+    for i in range(num_jira_issues):
+        description = 'Seen on %s accounts:\n{noformat}\n%s\n{noformat}' % (
+            rand.randint(1, 50), generate_traceback_text(rand, rand.choice(stacks))
+        )
+        yield JiraIssue(
+            'BENCH-%s' % i, '', '%s is broken' % ' '.join(rand.sample(WORDS, 3)),
+            description, description, '', '', 'Bug', '', 'Open',
+            '2018-04-18T11:19:55.000-0400', '2018-04-18T11:19:55.000-0400', [],
+        )
+
+
+def p95(values):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * 0.95))]
+
+
+def time_queries(name, func, args_list):
+    timings = []
+    for args in args_list:
+        start = time.time()
+        func(*args)
+        timings.append((time.time() - start) * 1000)
+    print('  %-28s n=%-5d median=%7.2fms p95=%7.2fms' % (
+        name, len(timings), statistics.median(timings), p95(timings)
+    ))
+
+
+def run(name, backend, tracebacks, jira_issues, query_texts, batch_size):
+    print(name)
+    start = time.time()
+    for i in range(0, len(tracebacks), batch_size):
+        backend.save_tracebacks(tracebacks[i:i + batch_size])
+    elapsed = time.time() - start
+    print('  ingested %s tracebacks: %.0f docs/sec' % (len(tracebacks), len(tracebacks) / elapsed))
+
+    start = time.time()
+    for jira_issue in jira_issues:
+        backend.save_jira_issue(jira_issue)
+    elapsed = time.time() - start
+    print('  ingested %s jira issues: %.0f docs/sec' % (
+        len(jira_issues), len(jira_issues) / elapsed
+    ))
+
+    if isinstance(backend, ElasticsearchBackend):
+        backend.es.indices.refresh()
+
+    days = sorted(set(tb.origin_timestamp.date() for tb in tracebacks))
+    time_queries('get_tracebacks (one day)', backend.get_tracebacks, [
+        (day, day, 100) for day in days
+    ])
+    for match_level in sorted(es_util.ALL_MATCH_LEVELS, reverse=True):
+        time_queries(
+            'get_matching_tracebacks %s' % match_level, backend.get_matching_tracebacks,
+            [(text, match_level, 100) for text in query_texts]
+        )
+        time_queries(
+            'get_matching_jira_issues %s' % match_level, backend.get_matching_jira_issues,
+            [(text, match_level) for text in query_texts]
+        )
+    time_queries('search_jira_issues', backend.search_jira_issues, [
+        (' '.join(text.split()[-4:-1]), 10) for text in query_texts
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backends', nargs='+', default=['sqlite'],
+                        choices=['sqlite', 'elasticsearch'])
+    parser.add_argument('--tracebacks', type=int, default=50000)
+    parser.add_argument('--jira-issues', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=30, help='days the tracebacks are spread over')
+    parser.add_argument('--stacks', type=int, default=500, help='number of distinct stacks')
+    parser.add_argument('--queries', type=int, default=200, help='number of each query to run')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    stacks = generate_stacks(rand, args.stacks)
+    tracebacks = list(generate_tracebacks(rand, stacks, args.tracebacks, args.days))
+    jira_issues = list(generate_jira_issues(rand, stacks, args.jira_issues))
+    query_texts = [tb.traceback_text for tb in rand.sample(tracebacks, args.queries)]
+
+    for name in args.backends:
+        if name == 'sqlite':
+            with tempfile.TemporaryDirectory() as directory:
+                backend = SqliteBackend(os.path.join(directory, 'benchmark.sqlite3'))
+                run(name, backend, tracebacks, jira_issues, query_texts, args.batch_size)
+                backend.close()
+        else:
+            backend = ElasticsearchBackend(elasticsearch_config.get_db())
+            run(name, backend, tracebacks, jira_issues, query_texts, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
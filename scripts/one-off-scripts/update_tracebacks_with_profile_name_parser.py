@@ -6,21 +6,24 @@
 """
 import datetime
 
-from elasticsearch import Elasticsearch
-import certifi
-
-from app import (
-    config_util,
+from common_util import (
+    elasticsearch_config,
+)
+from lib.logparse import (
     profile_name_parser,
+)
+from lib.traceback import (
     traceback_db,
+)
+from webapp import (
     tracing,
 )
 
 
 tracer = tracing.initialize_tracer()
 
-ES_ADDRESS = config_util.get('ES_ADDRESS')
-ES = Elasticsearch([ES_ADDRESS], ca_certs=certifi.where())
+ES = elasticsearch_config.get_db()
+traceback_db.register_text_loader(ES)
 
 
 def main():
@@ -32,14 +35,16 @@ def main():
             except Exception:
                 print('date does not exist: %s' % date_)
                 continue
-            tracebacks = traceback_db.get_tracebacks(
-                ES, tracer, date_, date_, 10000
-            )
-            print('found %s tracebacks' % len(tracebacks))
-            for traceback in tracebacks:
+            # the parser reads every traceback's raw_full_text, so fetch it with the rest
+            num_tracebacks = 0
+            for traceback in traceback_db.iter_tracebacks(
+                    ES, tracer, date_, date_, excluded_fields=()
+            ):
+                num_tracebacks += 1
                 new_traceback = profile_name_parser.parse(traceback)
                 if new_traceback:
                     traceback_db.save_traceback(ES, new_traceback)
+            print('found %s tracebacks' % num_tracebacks)
 
 
 if __name__ == '__main__':
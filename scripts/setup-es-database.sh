@@ -11,10 +11,13 @@ set -a
 source .env
 set +a
 
+# tracebacks are saved in monthly partitions (tracebacks-v2-YYYY-MM, where v2 is the version of
+# our mapping). the template gives each new partition our mapping and adds it to the 'tracebacks'
+# read alias
 curl -X PUT \
-     "$ES_ADDRESS:9200/traceback-index" \
+     "$ES_ADDRESS:9200/_template/tracebacks-v2" \
      -H 'Content-Type: application/json' \
-     -d @scripts/es_mappings/traceback_index.json
+     -d @scripts/es_mappings/traceback_index_template.json
 
 echo "\n"
 
@@ -22,3 +25,37 @@ curl -X PUT \
      "$ES_ADDRESS:9200/jira-issue-index" \
      -H 'Content-Type: application/json' \
      -d @scripts/es_mappings/jira_issue_index.json
+
+echo "\n"
+
+curl -X PUT \
+     "$ES_ADDRESS:9200/traceback-group-index" \
+     -H 'Content-Type: application/json' \
+     -d @scripts/es_mappings/traceback_group_index.json
+
+echo "\n"
+
+# one document per traceback we've added to its group, so re-saving a traceback never counts it
+# twice. see traceback_group_db.add_occurrences
+curl -X PUT \
+     "$ES_ADDRESS:9200/traceback-occurrence-index" \
+     -H 'Content-Type: application/json' \
+     -d @scripts/es_mappings/traceback_occurrence_index.json
+
+echo "\n"
+
+# one percolator query per traceback signature and match level. jira issues are run against these
+# when they're saved, see lib/traceback/traceback_query_db.py
+curl -X PUT \
+     "$ES_ADDRESS:9200/traceback-query-index" \
+     -H 'Content-Type: application/json' \
+     -d @scripts/es_mappings/traceback_query_index.json
+
+echo "\n"
+
+# api calls are saved in monthly indices (api-call-YYYY-MM). the template maps their fields as
+# keywords and numbers, since we only ever filter and aggregate on them
+curl -X PUT \
+     "$ES_ADDRESS:9200/_template/api-calls" \
+     -H 'Content-Type: application/json' \
+     -d @scripts/es_mappings/api_call_index_template.json
@@ -0,0 +1,159 @@
+"""
+    Helpers for loading large amounts of historical data into ES without hurting live traffic.
+
+    For all functions, `es` must be an instance of Elasticsearch
+"""
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Tuple,
+)
+import concurrent.futures
+import contextlib
+import logging
+import time
+
+import elasticsearch
+
+
+logger = logging.getLogger()
+
+
+BULK_LOAD_SETTINGS = {
+    "index": {
+        "refresh_interval": "-1",
+        "number_of_replicas": 0,
+    }
+}
+"""
+    Index settings we use while bulk loading. No refreshes and no replicas, so that each document
+    is only written (and merged) once
+"""
+
+WRITE_THREAD_POOLS = 'bulk,write'
+"""
+    The thread pools that handle our bulk requests. ES 6.3 renamed 'bulk' to 'write'
+"""
+
+MAX_QUEUED_WRITES = 50
+"""
+    If more bulk requests than this are queued across the cluster, we consider it under pressure
+"""
+
+PRESSURE_SLEEP_SECONDS = 5
+"""
+    How long we wait before starting more work when the cluster is under pressure
+"""
+
+
+@contextlib.contextmanager
+def bulk_load_mode(es, indices:Iterable[str]):
+    """
+        Context manager that turns off refreshes and replicas on the given indices while we bulk
+        load into them
+
+        Indices that don't exist yet are created first (so that they get their index template),
+        and indices already in bulk load mode (refreshes already off) are left to whoever put them
+        there. On exit, even if the load failed, each index gets its original refresh interval and
+        replica count back, and is refreshed so the loaded documents are searchable right away.
+
+        Yields the names of the indices we put into bulk load mode.
+    """
+    original_settings: Dict[str, dict] = {}
+    for index in indices:
+        es.indices.create(index=index, ignore=400) # 400 means the index already exists
+        settings = es.indices.get_settings(index=index)[index]['settings']['index']
+        if settings.get('refresh_interval') == BULK_LOAD_SETTINGS['index']['refresh_interval']:
+            logger.warning('index %s is already in bulk load mode. leaving it alone', index)
+            continue
+        original_settings[index] = {
+            "index": {
+                # None resets the setting to ES's default
+                "refresh_interval": settings.get('refresh_interval'),
+                "number_of_replicas": settings.get('number_of_replicas'),
+            }
+        }
+        es.indices.put_settings(index=index, body=BULK_LOAD_SETTINGS)
+        logger.info('put index %s into bulk load mode', index)
+
+    try:
+        yield sorted(original_settings)
+    finally:
+        for index, settings in original_settings.items():
+            try:
+                es.indices.put_settings(index=index, body=settings)
+                es.indices.refresh(index=index)
+                logger.info('restored index %s from bulk load mode', index)
+            except elasticsearch.ElasticsearchException:
+                logger.exception('failed to restore index %s from bulk load mode', index)
+
+
+def get_write_pressure(es) -> Tuple[int, int]:
+    """
+        Returns the number of bulk requests queued across the cluster, and the total number of bulk
+        requests the cluster has rejected since its nodes started
+    """
+    queued = 0
+    rejected = 0
+    for pool in es.cat.thread_pool(
+            thread_pool_patterns=WRITE_THREAD_POOLS, format='json', h='name,queue,rejected'
+    ):
+        queued += int(pool['queue'])
+        rejected += int(pool['rejected'])
+    return queued, rejected
+
+
+def run_throttled(es, func:Callable, args_list:Iterable[tuple], max_concurrency:int) -> List:
+    """
+        Calls func with each of the given tuples of args, running up to max_concurrency calls at
+        a time in threads
+
+        Concurrency adapts to the cluster: before starting each call we check its write thread
+        pools. If bulk requests are piling up or being rejected we halve our concurrency and back
+        off; otherwise we let it grow again by one, up to max_concurrency.
+
+        A call that raises is logged and its result is None.
+
+        @return: the results of each call, in the same order as args_list
+    """
+    args_list = list(args_list)
+    results: List = [None] * len(args_list)
+    concurrency = max_concurrency
+    _, last_rejected = get_write_pressure(es)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        running: Dict[concurrent.futures.Future, int] = {}
+        for i, args in enumerate(args_list):
+            while True:
+                queued, rejected = get_write_pressure(es)
+                if queued > MAX_QUEUED_WRITES or rejected > last_rejected:
+                    concurrency = max(1, concurrency // 2)
+                    logger.info(
+                        'cluster under write pressure (%s queued, %s newly rejected). '
+                        'concurrency down to %s', queued, rejected - last_rejected, concurrency
+                    )
+                    last_rejected = rejected
+                    time.sleep(PRESSURE_SLEEP_SECONDS)
+                elif concurrency < max_concurrency:
+                    concurrency += 1
+                if len(running) < concurrency:
+                    break
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    _collect_result(future, running.pop(future), results)
+            running[executor.submit(func, *args)] = i
+
+        for future in concurrent.futures.as_completed(running):
+            _collect_result(future, running[future], results)
+    return results
+
+
+def _collect_result(future:concurrent.futures.Future, index:int, results:List):
+    try:
+        results[index] = future.result()
+    except Exception: # pylint: disable=broad-except
+        logger.exception('bulk load call failed')
@@ -0,0 +1,234 @@
+"""
+    The format our dogpile regions store their values in redis in.
+
+    Dogpile's redis backend pickles whatever we cache. A pickled list of our model objects repeats
+    every attribute name of every object, and stores all of their text uncompressed, so most of a
+    cached list of tracebacks or jira issues is overhead. L{SerializerProxy} encodes our values
+    before the redis backend sees them:
+    - a header: L{MAGIC}, the L{VERSION} of the format and the encoding of the body
+    - the body: the value as JSON, zlib compressed. Objects of the types registered with
+      L{register_type} are written as their type's name and a list of their fields. Tuples, dicts,
+      datetimes and dates are tagged, so they decode to what we cached
+
+    Values that hold anything else are pickled instead, and compressed the same way.
+
+    Our values come out at a sixth to a ninth of their pickled size (see
+    scripts/benchmarks/cache_serializer.py), but take a few times longer to decode than to unpickle.
+    The in-process tier in front of redis keeps values decoded, so a busy key is only decoded once
+    per process in a while. Decoding builds objects through their constructors, so a value cached
+    before a field was added still gets the field's default.
+
+    A value with another magic or version, or one cached before we had this format, is ignored:
+    the region counts it as a miss and recomputes it. Bump L{VERSION} whenever the fields of a
+    registered type change.
+"""
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Optional,
+    Sequence,
+    Tuple,
+)
+import datetime
+import json
+import logging
+import pickle
+import zlib
+
+from dogpile.cache.api import (
+    CachedValue,
+    NO_VALUE,
+)
+from dogpile.cache.proxy import ProxyBackend
+
+
+MAGIC = b'acs'
+"""
+    The start of every value we write. Short for assertion-context serializer
+"""
+
+VERSION = 1
+"""
+    Version of our format. Values written with any other version are ignored
+"""
+
+JSON_ENCODING = b'j'
+PICKLE_ENCODING = b'p'
+
+COMPRESSION_LEVEL = 6
+"""
+    zlib's default. Higher levels barely shrink our values and take much longer to write
+"""
+
+logger = logging.getLogger()
+
+_types: Dict[str, Tuple[type, Callable[[Any], Sequence]]] = {}
+"""
+    Name of a registered type -> (the type, the function that returns an object's fields)
+"""
+_type_names: Dict[type, str] = {}
+
+
+def register_type(name:str, cls:type, get_fields:Callable[[Any], Sequence]):
+    """
+        Lets us write objects of the given class compactly
+
+        get_fields takes an object and returns its fields, in the order the class's constructor
+        takes them: we decode the object by passing them back to the constructor. Fields may be
+        any value we can encode, including other registered objects
+    """
+    assert name not in _types or _types[name][0] is cls, (name, _types[name])
+    _types[name] = (cls, get_fields)
+    _type_names[cls] = name
+
+
+class _UnencodableError(Exception):
+    pass
+
+
+def dumps(value) -> bytes:
+    """
+        Encodes the given value in our format
+    """
+    try:
+        encoding = JSON_ENCODING
+        body = json.dumps(_encode(value), separators=(',', ':')).encode('utf-8')
+    except _UnencodableError:
+        encoding = PICKLE_ENCODING
+        body = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    return MAGIC + bytes((VERSION,)) + encoding + zlib.compress(body, COMPRESSION_LEVEL)
+
+
+def loads(data:bytes):
+    """
+        Decodes a value written by L{dumps}
+
+        Raises ValueError if the value isn't in our current format, or names a type we don't know
+    """
+    header_size = len(MAGIC) + 2
+    if data[:len(MAGIC)] != MAGIC or len(data) < header_size:
+        raise ValueError('not a cached value')
+    version = data[len(MAGIC)]
+    if version != VERSION:
+        raise ValueError('cached value is version %s, not %s' % (version, VERSION))
+
+    encoding = data[len(MAGIC) + 1:header_size]
+    try:
+        body = zlib.decompress(data[header_size:])
+    except zlib.error as e:
+        raise ValueError('cached value is corrupt: %s' % e) from e
+    if encoding == JSON_ENCODING:
+        return _decode(json.loads(body.decode('utf-8')))
+    if encoding == PICKLE_ENCODING:
+        return pickle.loads(body)
+    raise ValueError('unknown encoding %r' % encoding)
+
+
+def _encode(value):
+    value_type = type(value)
+    if value is None or value_type in (bool, int, float, str):
+        return value
+    if value_type is list:
+        return [_encode(item) for item in value]
+    if value_type in _type_names:
+        name = _type_names[value_type]
+        get_fields = _types[name][1]
+        return {"o": name, "f": [_encode(field) for field in get_fields(value)]}
+    if value_type is tuple:
+        return {"t": [_encode(item) for item in value]}
+    if value_type is dict:
+        if all(type(key) is str for key in value):
+            return {"d": {key: _encode(item) for key, item in value.items()}}
+        return {"p": [[_encode(key), _encode(item)] for key, item in value.items()]}
+    if value_type is datetime.datetime:
+        offset = value.utcoffset()
+        return {"dt": [
+            value.year, value.month, value.day,
+            value.hour, value.minute, value.second, value.microsecond,
+            None if offset is None else offset.total_seconds(),
+        ]}
+    if value_type is datetime.date:
+        return {"da": [value.year, value.month, value.day]}
+    raise _UnencodableError(value_type)
+
+
+def _decode(value):
+    if type(value) is list:
+        return [_decode(item) for item in value]
+    if type(value) is not dict:
+        return value
+
+    tag, content = next(iter(value.items()))
+    if tag == "o":
+        if content not in _types:
+            raise ValueError('cached value holds an unknown type %s' % content)
+        return _types[content][0](*_decode(value["f"]))
+    if tag == "t":
+        return tuple(_decode(item) for item in content)
+    if tag == "d":
+        return {key: _decode(item) for key, item in content.items()}
+    if tag == "p":
+        return {_decode(key): _decode(item) for key, item in content}
+    if tag == "dt":
+        offset = content[7]
+        return datetime.datetime(
+            *content[:7],
+            tzinfo=None if offset is None else datetime.timezone(
+                datetime.timedelta(seconds=offset)
+            )
+        )
+    if tag == "da":
+        return datetime.date(*content)
+    raise ValueError('unknown tag %s' % tag)
+
+
+class SerializerProxy(ProxyBackend):
+    """
+        Dogpile proxy backend that writes values in our format, and reads them back
+
+        Values the backend has in any other format are treated as missing
+
+        on_dump, if given, is called with the size in bytes of every value we encode
+    """
+    def __init__(self, on_dump:Optional[Callable[[int], None]]=None):
+        super().__init__()
+        self.on_dump = on_dump
+
+    def get(self, key):
+        return self._load(key, self.proxied.get(key))
+
+    def get_multi(self, keys):
+        keys = list(keys)
+        return [
+            self._load(key, value) for key, value in zip(keys, self.proxied.get_multi(keys))
+        ]
+
+    def set(self, key, value):
+        self.proxied.set(key, self._dump(value))
+
+    def set_multi(self, mapping):
+        self.proxied.set_multi({key: self._dump(value) for key, value in mapping.items()})
+
+    def _dump(self, value:CachedValue) -> bytes:
+        data = dumps((value.payload, value.metadata))
+        if self.on_dump is not None:
+            self.on_dump(len(data))
+        return data
+
+    def _load(self, key, value):
+        if value is NO_VALUE:
+            return value
+        if not isinstance(value, bytes):
+            logger.debug('ignoring %s, cached before our cache format', key)
+            return NO_VALUE
+        try:
+            payload, metadata = loads(value)
+        except ValueError as e:
+            logger.info('ignoring cached value %s: %s', key, e)
+            return NO_VALUE
+        except Exception:
+            # a pickled value may name a class we've since renamed or removed
+            logger.warning('ignoring cached value %s that we can\'t decode', key, exc_info=True)
+            return NO_VALUE
+        return CachedValue(payload, metadata)
@@ -0,0 +1,159 @@
+"""
+    The cache keys and metrics of our dogpile regions.
+
+    Our cached functions take the ES client and the opentracing tracer as arguments. Neither
+    changes what the function returns, so L{function_key_generator} leaves them out of the cache
+    key: a cache warmed by a worker (tracer=None) also serves our web requests (which pass
+    opentracing.tracer). The other arguments are bound to the function's parameters, defaults
+    included, and written out in a canonical form.
+
+    L{InstrumentedCacheRegion} reports the hits, misses, regeneration time and payload size of
+    every cached function to prometheus. Payload sizes come from the region's
+    L{cache_serializer.SerializerProxy}, which already encodes each value it stores.
+"""
+import datetime
+import functools
+import inspect
+import json
+import threading
+import time
+
+import dogpile.cache.region
+import prometheus_client
+
+
+IGNORED_ARGUMENTS = frozenset(('es', 'ES', 'tracer'))
+"""
+    Names of the parameters we leave out of cache keys: our infrastructure, not our inputs
+"""
+
+CACHE_HITS = prometheus_client.Counter(
+    'dogpile_cache_hits', 'Calls to a cached function answered from the cache',
+    ['region', 'function'],
+)
+CACHE_MISSES = prometheus_client.Counter(
+    'dogpile_cache_misses', 'Calls to a cached function that had to run it',
+    ['region', 'function'],
+)
+REGENERATION_SECONDS = prometheus_client.Histogram(
+    'dogpile_cache_regeneration_seconds', 'Time spent running a cached function on a miss',
+    ['region', 'function'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+PAYLOAD_BYTES = prometheus_client.Histogram(
+    'dogpile_cache_payload_bytes', 'Size of the values a cached function returns, as we store them',
+    ['region', 'function'],
+    buckets=(1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8),
+)
+
+
+def function_key_generator(namespace, fn):
+    """
+        Dogpile function_key_generator that ignores our L{IGNORED_ARGUMENTS}
+
+        Keys are the function's module and name, then each of its other arguments by name, in the
+        canonical form of L{canonicalize}. A call that passes an argument by keyword, or leaves out
+        an argument with a default, gets the same key as one that passes every argument by position
+    """
+    signature = inspect.signature(fn)
+    prefix = '%s:%s' % (fn.__module__, fn.__name__)
+    if namespace is not None:
+        prefix = '%s|%s' % (prefix, namespace)
+
+    def generate_key(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        return '|'.join([prefix] + [
+            '%s=%s' % (name, canonicalize(value))
+            for name, value in arguments.arguments.items()
+            if name not in IGNORED_ARGUMENTS
+        ])
+    return generate_key
+
+
+def canonicalize(value) -> str:
+    """
+        Writes the given argument in a form that's the same for equal values, and different for
+        different ones
+
+        Strings are quoted, so texts with spaces or separators can't run together. Timezone-aware
+        datetimes are converted to UTC. Sets are sorted.
+    """
+    if isinstance(value, str):
+        return json.dumps(value)
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        return value.isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ','.join(canonicalize(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return '{%s}' % ','.join(sorted(canonicalize(item) for item in value))
+    if isinstance(value, dict):
+        return '{%s}' % ','.join(sorted(
+            '%s:%s' % (canonicalize(key), canonicalize(item)) for key, item in value.items()
+        ))
+    return repr(value)
+
+
+class InstrumentedCacheRegion(dogpile.cache.region.CacheRegion):
+    """
+        A dogpile region whose cached functions report their hits, misses, regeneration time and
+        payload size, labeled with the region's name and the function's name
+
+        The region only learns a value's size if it's wrapped in a
+        L{cache_serializer.SerializerProxy} that reports to L{observe_payload_size}
+    """
+    def __init__(self, name:str, **kwargs):
+        kwargs.setdefault('function_key_generator', function_key_generator)
+        super().__init__(name=name, **kwargs)
+        self._regenerating = threading.local()
+
+    def cache_on_arguments(self, *args, **kwargs):
+        decorator = super().cache_on_arguments(*args, **kwargs)
+
+        def instrumented_decorator(fn):
+            labels = (self.name, '%s.%s' % (fn.__module__.rsplit('.', 1)[-1], fn.__name__))
+
+            @functools.wraps(fn)
+            def creator(*fn_args, **fn_kwargs):
+                self._regenerating.ran = True
+                start = time.time()
+                value = fn(*fn_args, **fn_kwargs)
+                REGENERATION_SECONDS.labels(*labels).observe(time.time() - start)
+                # dogpile stores the value as soon as we return it, on this thread
+                self._regenerating.labels = labels
+                return value
+
+            cached_fn = decorator(creator)
+
+            @functools.wraps(cached_fn)
+            def instrumented_fn(*fn_args, **fn_kwargs):
+                # we may be inside the creator of another cached function
+                outer_ran = getattr(self._regenerating, 'ran', False)
+                outer_labels = getattr(self._regenerating, 'labels', None)
+                self._regenerating.ran = False
+                self._regenerating.labels = None
+                try:
+                    value = cached_fn(*fn_args, **fn_kwargs)
+                    if self._regenerating.ran:
+                        CACHE_MISSES.labels(*labels).inc()
+                    else:
+                        CACHE_HITS.labels(*labels).inc()
+                    return value
+                finally:
+                    self._regenerating.ran = outer_ran
+                    self._regenerating.labels = outer_labels
+            return instrumented_fn
+        return instrumented_decorator
+
+    def observe_payload_size(self, size:int):
+        """
+            Records the size of a value we're storing, if it was just regenerated by one of our
+            cached functions. Values stored with the region's set() aren't recorded
+        """
+        labels = getattr(self._regenerating, 'labels', None)
+        if labels is not None:
+            PAYLOAD_BYTES.labels(*labels).observe(size)
@@ -1,3 +1,15 @@
+"""
+    Our factory of Elasticsearch clients.
+
+    Each process keeps one client per context (see L{CONTEXTS}). A client holds a pool of
+    persistent connections and is safe to share between threads, so everything in a process should
+    get its client from L{get_db} rather than building its own.
+"""
+from typing import (
+    Dict,
+)
+import threading
+
 from elasticsearch import Elasticsearch
 import certifi
 
@@ -6,7 +18,104 @@ from common_util import (
 )
 
 
-def get_db() -> Elasticsearch:
-    ES_ADDRESS = config_util.get('ES_ADDRESS')
-    ES = Elasticsearch([ES_ADDRESS], ca_certs=certifi.where())
-    return ES
+CONTEXTS = {
+    'web': {"timeout": 10, "pool_size": 10, "max_retries": 1},
+    'worker': {"timeout": 60, "pool_size": 10, "max_retries": 3},
+    'script': {"timeout": 300, "pool_size": 4, "max_retries": 3},
+    'healthcheck': {"timeout": 1, "pool_size": 1, "max_retries": 0},
+}
+"""
+    Default client settings for each context we run in:
+    - timeout: seconds a request may take, unless the call passes its own request_timeout. web
+      requests give up quickly, workers and scripts run long bulk and maintenance requests
+    - pool_size: max number of connections we keep open to each ES node. should be at least the
+      number of threads sharing the client
+    - max_retries: times a request that timed out or failed to connect is retried on another
+      connection
+
+    The timeout and pool size can be overridden with the ES_<CONTEXT>_TIMEOUT_SECONDS and
+    ES_<CONTEXT>_POOL_SIZE settings.
+"""
+
+REQUEST_TIMEOUTS = {
+    'bulk': 120,
+    'maintenance': 600,
+}
+"""
+    request_timeout (in seconds) we pass to operations that take longer than the client's default:
+    - bulk: each bulk request of a streaming_bulk or parallel_bulk
+    - maintenance: synchronous update_by_query and delete_by_query requests
+"""
+
+_clients: Dict[str, Elasticsearch] = {}
+_clients_lock = threading.Lock()
+
+
+def get_db(context:str='script') -> Elasticsearch:
+    """
+        Returns this process's client for the given context, creating it on first use
+
+        Request bodies are gzipped (and ES gzips its responses) if the ES_HTTP_COMPRESS setting is
+        true. Worth it for our bulk traffic, which is mostly log text.
+
+        @precondition: context in CONTEXTS
+    """
+    assert context in CONTEXTS, (context, CONTEXTS)
+    with _clients_lock:
+        if context not in _clients:
+            _clients[context] = _create_client(context)
+        return _clients[context]
+
+
+def _create_client(context:str) -> Elasticsearch:
+    settings = CONTEXTS[context]
+    return Elasticsearch(
+        [config_util.get('ES_ADDRESS')],
+        ca_certs=certifi.where(),
+        timeout=_get_setting('ES_%s_TIMEOUT_SECONDS' % context.upper(), settings['timeout']),
+        maxsize=_get_setting('ES_%s_POOL_SIZE' % context.upper(), settings['pool_size']),
+        max_retries=settings['max_retries'],
+        retry_on_timeout=settings['max_retries'] > 0,
+        http_compress=config_util.get('ES_HTTP_COMPRESS'),
+    )
+
+
+def _get_setting(key:str, default):
+    try:
+        return config_util.get(key)
+    except config_util.ConfigKeyNotFound:
+        return default
+
+
+def get_pool_metrics() -> Dict[str, dict]:
+    """
+        Describes the connection pools of every client this process has created
+
+        For each context, and each ES node its client talks to:
+        - pool_size: max number of connections kept open to the node
+        - open_connections: number of connections opened to the node so far
+        - idle_connections: number of open connections waiting in the pool
+        - requests: number of requests sent to the node
+        Plus dead_nodes: number of nodes the client has marked dead after failed requests.
+    """
+    with _clients_lock:
+        clients = dict(_clients)
+
+    res = {}
+    for context, es in sorted(clients.items()):
+        connection_pool = es.transport.connection_pool
+        nodes = {}
+        for connection in connection_pool.connections:
+            pool = connection.pool
+            nodes[connection.host] = {
+                "pool_size": pool.pool.maxsize,
+                "open_connections": pool.num_connections,
+                # urllib3 fills its queue with None placeholders for connections not opened yet
+                "idle_connections": sum(1 for conn in list(pool.pool.queue) if conn is not None),
+                "requests": pool.num_requests,
+            }
+        res[context] = {
+            "nodes": nodes,
+            "dead_nodes": len(getattr(connection_pool, 'dead_count', {})),
+        }
+    return res
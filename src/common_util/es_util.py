@@ -1,3 +1,10 @@
+import logging
+
+from opentracing_instrumentation.request_context import get_current_span
+
+
+logger = logging.getLogger()
+
 EXACT_MATCH = 100 # percent
 SIMILAR_MATCH = 98 # percent
 ALL_MATCH_LEVELS = set((
@@ -37,3 +44,41 @@ def generate_text_match_payload(text, fields_to_match_against, match_level):
             }
         }
     }
+
+
+MSEARCH_CHUNK_SIZE = 50
+"""
+    Max number of searches we send to ES in a single msearch request
+"""
+
+
+def msearch(es, tracer, index, doc_type, bodies, chunk_size=MSEARCH_CHUNK_SIZE):
+    """
+        Runs all the given search bodies against index/doc_type using as few msearch requests as
+        possible. Each msearch request gets its own tracing span.
+
+        A search that fails (for example, because the index doesn't exist) is logged and returned
+        as None.
+
+        @return: a list of raw ES search responses, in the same order as bodies
+    """
+    bodies = list(bodies)
+    root_span = get_current_span()
+    header = {"index": index, "type": doc_type}
+    responses = []
+    for start in range(0, len(bodies), chunk_size):
+        chunk = bodies[start:start + chunk_size]
+        request = []
+        for body in chunk:
+            request.append(header)
+            request.append(body)
+        with tracer.start_span('elasticsearch msearch', child_of=root_span) as span:
+            span.set_tag('num_searches', len(chunk))
+            raw_es_response = es.msearch(body=request)
+        for response in raw_es_response['responses']:
+            if 'error' in response:
+                logger.warning('search against %s failed: %s', index, response['error'])
+                responses.append(None)
+            else:
+                responses.append(response)
+    return responses
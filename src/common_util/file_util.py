@@ -0,0 +1,31 @@
+"""
+    Helpers for the files we keep outside of our databases (our traceback archive and ingest spool)
+"""
+import os
+
+
+def is_on_volume(path:str) -> bool:
+    """
+        Returns True if the given directory is on a mounted volume, rather than on the container's
+        own filesystem (which is gone once the container is replaced)
+
+        Relative paths resolve against our working directory, which is never a volume.
+    """
+    if not os.path.isabs(path):
+        return False
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path != os.path.sep
+
+
+def fsync_directory(path:str):
+    """
+        Syncs the given directory to disk, so the files we just renamed into it (or removed from
+        it) stay renamed if the machine goes down. Syncing a file doesn't sync its directory entry
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,149 @@
+"""
+    An in-process tier in front of our redis dogpile regions.
+
+    L{LocalCacheProxy} wraps a region's redis backend. Lookups check a small LRU of recently used
+    values first, so a process that asks for the same thing twice in a row skips both the redis
+    round trip and unpickling the value. Entries expire after a fixed time, whatever dogpile's own
+    expiration says, which bounds how stale a value can get if we miss an invalidation.
+
+    Values are shared by every caller in the process: callers must not modify what a cached
+    function returns.
+"""
+from typing import (
+    Callable,
+    Iterable,
+    List,
+    Optional,
+)
+import threading
+
+from dogpile.cache.api import NO_VALUE
+from dogpile.cache.proxy import ProxyBackend
+import cachetools
+
+
+class LocalCacheProxy(ProxyBackend):
+    """
+        Dogpile proxy backend that keeps up to max_size values in process memory, for up to
+        expiration_time seconds each
+
+        Writes go to both tiers. Deletes go to both tiers, and are passed to on_delete so other
+        processes can drop their copies too. on_use is called before every lookup, so the owner
+        can start listening for other processes' deletes once the tier is in use.
+    """
+    def __init__(self, max_size:int, expiration_time:int,
+                 on_delete:Optional[Callable[[List[str]], None]]=None,
+                 on_use:Optional[Callable[[], None]]=None):
+        super().__init__()
+        self._cache: cachetools.TTLCache = cachetools.TTLCache(
+            maxsize=max_size, ttl=expiration_time
+        )
+        self._lock = threading.Lock()
+        self._on_delete = on_delete
+        self._on_use = on_use
+        self._local_hits = 0
+        self._local_misses = 0
+        self._redis_hits = 0
+        self._redis_misses = 0
+
+    def get(self, key):
+        value = self._get_local(key)
+        if value is not NO_VALUE:
+            return value
+        value = self.proxied.get(key)
+        self._save_local({key: value})
+        return value
+
+    def get_multi(self, keys):
+        keys = list(keys)
+        values = [self._get_local(key) for key in keys]
+        missing_keys = [key for key, value in zip(keys, values) if value is NO_VALUE]
+        if missing_keys:
+            found = dict(zip(missing_keys, self.proxied.get_multi(missing_keys)))
+            self._save_local(found)
+            values = [
+                found[key] if value is NO_VALUE else value for key, value in zip(keys, values)
+            ]
+        return values
+
+    def set(self, key, value):
+        self.proxied.set(key, value)
+        self._set_local({key: value})
+
+    def set_multi(self, mapping):
+        self.proxied.set_multi(mapping)
+        self._set_local(mapping)
+
+    def delete(self, key):
+        self.delete_multi([key])
+
+    def delete_multi(self, keys):
+        keys = list(keys)
+        self.proxied.delete_multi(keys)
+        self.discard(keys)
+        if self._on_delete is not None:
+            self._on_delete(keys)
+
+    def discard(self, keys:Iterable[str]):
+        """
+            Drops the given keys from this process's tier only
+        """
+        with self._lock:
+            for key in keys:
+                self._cache.pop(key, None)
+
+    def clear(self):
+        """
+            Drops every value from this process's tier
+        """
+        with self._lock:
+            self._cache.clear()
+
+    def get_metrics(self) -> dict:
+        """
+            Returns the number of values in this process's tier, and the hits, misses and hit
+            ratio of each tier. A redis lookup only happens on a local miss
+        """
+        with self._lock:
+            return {
+                "size": len(self._cache),
+                "max_size": self._cache.maxsize,
+                "local": _get_tier_metrics(self._local_hits, self._local_misses),
+                "redis": _get_tier_metrics(self._redis_hits, self._redis_misses),
+            }
+
+    def _get_local(self, key):
+        if self._on_use is not None:
+            self._on_use()
+        with self._lock:
+            value = self._cache.get(key, NO_VALUE)
+            if value is NO_VALUE:
+                self._local_misses += 1
+            else:
+                self._local_hits += 1
+            return value
+
+    def _save_local(self, values_from_redis:dict):
+        """
+            Counts the redis lookups of the given values, and keeps the ones redis had
+        """
+        with self._lock:
+            for key, value in values_from_redis.items():
+                if value is NO_VALUE:
+                    self._redis_misses += 1
+                else:
+                    self._redis_hits += 1
+                    self._cache[key] = value
+
+    def _set_local(self, mapping:dict):
+        with self._lock:
+            for key, value in mapping.items():
+                self._cache[key] = value
+
+
+def _get_tier_metrics(hits:int, misses:int) -> dict:
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / (hits + misses) if hits + misses else None,
+    }
@@ -1,40 +1,128 @@
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+import json
 import logging
+import os
+import threading
+import time
 
 import dogpile.cache
 import redis
 
 from common_util import config_util
+from common_util.cache_serializer import SerializerProxy
+from common_util.dogpile_util import InstrumentedCacheRegion
+from common_util.local_cache import LocalCacheProxy
 
 USE_DOGPILE_CACHE = config_util.get('USE_DOGPILE_CACHE')
 REDIS_ADDRESS = config_util.get('REDIS_ADDRESS')
 REDIS = redis.StrictRedis(host=config_util.get('REDIS_ADDRESS'))
 
+GENERATION_KEY_TEMPLATE = 'dogpile-generation:%s'
+"""
+    Redis key of the generation counter of the dogpile region with the given prefix. Every key of
+    the region includes the current generation, so bumping the counter invalidates the whole region
+"""
+
+GENERATION_CACHE_SECONDS = 1.0
+"""
+    How long we reuse a region's generation before reading it from redis again. Another process's
+    invalidation may take this long to reach us. Our own invalidations apply immediately
+"""
+
+LOCAL_CACHE_SIZE = config_util.get('LOCAL_CACHE_SIZE')
+"""
+    Default max number of values each process keeps in memory for each dogpile region (see
+    L{LocalCacheProxy}). 0 turns the in-process tier off
+"""
+
+LOCAL_CACHE_SECONDS = config_util.get('LOCAL_CACHE_SECONDS')
+"""
+    Max number of seconds a value stays in a process's in-memory tier
+"""
+
+INVALIDATION_CHANNEL = 'dogpile-invalidation'
+"""
+    Redis pub/sub channel our processes announce their cache invalidations on, so every other
+    process drops its in-memory copies right away
+"""
+
+RESUBSCRIBE_SECONDS = 5
+"""
+    How long we wait to resubscribe to L{INVALIDATION_CHANNEL} after losing our connection
+"""
+
 
 logger = logging.getLogger()
 
+_local_caches: Dict[str, LocalCacheProxy] = {}
+"""
+    Dogpile region prefix -> the in-process tier of that region
+"""
+
+_subscriber_pid: Optional[int] = None
+"""
+    The process that started our L{INVALIDATION_CHANNEL} listener. Threads don't survive a fork,
+    so a forked worker starts its own
+"""
+_subscriber_lock = threading.Lock()
+
+_generations: Dict[str, Tuple[int, float]] = {}
+"""
+    Dogpile region prefix -> (generation, time.monotonic() we read it at)
+"""
+_generations_lock = threading.Lock()
+
+
+def make_dogpile_region(dogpile_region_prefix:str, expiration_time:int=60*15,
+                        redis_expiration_time:int=60*20, local_cache_size:Optional[int]=None):
+    """
+        Creates a dogpile region that caches in redis, with keys starting with the given prefix
+
+        Values are recomputed once they're older than expiration_time seconds, and dropped from
+        redis after redis_expiration_time seconds. Keys include the region's generation (see
+        L{force_redis_cache_invalidation}), so values from before an invalidation are never read
+        again and just wait for redis to expire them
 
-def make_dogpile_region(dogpile_region_prefix:str):
+        Up to local_cache_size values (L{LOCAL_CACHE_SIZE} by default) are also kept in process
+        memory, in front of redis. Redis stores values in the format of L{cache_serializer}
+
+        Cached functions get their keys and report their metrics as described in L{dogpile_util}
+    """
     if not USE_DOGPILE_CACHE:
-        dogpile_region = dogpile.cache.make_region().configure('dogpile.cache.null')
+        dogpile_region = InstrumentedCacheRegion(dogpile_region_prefix).configure(
+            'dogpile.cache.null'
+        )
         logger.info("dogpile cache turned off")
         return dogpile_region
 
     key_mangler_func = lambda key: (
-        "%s:%s" % (
+        "%s:%s:%s" % (
             dogpile_region_prefix,
+            get_generation(dogpile_region_prefix),
             dogpile.cache.util.sha1_mangle_key(key.encode('utf-8'))
         )
     )
 
-    dogpile_region = dogpile.cache.make_region(
-        key_mangler=key_mangler_func
-    ).configure(
+    dogpile_region = InstrumentedCacheRegion(
+        dogpile_region_prefix,
+        key_mangler=key_mangler_func,
+    )
+    dogpile_region.configure(
         'dogpile.cache.redis',
-        expiration_time=60*15,  # 15 minutes
+        expiration_time=expiration_time,
         arguments={
             'host': REDIS_ADDRESS,
-            'redis_expiration_time': 60*20,  # 20 minutes
-        }
+            'redis_expiration_time': redis_expiration_time,
+        },
+        # the in-process tier keeps decoded values, in front of the serializer
+        wrap=_make_local_cache(dogpile_region_prefix, local_cache_size) + [
+            SerializerProxy(on_dump=dogpile_region.observe_payload_size)
+        ],
     )
     logger.info("using dogpile cache from redis at %s", REDIS_ADDRESS)
 
@@ -45,7 +133,125 @@ def make_dogpile_region(dogpile_region_prefix:str):
 
 def force_redis_cache_invalidation(key_prefix:str):
     """
-        Given a key prefix, forces invalidation of those keys by deleting them from redis
+        Given a dogpile region's key prefix, invalidates every value cached in the region
+
+        A single INCR of the region's generation counter, whatever the size of the region (or of
+        the rest of redis). Announced on L{INVALIDATION_CHANNEL}, so every process drops its
+        in-memory copies too
+    """
+    generation = REDIS.incr(GENERATION_KEY_TEMPLATE % key_prefix)
+    _set_generation(key_prefix, generation)
+    REDIS.publish(
+        INVALIDATION_CHANNEL, json.dumps({"prefix": key_prefix, "generation": generation})
+    )
+
+
+def get_generation(key_prefix:str) -> int:
+    """
+        Returns the current generation of the dogpile region with the given key prefix. Regions
+        start at generation 0
+    """
+    now = time.monotonic()
+    with _generations_lock:
+        cached = _generations.get(key_prefix)
+    if cached is not None and now - cached[1] < GENERATION_CACHE_SECONDS:
+        return cached[0]
+
+    generation = int(REDIS.get(GENERATION_KEY_TEMPLATE % key_prefix) or 0)
+    with _generations_lock:
+        _generations[key_prefix] = (generation, now)
+    return generation
+
+
+def _set_generation(key_prefix:str, generation:int):
+    """
+        Records a region's new generation, and drops the region's in-memory values, which all
+        belong to older generations
+    """
+    with _generations_lock:
+        cached = _generations.get(key_prefix)
+        if cached is not None and cached[0] > generation:
+            return
+        _generations[key_prefix] = (generation, time.monotonic())
+    local_cache = _local_caches.get(key_prefix)
+    if local_cache is not None:
+        local_cache.clear()
+
+
+def _make_local_cache(key_prefix:str, local_cache_size:Optional[int]) -> List[LocalCacheProxy]:
+    """
+        Creates the in-process tier of a region, as a list of proxies for dogpile's wrap argument.
+        Empty if the tier is turned off
+    """
+    if local_cache_size is None:
+        local_cache_size = LOCAL_CACHE_SIZE
+    if not local_cache_size:
+        return []
+
+    local_cache = LocalCacheProxy(
+        local_cache_size,
+        LOCAL_CACHE_SECONDS,
+        on_delete=lambda keys: _publish_deletes(key_prefix, keys),
+        on_use=_start_subscriber,
+    )
+    _local_caches[key_prefix] = local_cache
+    return [local_cache]
+
+
+def _publish_deletes(key_prefix:str, keys:List[str]):
+    REDIS.publish(INVALIDATION_CHANNEL, json.dumps({"prefix": key_prefix, "keys": keys}))
+
+
+def _start_subscriber():
+    """
+        Starts this process's L{INVALIDATION_CHANNEL} listener, unless it's already running
+    """
+    global _subscriber_pid
+    if _subscriber_pid == os.getpid():
+        return
+    with _subscriber_lock:
+        if _subscriber_pid == os.getpid():
+            return
+        _subscriber_pid = os.getpid()
+        threading.Thread(
+            target=_listen_for_invalidations, name='dogpile-invalidation', daemon=True
+        ).start()
+
+
+def _listen_for_invalidations():
+    while True:
+        try:
+            pubsub = REDIS.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                _handle_invalidation(json.loads(message['data']))
+        except redis.exceptions.RedisError:
+            logger.warning(
+                'lost our subscription to %s. retrying in %s seconds',
+                INVALIDATION_CHANNEL, RESUBSCRIBE_SECONDS, exc_info=True
+            )
+        # we may have missed some invalidations
+        for local_cache in _local_caches.values():
+            local_cache.clear()
+        time.sleep(RESUBSCRIBE_SECONDS)
+
+
+def _handle_invalidation(message:dict):
+    if "generation" in message:
+        _set_generation(message["prefix"], message["generation"])
+        return
+    local_cache = _local_caches.get(message["prefix"])
+    if local_cache is not None:
+        local_cache.discard(message["keys"])
+
+
+def get_cache_metrics() -> Dict[str, dict]:
+    """
+        Describes the in-process tier of every dogpile region in this process: its size, and the
+        hits, misses and hit ratio of the in-process and redis tiers. See
+        L{LocalCacheProxy.get_metrics}
     """
-    for key in REDIS.scan_iter('%s*' % key_prefix):
-        REDIS.delete(key)
+    return {
+        key_prefix: local_cache.get_metrics()
+        for key_prefix, local_cache in sorted(_local_caches.items())
+    }
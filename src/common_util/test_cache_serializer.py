@@ -0,0 +1,99 @@
+import datetime
+import unittest
+
+from dogpile.cache.api import (
+    CachedValue,
+    NO_VALUE,
+)
+from dogpile.cache.backends.memory import MemoryBackend
+
+from common_util import (
+    cache_serializer,
+    testing_util,
+)
+from common_util.cache_serializer import SerializerProxy
+from lib.jira.jira_issue import JiraIssue
+
+
+EASTERN = datetime.timezone(datetime.timedelta(hours=-4))
+
+
+def make_traceback():
+    return testing_util.make_traceback(
+        700594297938165774, timestamp=datetime.datetime(2018, 4, 1, 3, 18, 39, tzinfo=EASTERN),
+        profile_name='profile', unloaded_fields=('raw_traceback_text', 'raw_full_text'),
+    )
+
+
+def make_jira_issue():
+    created = datetime.datetime(2018, 4, 1, 12, 0, 0, 123000, tzinfo=datetime.timezone.utc)
+    return JiraIssue(
+        'PPC-123', 'https://jira/PPC-123', 'summary', 'focus=700594297938165774', 'filtered',
+        'comments', 'comments filtered', 'Bug', 'someone', 'Open', created, created, ['label'],
+    )
+
+
+class TestCacheSerializer(unittest.TestCase):
+    def test_round_trip(self):
+        value = (
+            [make_traceback(), make_traceback()],
+            12,
+            {'PPC-123': make_jira_issue(), 'day': datetime.date(2018, 4, 1)},
+            {1: 'int keys', None: 1.5},
+        )
+        decoded = cache_serializer.loads(cache_serializer.dumps(value))
+
+        self.assertEqual(type(decoded), tuple)
+        tracebacks, count, issues, other = decoded
+        self.assertEqual(count, 12)
+        self.assertEqual(other, {1: 'int keys', None: 1.5})
+        self.assertEqual(issues['day'], datetime.date(2018, 4, 1))
+        self.assertEqual(issues['PPC-123'].document(), make_jira_issue().document())
+        self.assertEqual(tracebacks[0]._fields(), make_traceback()._fields())
+        self.assertEqual(tracebacks[0].origin_timestamp.utcoffset(), EASTERN.utcoffset(None))
+        # fields the query left out are still loaded on first access
+        self.assertEqual(
+            tracebacks[1]._unloaded_fields, frozenset(('raw_traceback_text', 'raw_full_text'))
+        )
+
+    def test_pickles_other_types(self):
+        value = [{'a set'}, make_traceback()]
+        data = cache_serializer.dumps(value)
+        encoding = data[len(cache_serializer.MAGIC) + 1:][:1]
+        self.assertEqual(encoding, cache_serializer.PICKLE_ENCODING)
+        decoded = cache_serializer.loads(data)
+        self.assertEqual(decoded[0], {'a set'})
+        self.assertEqual(decoded[1]._fields(), make_traceback()._fields())
+
+    def test_rejects_other_versions(self):
+        data = bytearray(cache_serializer.dumps([1, 2]))
+        data[len(cache_serializer.MAGIC)] = cache_serializer.VERSION + 1
+        with self.assertRaises(ValueError):
+            cache_serializer.loads(bytes(data))
+        with self.assertRaises(ValueError):
+            cache_serializer.loads(b'not ours')
+
+
+class TestSerializerProxy(unittest.TestCase):
+    def setUp(self):
+        self.redis = MemoryBackend({})
+        self.proxy = SerializerProxy().wrap(self.redis)
+
+    def test_round_trip(self):
+        metadata = {"ct": 1522555200.5, "v": 1}
+        self.proxy.set_multi({'a': CachedValue([make_jira_issue()], metadata)})
+        self.assertIsInstance(self.redis.get('a'), bytes)
+
+        value = self.proxy.get('a')
+        self.assertEqual(value.metadata, metadata)
+        self.assertEqual(value.payload[0].key, 'PPC-123')
+        self.assertEqual(self.proxy.get_multi(['b']), [NO_VALUE])
+
+    def test_ignores_stale_values(self):
+        data = bytearray(cache_serializer.dumps(([1], {"ct": 1, "v": 1})))
+        data[len(cache_serializer.MAGIC)] = 0
+        self.redis.set('old version', bytes(data))
+        self.redis.set('before our format', CachedValue([1], {"ct": 1, "v": 1}))
+        self.assertEqual(
+            self.proxy.get_multi(['old version', 'before our format']), [NO_VALUE, NO_VALUE]
+        )
@@ -0,0 +1,69 @@
+import datetime
+import unittest
+
+import prometheus_client
+
+from common_util import dogpile_util
+from common_util.cache_serializer import SerializerProxy
+
+
+def get_tracebacks(es, tracer, start_date=None, end_date=None, num_matches=100):
+    # pylint: disable=unused-argument
+    pass
+
+
+class TestFunctionKeyGenerator(unittest.TestCase):
+    def setUp(self):
+        self.generate_key = dogpile_util.function_key_generator(None, get_tracebacks)
+
+    def test_ignores_infrastructure(self):
+        day = datetime.date(2018, 4, 1)
+        self.assertEqual(
+            self.generate_key('es', None, day, day),
+            self.generate_key('other es', 'tracer', day, end_date=day, num_matches=100),
+        )
+        self.assertNotEqual(
+            self.generate_key('es', None, day, day),
+            self.generate_key('es', None, day, day, 50),
+        )
+
+    def test_canonical_arguments(self):
+        eastern = datetime.timezone(datetime.timedelta(hours=-4))
+        self.assertEqual(
+            self.generate_key(None, None, datetime.datetime(2018, 4, 1, 12, tzinfo=eastern)),
+            self.generate_key(
+                None, None, datetime.datetime(2018, 4, 1, 16, tzinfo=datetime.timezone.utc)
+            ),
+        )
+        self.assertEqual(
+            dogpile_util.canonicalize({'b', 'a'}), dogpile_util.canonicalize({'a', 'b'})
+        )
+        self.assertNotEqual(
+            dogpile_util.canonicalize(('a b', 'c')), dogpile_util.canonicalize(('a', 'b c'))
+        )
+
+
+class TestInstrumentedCacheRegion(unittest.TestCase):
+    def test_hits_and_misses(self):
+        region = dogpile_util.InstrumentedCacheRegion('dogpile:test-region')
+        region.configure(
+            'dogpile.cache.memory',
+            wrap=[SerializerProxy(on_dump=region.observe_payload_size)],
+        )
+        calls = []
+
+        @region.cache_on_arguments()
+        def double(es, value): # pylint: disable=unused-argument
+            calls.append(value)
+            return value * 2
+
+        labels = {"region": 'dogpile:test-region', "function": 'test_dogpile_util.double'}
+        self.assertEqual(double('es', 2), 4)
+        self.assertEqual(double('other es', 2), 4)
+        self.assertEqual(calls, [2])
+        self.assertEqual(self._get_sample('dogpile_cache_misses_total', labels), 1)
+        self.assertEqual(self._get_sample('dogpile_cache_hits_total', labels), 1)
+        self.assertEqual(self._get_sample('dogpile_cache_payload_bytes_count', labels), 1)
+
+    def _get_sample(self, name, labels):
+        return prometheus_client.REGISTRY.get_sample_value(name, labels)
@@ -0,0 +1,40 @@
+import unittest
+
+from dogpile.cache.api import NO_VALUE
+from dogpile.cache.backends.memory import MemoryBackend
+
+from common_util.local_cache import LocalCacheProxy
+
+
+class TestLocalCacheProxy(unittest.TestCase):
+    def setUp(self):
+        self.deleted = []
+        self.redis = MemoryBackend({})
+        self.proxy = LocalCacheProxy(2, 60, on_delete=self.deleted.extend).wrap(self.redis)
+
+    def test_lookups(self):
+        self.redis.set('a', 1)
+        self.assertEqual(self.proxy.get('a'), 1)
+        self.assertEqual(self.proxy.get('a'), 1)
+        self.assertEqual(self.proxy.get_multi(['a', 'b']), [1, NO_VALUE])
+        metrics = self.proxy.get_metrics()
+        self.assertEqual(metrics['local'], {"hits": 2, "misses": 2, "hit_ratio": 0.5})
+        self.assertEqual(metrics['redis'], {"hits": 1, "misses": 1, "hit_ratio": 0.5})
+
+        # we keep our copy until it's deleted
+        self.redis.set('a', 2)
+        self.assertEqual(self.proxy.get('a'), 1)
+        self.proxy.discard(['a'])
+        self.assertEqual(self.proxy.get('a'), 2)
+
+    def test_writes(self):
+        self.proxy.set_multi({'a': 1, 'b': 2})
+        self.assertEqual(self.redis.get('b'), 2)
+        self.proxy.delete('a')
+        self.assertEqual(self.redis.get('a'), NO_VALUE)
+        self.assertEqual(self.proxy.get('a'), NO_VALUE)
+        self.assertEqual(self.deleted, ['a'])
+
+    def test_size_limit(self):
+        self.proxy.set_multi({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(self.proxy.get_metrics()['size'], 2)
@@ -0,0 +1,48 @@
+import unittest
+
+from common_util import redis_util
+from common_util.testing_util import FakeRedis
+
+
+class TestGenerations(unittest.TestCase):
+    def setUp(self):
+        self.original_redis = redis_util.REDIS
+        redis_util.REDIS = FakeRedis()
+        redis_util._generations.clear()
+
+    def tearDown(self):
+        redis_util.REDIS = self.original_redis
+        redis_util._generations.clear()
+
+    def test_invalidation(self):
+        self.assertEqual(redis_util.get_generation('dogpile:test'), 0)
+        redis_util.force_redis_cache_invalidation('dogpile:test')
+        self.assertEqual(redis_util.get_generation('dogpile:test'), 1)
+        self.assertEqual(redis_util.get_generation('dogpile:test-other'), 0)
+        self.assertEqual(redis_util.REDIS.messages, [
+            (redis_util.INVALIDATION_CHANNEL, {"prefix": 'dogpile:test', "generation": 1})
+        ])
+
+    def test_other_processes_invalidation(self):
+        """
+            We reuse the generation we read for a moment, and then see the new one
+        """
+        self.assertEqual(redis_util.get_generation('dogpile:test'), 0)
+        redis_util.REDIS.incr(redis_util.GENERATION_KEY_TEMPLATE % 'dogpile:test')
+        self.assertEqual(redis_util.get_generation('dogpile:test'), 0)
+        generation, read_at = redis_util._generations['dogpile:test']
+        redis_util._generations['dogpile:test'] = (
+            generation, read_at - redis_util.GENERATION_CACHE_SECONDS
+        )
+        self.assertEqual(redis_util.get_generation('dogpile:test'), 1)
+
+    def test_announced_invalidation(self):
+        """
+            Other processes announce their invalidations, which reach us right away
+        """
+        self.assertEqual(redis_util.get_generation('dogpile:test'), 0)
+        redis_util._handle_invalidation({"prefix": 'dogpile:test', "generation": 3})
+        self.assertEqual(redis_util.get_generation('dogpile:test'), 3)
+        # an announcement that arrives late doesn't take us back
+        redis_util._handle_invalidation({"prefix": 'dogpile:test', "generation": 2})
+        self.assertEqual(redis_util.get_generation('dogpile:test'), 3)
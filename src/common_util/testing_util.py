@@ -0,0 +1,55 @@
+"""
+    Fakes and factories shared by our unit tests
+"""
+import datetime
+import json
+
+from lib.traceback.traceback import Traceback
+
+
+TRACEBACK_TEXT = 'Traceback (most recent call last):\nKeyError: 1'
+
+TIMESTAMP = datetime.datetime(2018, 4, 1, 10, tzinfo=datetime.timezone.utc)
+
+
+class FakeRedis():
+    """
+        The parts of a redis client our caches use, kept in a dict. The expiry each key was set
+        with is kept in `expirations`, and published messages are decoded and kept in `messages`
+    """
+    def __init__(self):
+        self.values = {}
+        self.expirations = {}
+        self.messages = []
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        self.expirations[key] = ex
+        return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+        self.expirations.pop(key, None)
+
+    def incr(self, key):
+        self.values[key] = self.values.get(key, 0) + 1
+        return self.values[key]
+
+    def publish(self, channel, message):
+        self.messages.append((channel, json.loads(message)))
+
+
+def make_traceback(id_, text:str=TRACEBACK_TEXT, timestamp:datetime.datetime=TIMESTAMP, **kwargs
+) -> Traceback:
+    """
+        Creates a L{Traceback} with the given papertrail id, whose texts are all the given text.
+        Other keyword arguments are passed on to Traceback
+    """
+    return Traceback(
+        text, text, text, text, id_, timestamp, 'i-2ee330b7', 'manager.debug', **kwargs
+    )
@@ -1,4 +1,5 @@
 import datetime
+import typing
 
 
 def round_time(dt=None, date_delta=datetime.timedelta(minutes=1), to='average'):
@@ -22,3 +23,16 @@ def round_time(dt=None, date_delta=datetime.timedelta(minutes=1), to='average'):
         rounding = (seconds + round_to / 2) // round_to * round_to
 
     return dt + datetime.timedelta(0, rounding - seconds, -dt.microsecond)
+
+
+def get_months(start_date:datetime.date, end_date:datetime.date
+) -> typing.List[typing.Tuple[int, int]]:
+    """
+        Returns the (year, month) of every month between start_date and end_date, inclusive
+    """
+    months = []
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
@@ -82,7 +82,7 @@ class ApiCall():
 
         # We get the datetime as a string, we need to parse it out
         timestamp = datetime.datetime.strptime(
-            source["origin_timestamp"],
+            source["timestamp"],
             '%Y-%m-%dT%H:%M:%S%z'
         )
 
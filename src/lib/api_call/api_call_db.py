@@ -1,15 +1,31 @@
 """
     Utility functions for performing actions on our api call ES database.
 
+    API calls are our highest-volume document type. Their indices get their mappings from the
+    'api-calls' index template (see scripts/es_mappings/api_call_index_template.json).
+
     For all functions, `es` must be an instance of Elasticsearch
 """
+from typing import (
+    Iterable,
+    List,
+    Tuple,
+)
 import collections
+import collections.abc
+import datetime
 import logging
+import time
 
 import elasticsearch
 import elasticsearch.helpers
 
-from common_util import retry
+from common_util import (
+    config_util,
+    elasticsearch_config,
+    retry,
+    time_util,
+)
 
 
 INDEX_TEMPLATE = 'api-call-%04d-%02d'
@@ -20,20 +36,95 @@ INDEX_TEMPLATE = 'api-call-%04d-%02d'
 """
 DOC_TYPE = 'api-call'
 
+BULK_CHUNK_SIZE = config_util.get('API_CALL_BULK_CHUNK_SIZE')
+"""
+    Default number of api calls we send to ES in a single bulk request
+"""
+
+BULK_THREAD_COUNT = config_util.get('API_CALL_BULK_THREAD_COUNT')
+"""
+    Default number of bulk requests we send to ES at the same time
+"""
+
+REJECTED_STATUS = 429
+"""
+    Status ES gives an item it couldn't index because its bulk queue was full
+"""
+
 logger = logging.getLogger()
 
 
 @retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,
                          elasticsearch.ElasticsearchException))
-def save(es, api_calls):
+def save(es, api_calls:Iterable, chunk_size:int=BULK_CHUNK_SIZE,
+         thread_count:int=BULK_THREAD_COUNT) -> Tuple[int, List[dict]]:
     """
         Takes an iterable of L{ApiCall} and saves them to the database
 
-        Returns True if successful
+        Sends L{thread_count} bulk requests of L{chunk_size} api calls at a time. Items ES rejects
+        because it's overloaded are sent again (with backoff) once the rest are done. Any other
+        failed item is logged and returned to the caller.
+
+        Logs how many api calls we saved per second, and how many were rejected.
+
+        Returns a tuple of (number of api calls saved, list of per-item error dicts from ES)
+    """
+    assert isinstance(api_calls, collections.abc.Iterable), (type(api_calls), api_calls)
+    api_calls_by_id = collections.OrderedDict(
+        (str(api_call.papertrail_id), api_call) for api_call in api_calls
+    )
+
+    start_time = time.monotonic()
+    num_saved = 0
+    rejected_api_calls = []
+    errors = []
+    for ok, item in elasticsearch.helpers.parallel_bulk(
+            es,
+            _create_documents(api_calls_by_id.values()),
+            thread_count=thread_count,
+            chunk_size=chunk_size,
+            raise_on_error=False,
+            request_timeout=elasticsearch_config.REQUEST_TIMEOUTS['bulk'],
+    ):
+        if ok:
+            num_saved += 1
+        elif item['index'].get('status') == REJECTED_STATUS:
+            rejected_api_calls.append(api_calls_by_id[str(item['index']['_id'])])
+        else:
+            logger.error('failed to save api call: %s', item)
+            errors.append(item)
+
+    if rejected_api_calls:
+        # streaming_bulk retries rejected items itself, backing off between tries
+        for ok, item in elasticsearch.helpers.streaming_bulk(
+                es,
+                _create_documents(rejected_api_calls),
+                chunk_size=chunk_size,
+                raise_on_error=False,
+                max_retries=5,
+                request_timeout=elasticsearch_config.REQUEST_TIMEOUTS['bulk'],
+        ):
+            if ok:
+                num_saved += 1
+            else:
+                logger.error('failed to save api call: %s', item)
+                errors.append(item)
+
+    duration = time.monotonic() - start_time
+    logger.info(
+        'saved %s api calls in %.1fs (%.0f docs/sec). %s rejected by ES, %s failed',
+        num_saved, duration, num_saved / duration if duration else 0, len(rejected_api_calls),
+        len(errors),
+    )
+    return num_saved, errors
+
+
+def get_indices_for_date_range(start_date:datetime.date, end_date:datetime.date) -> List[str]:
+    """
+        Returns the names of the indices that api calls from start_date to end_date (inclusive) are
+        written to. The indices may not exist yet
     """
-    assert isinstance(api_calls, collections.Iterable), (type(api_calls), api_calls)
-    elasticsearch.helpers.bulk(es, _create_documents(api_calls))
-    return True
+    return [INDEX_TEMPLATE % month for month in time_util.get_months(start_date, end_date)]
 
 
 def _create_documents(api_calls):
@@ -6,6 +6,7 @@ from lib.jira import (
 )
 from lib.traceback import (
     traceback_db,
+    traceback_group_db,
 )
 import tasks
 
@@ -20,6 +21,8 @@ def invalidate_cache(cache:Optional[str]):
     if cache is None or cache == 'traceback':
         logger.info('invalidating traceback cache')
         traceback_db.invalidate_cache()
+        traceback_group_db.invalidate_cache()
+        traceback_db.invalidate_timeseries_cache()
     if cache is None or cache == 'jira':
         logger.info('invalidating jira cache')
         jira_issue_db.invalidate_cache()
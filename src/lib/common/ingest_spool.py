@@ -0,0 +1,335 @@
+"""
+    A write-ahead spool for the tracebacks and api calls we parse, for when ES can't take them.
+
+    L{save_tracebacks} and L{save_api_calls} write straight to ES while it's healthy. If ES is
+    down, timing out or rejecting writes, the batch (or just the items ES rejected) is written to
+    a segment file in L{SPOOL_PATH} instead, and for the next L{BACKOFF_SECONDS} we spool every
+    batch without trying ES at all. Parsing keeps going at full speed through an ES brownout.
+
+    Each segment is one batch: gzipped JSON lines, written under a temporary name, synced to disk
+    and renamed into place. Segments are never modified. L{drain} replays them into ES, oldest
+    first, and deletes each once it's saved. Our celery beat drains the spool every
+    L{DRAIN_INTERVAL_SECONDS}.
+
+    Replaying a segment twice must do no harm. Traceback and api call documents are keyed by
+    papertrail id, so saving them twice is fine, but adding a traceback to its group adds to the
+    group's counts. So we save tracebacks in stages, and spool each stage on its own: we index
+    their documents, then add the new ones to their groups ('traceback_groups' segments), then
+    register the jira queries of their signatures ('traceback_queries' segments). The group stage
+    claims each traceback's occurrence before it counts it (see
+    L{traceback_group_db.add_occurrences}), so replaying it skips the tracebacks that were counted
+    before ES failed.
+"""
+from typing import (
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+import contextlib
+import fcntl
+import gzip
+import json
+import logging
+import os
+import time
+
+import elasticsearch
+
+from common_util import (
+    config_util,
+    file_util,
+)
+from lib.api_call import api_call_db
+from lib.api_call.api_call import ApiCall
+from lib.traceback import traceback_db
+from lib.traceback.traceback import (
+    Traceback,
+    generate_traceback_from_source,
+)
+
+
+SPOOL_PATH = config_util.get('INGEST_SPOOL_PATH')
+"""
+    Directory we keep the spooled segments in. Must be on a volume our workers share (the
+    kubernetes data volume, mounted at /data), so the segments outlive the pod that spooled them
+    and any worker can drain them
+"""
+
+DRAIN_INTERVAL_SECONDS = 60
+"""
+    How often our celery beat drains the spool
+"""
+
+BACKOFF_SECONDS = 60
+"""
+    How long we spool without trying ES after it failed a write
+"""
+
+UNAVAILABLE_STATUSES = (429, 503)
+"""
+    HTTP statuses ES answers with when it's overloaded or has no master. Writes that fail with
+    these are spooled. Any other failure is a problem with the document, and is returned to the
+    caller as before
+"""
+
+LOCK_FILE = '.drain.lock'
+
+logger = logging.getLogger()
+
+
+def _save_tracebacks(es, tracebacks:List[Traceback]) -> Tuple[int, List[dict]]:
+    """
+        Saves the given tracebacks' documents, then adds the new ones to their groups. If ES can't
+        take the group stage, we spool it alone
+    """
+    saved_tracebacks, new_tracebacks, errors = traceback_db.index_tracebacks(es, tracebacks)
+    _save_or_spool('traceback_groups', es, new_tracebacks)
+    return len(saved_tracebacks), errors
+
+
+def _replay_tracebacks(es, tracebacks:List[Traceback]) -> Tuple[int, List[dict]]:
+    """
+        L{_save_tracebacks}, for a spooled batch. ES may have indexed some of the batch before it
+        failed, and those aren't new to it now. So we add every saved traceback to its group, and
+        leave it to the occurrence claims to skip the ones that were counted already
+    """
+    saved_tracebacks, _, errors = traceback_db.index_tracebacks(es, tracebacks)
+    _save_or_spool('traceback_groups', es, saved_tracebacks)
+    return len(saved_tracebacks), errors
+
+
+def _add_to_groups(es, tracebacks:List[Traceback]) -> Tuple[int, List[dict]]:
+    """
+        Adds the given tracebacks to their groups, then registers the queries of the ones we added.
+        If ES can't take the query stage, we spool it alone
+    """
+    num_added, errors = traceback_db.add_to_groups(es, tracebacks)
+    _save_or_spool('traceback_queries', es, traceback_db.get_grouped(tracebacks, errors))
+    return num_added, errors
+
+
+def _register_queries(es, tracebacks:List[Traceback]) -> Tuple[int, List[dict]]:
+    traceback_db.register_queries(es, tracebacks)
+    return len(tracebacks), []
+
+
+KINDS = {
+    'tracebacks': (
+        _save_tracebacks,
+        _replay_tracebacks,
+        lambda traceback: traceback.origin_papertrail_id,
+        generate_traceback_from_source,
+    ),
+    'traceback_groups': (
+        _add_to_groups,
+        _add_to_groups,
+        lambda traceback: traceback.origin_papertrail_id,
+        generate_traceback_from_source,
+    ),
+    'traceback_queries': (
+        _register_queries,
+        _register_queries,
+        lambda traceback: traceback.origin_papertrail_id,
+        generate_traceback_from_source,
+    ),
+    'api_calls': (
+        api_call_db.save,
+        api_call_db.save,
+        lambda api_call: api_call.papertrail_id,
+        ApiCall.generate_from_source,
+    ),
+}
+"""
+    For each kind of item we spool: the function that saves a batch of them to ES, the function
+    that saves a batch of them we spooled, the function that returns an item's papertrail id, and
+    the function that decodes an item's document.
+    'traceback_groups' segments hold tracebacks that are already indexed, and only need adding to
+    their groups. 'traceback_queries' segments hold tracebacks that are already in their groups,
+    and only need their queries registered
+"""
+
+_unavailable_until = 0.0
+"""
+    time.monotonic() until which we spool without trying ES
+"""
+
+
+def save_tracebacks(es, tracebacks:Iterable) -> Tuple[int, int, List[dict]]:
+    """
+        Saves the given tracebacks like L{traceback_db.save_tracebacks} does, or spools them if
+        ES can't take them
+
+        Returns a tuple of (number saved, number spooled, list of per-item error dicts from ES)
+    """
+    return _save_or_spool('tracebacks', es, tracebacks)
+
+
+def save_api_calls(es, api_calls:Iterable) -> Tuple[int, int, List[dict]]:
+    """
+        Saves the given api calls with L{api_call_db.save}, or spools them if ES can't take them
+
+        Returns a tuple of (number saved, number spooled, list of per-item error dicts from ES)
+    """
+    return _save_or_spool('api_calls', es, api_calls)
+
+
+def _save_or_spool(kind:str, es, items:Iterable) -> Tuple[int, int, List[dict]]:
+    items = list(items)
+    if not items:
+        return 0, 0, []
+    if _is_backing_off():
+        _spool(kind, items)
+        return 0, len(items), []
+
+    num_saved, errors, unsaved_items = _save(kind, es, items)
+    if unsaved_items:
+        _spool(kind, unsaved_items)
+    return num_saved, len(unsaved_items), errors
+
+
+def _save(kind:str, es, items:list, replay:bool=False) -> Tuple[int, List[dict], list]:
+    """
+        Saves the given items to ES. If replay is True, they're from a segment we spooled
+
+        Returns a tuple of (number saved, per-item errors we can't retry, items ES couldn't take).
+        Backs off if ES couldn't take any of them
+    """
+    save, replay_save, get_id, _ = KINDS[kind]
+    if replay:
+        save = replay_save
+    try:
+        num_saved, errors = save(es, items)
+    except elasticsearch.exceptions.TransportError as e:
+        if not _is_unavailable_error(e):
+            raise
+        logger.warning('elasticsearch is unavailable (%s). spooling %s %s', e, len(items), kind)
+        _back_off()
+        return 0, [], items
+
+    rejected_ids = set()
+    remaining_errors = []
+    for error in errors:
+        item = next(iter(error.values()))
+        if item.get('status') in UNAVAILABLE_STATUSES:
+            rejected_ids.add(str(item['_id']))
+        else:
+            remaining_errors.append(error)
+    if not rejected_ids:
+        return num_saved, remaining_errors, []
+
+    logger.warning('elasticsearch rejected %s %s. spooling them', len(rejected_ids), kind)
+    _back_off()
+    return num_saved, remaining_errors, [
+        item for item in items if str(get_id(item)) in rejected_ids
+    ]
+
+
+def _is_unavailable_error(e:elasticsearch.exceptions.TransportError) -> bool:
+    return (
+        isinstance(e, elasticsearch.exceptions.ConnectionError)
+        or e.status_code in UNAVAILABLE_STATUSES
+    )
+
+
+def _is_backing_off() -> bool:
+    return time.monotonic() < _unavailable_until
+
+
+def _back_off():
+    global _unavailable_until
+    _unavailable_until = time.monotonic() + BACKOFF_SECONDS
+
+
+def _spool(kind:str, items:list, path:str=SPOOL_PATH) -> str:
+    """
+        Writes the given items to a new segment
+
+        Returns the segment's file name
+    """
+    if not file_util.is_on_volume(path):
+        logger.warning(
+            'ingest spool %s is not on a persistent volume. spooled %s are lost with the container',
+            path, kind,
+        )
+    os.makedirs(path, exist_ok=True)
+    name = '%020d-%s-%s.jsonl.gz' % (int(time.time() * 10**9), os.getpid(), kind)
+    tmp_path = os.path.join(path, '.%s.tmp' % name)
+    with open(tmp_path, 'wb') as f:
+        with gzip.GzipFile(fileobj=f, mode='wb') as gzip_file:
+            for item in items:
+                gzip_file.write((json.dumps(item.document()) + '\n').encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(path, name))
+    file_util.fsync_directory(path)
+    logger.info('spooled %s %s to %s', len(items), kind, name)
+    return name
+
+
+def get_segments(path:str=SPOOL_PATH) -> List[str]:
+    """
+        Returns the file names of the spooled segments, oldest first
+    """
+    try:
+        names = os.listdir(path)
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if name.endswith('.jsonl.gz') and name[0] != '.')
+
+
+def drain(es, max_segments:Optional[int]=None, path:str=SPOOL_PATH) -> int:
+    """
+        Replays the spooled segments into ES, oldest first, deleting each one once it's saved
+
+        Stops at the first segment ES can't take, and backs off like our saves do. Items ES
+        rejected are spooled again in a new segment. Does nothing while we're backing off, or if
+        another drain already holds the spool's lock.
+
+        Returns the number of items saved
+    """
+    if _is_backing_off():
+        return 0
+    with _lock(path) as locked:
+        if not locked:
+            logger.info('ingest spool is already being drained')
+            return 0
+
+        total_saved = 0
+        for name in get_segments(path)[:max_segments]:
+            kind = name[:-len('.jsonl.gz')].split('-', 2)[2]
+            segment_path = os.path.join(path, name)
+            with gzip.open(segment_path, 'rt') as f:
+                items = [KINDS[kind][3](json.loads(line)) for line in f]
+            num_saved, errors, unsaved_items = _save(kind, es, items, replay=True)
+            total_saved += num_saved
+            for error in errors:
+                logger.error('failed to save spooled %s: %s', kind, error)
+            if unsaved_items and len(unsaved_items) == len(items):
+                break
+            if unsaved_items:
+                _spool(kind, unsaved_items, path)
+            os.remove(segment_path)
+            file_util.fsync_directory(path)
+            logger.info('replayed %s spooled %s from %s', num_saved, kind, name)
+            if unsaved_items:
+                break
+        return total_saved
+
+
+@contextlib.contextmanager
+def _lock(path:str):
+    """
+        Takes the spool's drain lock without waiting. Yields whether we got it
+    """
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, LOCK_FILE), 'w') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,169 @@
+import tempfile
+import unittest
+
+import elasticsearch
+
+from common_util.testing_util import make_traceback
+from lib.common import ingest_spool
+
+
+class TestIngestSpool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+        self.saved = []
+        self.failure = None
+        _, _, get_id, generate_from_source = ingest_spool.KINDS['tracebacks']
+        self.original_kind = ingest_spool.KINDS['tracebacks']
+        ingest_spool.KINDS['tracebacks'] = (self.save, self.save, get_id, generate_from_source)
+        ingest_spool._unavailable_until = 0.0
+
+    def tearDown(self):
+        ingest_spool.KINDS['tracebacks'] = self.original_kind
+        ingest_spool._unavailable_until = 0.0
+        self.directory.cleanup()
+
+    def save(self, _es, tracebacks):
+        if self.failure is not None:
+            raise self.failure
+        self.saved.extend(tb.origin_papertrail_id for tb in tracebacks)
+        return len(tracebacks), []
+
+    def test_drain(self):
+        ingest_spool._spool('tracebacks', [make_traceback(1), make_traceback(2)], self.path)
+        ingest_spool._spool('tracebacks', [make_traceback(3)], self.path)
+        self.assertEqual(len(ingest_spool.get_segments(self.path)), 2)
+
+        self.failure = elasticsearch.exceptions.ConnectionTimeout('TIMEOUT', 'timed out', None)
+        self.assertEqual(ingest_spool.drain(None, path=self.path), 0)
+        self.assertTrue(ingest_spool._is_backing_off())
+        self.assertEqual(len(ingest_spool.get_segments(self.path)), 2)
+
+        self.failure = None
+        ingest_spool._unavailable_until = 0.0
+        self.assertEqual(ingest_spool.drain(None, path=self.path), 3)
+        self.assertEqual(self.saved, [1, 2, 3])
+        self.assertEqual(ingest_spool.get_segments(self.path), [])
+
+    def test_other_errors_are_raised(self):
+        self.failure = elasticsearch.exceptions.RequestError(400, 'mapper_parsing_exception', {})
+        with self.assertRaises(elasticsearch.exceptions.RequestError):
+            ingest_spool._save('tracebacks', None, [make_traceback(1)])
+        self.assertFalse(ingest_spool._is_backing_off())
+
+
+class TestTracebackGroupStage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.original_index_tracebacks = ingest_spool.traceback_db.index_tracebacks
+        self.original_add_to_groups = ingest_spool.traceback_db.add_to_groups
+        self.original_register_queries = ingest_spool.traceback_db.register_queries
+        self.original_spool = ingest_spool._spool
+        ingest_spool._spool = lambda kind, items, path=self.directory.name: (
+            self.original_spool(kind, items, path)
+        )
+        ingest_spool.traceback_db.index_tracebacks = self.index_tracebacks
+        ingest_spool.traceback_db.add_to_groups = self.add_to_groups
+        ingest_spool.traceback_db.register_queries = self.register_queries
+        ingest_spool._unavailable_until = 0.0
+        self.indexed = []
+        self.grouped = []
+        self.registered = []
+        self.group_failure = None
+        self.unavailable_group_ids = set()
+        self.query_failure = None
+        self.existing_ids = set()
+
+    def tearDown(self):
+        ingest_spool._spool = self.original_spool
+        ingest_spool.traceback_db.index_tracebacks = self.original_index_tracebacks
+        ingest_spool.traceback_db.add_to_groups = self.original_add_to_groups
+        ingest_spool.traceback_db.register_queries = self.original_register_queries
+        ingest_spool._unavailable_until = 0.0
+        self.directory.cleanup()
+
+    def index_tracebacks(self, _es, tracebacks):
+        new_tracebacks = [
+            tb for tb in tracebacks if tb.origin_papertrail_id not in self.existing_ids
+        ]
+        self.indexed.extend(tb.origin_papertrail_id for tb in tracebacks)
+        self.existing_ids.update(tb.origin_papertrail_id for tb in tracebacks)
+        return list(tracebacks), new_tracebacks, []
+
+    def add_to_groups(self, _es, tracebacks):
+        if self.group_failure is not None:
+            raise self.group_failure
+        errors = []
+        for tb in tracebacks:
+            if tb.origin_papertrail_id in self.unavailable_group_ids:
+                errors.append({"update": {"_id": str(tb.origin_papertrail_id), "status": 503}})
+            else:
+                self.grouped.append(tb.origin_papertrail_id)
+        return len(tracebacks) - len(errors), errors
+
+    def register_queries(self, _es, tracebacks):
+        if self.query_failure is not None:
+            raise self.query_failure
+        self.registered.extend(tb.origin_papertrail_id for tb in tracebacks)
+
+    def get_segment_kinds(self):
+        return [
+            name[:-len('.jsonl.gz')].split('-', 2)[2]
+            for name in ingest_spool.get_segments(self.directory.name)
+        ]
+
+    def test_replay_after_group_failure_counts_once(self):
+        self.group_failure = elasticsearch.exceptions.ConnectionTimeout(
+            'TIMEOUT', 'timed out', None
+        )
+        self.assertEqual(
+            ingest_spool.save_tracebacks(None, [make_traceback(1), make_traceback(2)]), (2, 0, [])
+        )
+        segments = ingest_spool.get_segments(self.directory.name)
+        self.assertEqual(len(segments), 1)
+        self.assertTrue(segments[0].endswith('-traceback_groups.jsonl.gz'))
+
+        self.group_failure = None
+        ingest_spool._unavailable_until = 0.0
+        self.assertEqual(ingest_spool.drain(None, path=self.directory.name), 2)
+        self.assertEqual(self.indexed, [1, 2])
+        self.assertEqual(self.grouped, [1, 2])
+        self.assertEqual(ingest_spool.get_segments(self.directory.name), [])
+
+    def test_only_new_tracebacks_are_grouped(self):
+        self.existing_ids.add(1)
+        ingest_spool.save_tracebacks(None, [make_traceback(1), make_traceback(2)])
+        self.assertEqual(self.indexed, [1, 2])
+        self.assertEqual(self.grouped, [2])
+
+    def test_replayed_tracebacks_are_all_grouped(self):
+        # ES indexed the first traceback before it failed the batch
+        self.existing_ids.add(1)
+        ingest_spool._spool('tracebacks', [make_traceback(1), make_traceback(2)])
+        self.assertEqual(ingest_spool.drain(None, path=self.directory.name), 2)
+        # the occurrence claims skip the tracebacks that were already counted
+        self.assertEqual(self.grouped, [1, 2])
+
+    def test_rejected_group_updates_are_spooled(self):
+        self.unavailable_group_ids.add(2)
+        ingest_spool.save_tracebacks(None, [make_traceback(1), make_traceback(2)])
+        self.assertEqual(self.grouped, [1])
+        self.assertEqual(self.registered, [1])
+        self.assertEqual(self.get_segment_kinds(), ['traceback_groups'])
+
+        self.unavailable_group_ids.clear()
+        ingest_spool._unavailable_until = 0.0
+        self.assertEqual(ingest_spool.drain(None, path=self.directory.name), 1)
+        self.assertEqual(self.grouped, [1, 2])
+        self.assertEqual(self.registered, [1, 2])
+
+    def test_query_failure_only_spools_queries(self):
+        self.query_failure = elasticsearch.exceptions.ConnectionError('N/A', 'refused', None)
+        ingest_spool.save_tracebacks(None, [make_traceback(1), make_traceback(2)])
+        self.assertEqual(self.get_segment_kinds(), ['traceback_queries'])
+
+        self.query_failure = None
+        ingest_spool._unavailable_until = 0.0
+        self.assertEqual(ingest_spool.drain(None, path=self.directory.name), 2)
+        self.assertEqual(self.grouped, [1, 2])
+        self.assertEqual(self.registered, [1, 2])
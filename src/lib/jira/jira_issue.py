@@ -1,5 +1,23 @@
-from typing import List
+from typing import (
+    Iterable,
+    List,
+    Optional,
+)
 import datetime
+import re
+
+from common_util import cache_serializer
+
+
+REFERENCED_ID_REGEXES = (
+    # the 'old' pattern, which is what you get when you copy/paste from papertrail
+    re.compile(r'(?:focus|centered_on_id)=(\d{18})'),
+    # the links to our own traceback pages
+    re.compile(r'traceback/(\d{18})'),
+)
+"""
+    Regexes that find the papertrail ids referenced in a jira issue's text
+"""
 
 
 class JiraIssue():
@@ -21,6 +39,8 @@ class JiraIssue():
         - the created datetime of the issue
         - the last updated datetime of the issue
         - a list of the labels applied to the ticket
+        - a sorted list of the papertrail ids referenced in the description and comments. Found
+          with L{get_referenced_ids} if not given
     """
     def __init__(
             self,
@@ -37,6 +57,7 @@ class JiraIssue():
             created,
             updated,
             labels,
+            referenced_ids:Optional[List[int]]=None,
     ):
         self._key = key
         self._url = url
@@ -51,6 +72,9 @@ class JiraIssue():
         self._created = created
         self._updated = updated
         self._labels = labels
+        if referenced_ids is None:
+            referenced_ids = get_referenced_ids((description, comments))
+        self._referenced_ids = referenced_ids
 
     def __repr__(self):
         return str(self.document())
@@ -107,6 +131,17 @@ class JiraIssue():
     def labels(self) -> List[str]:
         return self._labels
 
+    @property
+    def referenced_ids(self) -> List[int]:
+        return self._referenced_ids
+
+    @property
+    def latest_referenced_id(self) -> Optional[int]:
+        """
+            The latest papertrail id referenced in the issue, or None if it doesn't reference any
+        """
+        return self._referenced_ids[-1] if self._referenced_ids else None
+
     def document(self) -> dict:
         """
             Returns the document form of this object for ElasticSearch.
@@ -127,9 +162,26 @@ class JiraIssue():
             "created": self._created,
             "updated": self._updated,
             "labels": self._labels,
+            "referenced_ids": self._referenced_ids,
+            "latest_referenced_id": self.latest_referenced_id,
         }
 
 
+def get_referenced_ids(texts:Iterable[Optional[str]]) -> List[int]:
+    """
+        Finds all the papertrail ids referenced in the given texts
+
+        @return: a sorted list of distinct ids. papertrail ids increase over time, so the last is
+            the latest
+    """
+    return sorted(set(
+        int(match)
+        for text in texts if text
+        for regex in REFERENCED_ID_REGEXES
+        for match in regex.findall(text)
+    ))
+
+
 def generate_from_source(source:dict) -> JiraIssue:
     """
         L{source} is a dictionary (from ElasticSearch) containing the fields of this object
@@ -160,4 +212,24 @@ def generate_from_source(source:dict) -> JiraIssue:
         created,
         updated,
         source["labels"] if "labels" in source else [],
+        # issues saved before we stored their referenced ids get them found again here
+        source.get("referenced_ids"),
     )
+
+
+cache_serializer.register_type('jira_issue', JiraIssue, lambda issue: (
+    issue.key,
+    issue.url,
+    issue.summary,
+    issue.description,
+    issue.description_filtered,
+    issue.comments,
+    issue.comments_filtered,
+    issue.issue_type,
+    issue.assignee,
+    issue.status,
+    issue.created,
+    issue.updated,
+    issue.labels,
+    issue.referenced_ids,
+))
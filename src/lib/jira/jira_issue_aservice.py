@@ -130,19 +130,15 @@ def create_title(traceback_text):
         return '%s: %s' % (last_line, second_to_last_line)
 
 
-def create_description(similar_tracebacks):
+def create_description(master_traceback, similar_tracebacks):
     """
         Creates a description for the JIRA ticket given a collection of tracebacks that share a
         traceback text
 
-        Takes the first traceback as the "master" traceback, from which we get the full context to
-        print. This is arbitrary and could be improved in the future by taking the one that user
-        selects instead.
+        The master traceback is the one the user selected. We print its full context.
     """
     tracebacks = list(similar_tracebacks)
     assert tracebacks, tracebacks
-    # grab the first as the master
-    master_traceback = tracebacks[0]
 
     return DESCRIPTION_TEMPLATE % (
         master_traceback.traceback_plus_context_text.rstrip(),
@@ -332,40 +328,6 @@ def jira_api_object_to_JiraIssue(jira_object:jira.resources.Issue) -> JiraIssue:
     )
 
 
-def get_all_referenced_ids(issue:JiraIssue) -> Iterator[int]:
-    """
-        Look through the comments and description and find all papertrail ids that are referenced.
-
-        Note that we might yield the same ID more than once.
-
-        @return: yields individual ids as ints
-    """
-    # look for the 'old' pattern, which is what you get when you copy/paste from papertrail
-    pattern = '(?:focus|centered_on_id)=(\d{18})'
-    for match in re.findall(pattern, issue.description):
-        yield int(match)
-    for match in re.findall(pattern, issue.comments):
-        yield int(match)
-
-    # look for my super fancy new pattern. we could make these be one check, but this is simpler
-    pattern = 'traceback/(\d{18})'
-    for match in re.findall(pattern, issue.description):
-        yield int(match)
-    for match in re.findall(pattern, issue.comments):
-        yield int(match)
-
-
-def find_latest_referenced_id(issue:JiraIssue) -> Optional[int]:
-    """
-        Look through the comments and description find the latest papertrail id someone referenced
-
-        @return: a single papertrail id or None if no ids are found
-    """
-    assert isinstance(issue, JiraIssue), (type(issue), issue)
-
-    return max(get_all_referenced_ids(issue), default=None) # type: ignore # not sure why mypy barfs
-
-
 def __strip_papertrail_metadata(text:str) -> str:
     """
         Given a block of text, filters out papertrail metadata
@@ -5,17 +5,37 @@
 """
 
 from typing import (
+    Dict,
+    Iterable,
+    Iterator,
     List,
 )
 import logging
 
 import elasticsearch
+import elasticsearch.helpers
 
 from opentracing_instrumentation.request_context import get_current_span
 import opentracing
 
+from lib.jira import (
+    jira_issue_match,
+    jira_traceback_extractor,
+)
 from lib.jira.jira_issue import JiraIssue, generate_from_source
+from lib.jira.jira_issue_match import (
+    DOC_TYPE,
+    INDEX,
+    TRACEBACK_FIELDS,
+)
+from lib.traceback import (
+    traceback_group_db,
+    traceback_minhash,
+    traceback_query_db,
+)
+from lib.traceback.traceback import generate_signature
 from common_util import (
+    elasticsearch_config,
     es_util,
     redis_util,
     retry,
@@ -28,16 +48,40 @@ def invalidate_cache():
     redis_util.force_redis_cache_invalidation(DOGPILE_REGION_PREFIX)
 
 
-INDEX = 'jira-issue-index'
-DOC_TYPE = 'jira-issue'
+BULK_CHUNK_SIZE = 500
+"""
+    Default number of jira issue updates we send to ES in a single bulk request
+"""
+
+MAX_SIMILAR_CANDIDATES = 1000
+"""
+    Max number of jira issues sharing a minhash band key that we compare against when looking for
+    similar issues
+"""
+
+SCROLL_PAGE_SIZE = 500
+"""
+    Default number of jira issues we fetch per request when iterating over a large result set
+"""
+
+SCROLL_TIMEOUT = '5m'
+"""
+    How long ES keeps a scroll alive between two of our page requests
+"""
 
 logger = logging.getLogger()
 
 
+_mapping_put = False
+"""
+    Whether this process has run L{put_mapping} yet (see L{_ensure_mapping})
+"""
+
+
 @retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
 def save_jira_issue(es, jira_issue:JiraIssue):
     """
-        Saves a jira issue to ES
+        Saves a jira issue to ES, and records which traceback groups it matches
 
         Invalidates the dogpile cache
 
@@ -46,7 +90,9 @@ def save_jira_issue(es, jira_issue:JiraIssue):
     """
     assert isinstance(jira_issue, JiraIssue), (type(jira_issue), jira_issue)
 
+    _ensure_mapping(es)
     doc = jira_issue.document()
+    doc.update(_generate_traceback_fields(jira_issue))
     res = es.index(
         index=INDEX,
         doc_type=DOC_TYPE,
@@ -54,9 +100,177 @@ def save_jira_issue(es, jira_issue:JiraIssue):
         body=doc
     )
     invalidate_cache()
+    match_jira_issue(es, jira_issue)
     return res
 
 
+def match_jira_issue(es, jira_issue:JiraIssue):
+    """
+        Finds the traceback groups the jira issue matches, and saves its key on every one of them
+        (and removes it from groups it no longer matches)
+
+        Exact matches are the groups with the signature of one of the issue's tracebacks, plus any
+        found by percolating the issue against our stored traceback queries. Similar matches come
+        from comparing the minhashes of the issue's tracebacks with the groups' minhashes.
+    """
+    signatures_by_match_level = traceback_query_db.percolate(es, jira_issue.document())
+    signatures_by_match_level[es_util.EXACT_MATCH] = (
+        set(signatures_by_match_level.get(es_util.EXACT_MATCH, ()))
+        | set(_generate_signatures(jira_issue))
+    )
+    signatures_by_match_level[es_util.SIMILAR_MATCH] = set(traceback_group_db.find_similar_groups(
+        es, None, _generate_minhashes(jira_issue)
+    ))
+    traceback_group_db.set_jira_issue_matches(es, jira_issue.key, signatures_by_match_level)
+
+
+def _generate_signatures(jira_issue:JiraIssue) -> List[str]:
+    """
+        Creates the signature of each traceback found in the jira issue's description and comments
+
+        Uses the same normalization as our tracebacks' signatures, so an issue that quotes a
+        traceback gets that traceback's signature
+    """
+    return sorted(set(
+        generate_signature(text)
+        for text in jira_traceback_extractor.extract_issue_traceback_texts(jira_issue)
+    ))
+
+
+def _generate_minhashes(jira_issue:JiraIssue) -> List[List[int]]:
+    """
+        Creates the minhash of each traceback found in the jira issue's description and comments
+    """
+    minhashes = (
+        traceback_minhash.generate_minhash(text)
+        for text in jira_traceback_extractor.extract_issue_traceback_texts(jira_issue)
+    )
+    return [minhash for minhash in minhashes if minhash]
+
+
+def _generate_traceback_fields(jira_issue:JiraIssue) -> dict:
+    """
+        Creates the L{TRACEBACK_FIELDS} we save on a jira issue's document
+    """
+    minhashes = _generate_minhashes(jira_issue)
+    return {
+        "traceback_signatures": _generate_signatures(jira_issue),
+        "traceback_minhashes": [{"minhash": minhash} for minhash in minhashes],
+        "minhash_band_keys": sorted(set(
+            key for minhash in minhashes for key in traceback_minhash.generate_band_keys(minhash)
+        )),
+    }
+
+
+def update_traceback_fields(es, jira_issues:Iterable[JiraIssue], chunk_size:int=BULK_CHUNK_SIZE
+) -> int:
+    """
+        Saves the L{TRACEBACK_FIELDS} and referenced ids of the given jira issues, which must
+        already be in the database
+
+        Adds the mappings for those fields first (see L{_ensure_mapping}), so this is safe to run
+        against an index that was created before the fields existed.
+
+        Invalidates the dogpile cache if any issue was updated.
+
+        Returns the number of jira issues updated
+    """
+    _ensure_mapping(es)
+    actions = (
+        {
+            "_op_type": "update",
+            "_index": INDEX,
+            "_type": DOC_TYPE,
+            "_id": jira_issue.key,
+            "doc": dict(
+                _generate_traceback_fields(jira_issue),
+                referenced_ids=jira_issue.referenced_ids,
+                latest_referenced_id=jira_issue.latest_referenced_id,
+            ),
+        }
+        for jira_issue in jira_issues
+    )
+    num_updated = 0
+    for ok, item in elasticsearch.helpers.streaming_bulk(
+            es, actions, chunk_size=chunk_size, raise_on_error=False, max_retries=3,
+            request_timeout=elasticsearch_config.REQUEST_TIMEOUTS['bulk'],
+    ):
+        if ok:
+            num_updated += 1
+        else:
+            logger.error('failed to update jira issue traceback fields: %s', item)
+    if num_updated:
+        invalidate_cache()
+    return num_updated
+
+
+def put_mapping(es):
+    """
+        Adds the mappings for the L{TRACEBACK_FIELDS} and referenced ids, so issues saved before we
+        had them can still be searched by them
+    """
+    es.indices.put_mapping(
+        index=INDEX,
+        doc_type=DOC_TYPE,
+        body={
+            "properties": {
+                "traceback_signatures": {"type": "keyword"},
+                "traceback_minhashes": {"type": "object", "enabled": False},
+                "minhash_band_keys": {"type": "keyword"},
+                "referenced_ids": {"type": "long"},
+                "latest_referenced_id": {"type": "long"},
+            }
+        }
+    )
+
+
+def _ensure_mapping(es):
+    """
+        Runs L{put_mapping} the first time this process writes a jira issue
+
+        An index created before we had the L{TRACEBACK_FIELDS} and referenced ids doesn't map them.
+        If we saved an issue to it first, ES would map them dynamically (signatures as text, for
+        example), and our own mapping would then conflict with those.
+    """
+    global _mapping_put
+    if _mapping_put:
+        return
+    try:
+        put_mapping(es)
+    except elasticsearch.exceptions.NotFoundError:
+        logger.warning('jira index not found. has it been created?')
+        return
+    except elasticsearch.exceptions.RequestError as e:
+        logger.error(
+            'failed to map the traceback fields of %s. was it saved to before we mapped them? '
+            'reindex it with scripts/es_mappings/jira_issue_index.json: %s', INDEX, e
+        )
+    _mapping_put = True
+
+
+def match_all_jira_issues(es) -> int:
+    """
+        Runs L{match_jira_issue} for every jira issue in the database
+
+        Used to fill in the traceback groups' jira issue keys after the groups have been rebuilt.
+        Saves the L{TRACEBACK_FIELDS} of every issue first, in case they were saved before we had
+        them.
+
+        Returns the number of jira issues matched
+    """
+    logger.info('updated the traceback fields of %s jira issues', update_traceback_fields(
+        es, iter_jira_issues(es, None)
+    ))
+    count = 0
+    for jira_issue in iter_jira_issues(es, None):
+        match_jira_issue(es, jira_issue)
+        count += 1
+        if count % 1000 == 0:
+            logger.info('matched %s jira issues', count)
+    logger.info('matched %s jira issues to traceback groups', count)
+    return count
+
+
 @retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
 def remove_jira_issue(es, issue_key:str):
     """
@@ -75,6 +289,7 @@ def remove_jira_issue(es, issue_key:str):
         return # it's cool if we don't find a matching issue
     else:
         invalidate_cache()
+        traceback_group_db.remove_jira_issue_key(es, issue_key)
 
 
 @retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
@@ -93,8 +308,9 @@ def get_matching_jira_issues(es, tracer, traceback_text, match_level):
     """
         Queries the database for any jira issues that include the traceback_text
 
-        We use matching_percentage to determine how much the traceback needs to match the given
-        traceback_text before we return it.
+        EXACT_MATCH finds the issues that quote a traceback with traceback_text's signature, with a
+        terms lookup on their traceback_signatures. SIMILAR_MATCH finds the issues with a traceback
+        similar to traceback_text, by comparing minhashes (see L{traceback_minhash}).
 
         Returns a list (instead of a generator) so we can be cached
 
@@ -109,9 +325,7 @@ def get_matching_jira_issues(es, tracer, traceback_text, match_level):
 
     tracer = tracer or opentracing.tracer
 
-    body = es_util.generate_text_match_payload(
-        traceback_text, ["description_filtered", "comments_filtered"], match_level
-    )
+    body = jira_issue_match.generate_match_payload(traceback_text, match_level)
 
     root_span = get_current_span()
     with tracer.start_span('elasticsearch', child_of=root_span):
@@ -125,12 +339,163 @@ def get_matching_jira_issues(es, tracer, traceback_text, match_level):
         except elasticsearch.exceptions.NotFoundError:
             logger.warning('jira index not found. has it been created?')
             return []
-    res = []
-    for raw_jira_issue in raw_es_response['hits']['hits']:
-        res.append(generate_from_source(raw_jira_issue['_source']))
+    return list(jira_issue_match.generate_matches(
+        traceback_text, match_level, raw_es_response['hits']['hits']
+    ))
+
+
+@DOGPILE_REGION.cache_on_arguments()
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def get_matching_jira_issues_for_texts(es, tracer, traceback_texts:tuple, match_level
+) -> Dict[str, List[JiraIssue]]:
+    """
+        Batched form of L{get_matching_jira_issues}: finds the jira issues matching each of the
+        given traceback_texts
+
+        Duplicate texts are only searched for once, and all the searches are sent together with
+        msearch. Takes a tuple (instead of a list) so we can be cached.
+
+        @return: a dict of traceback text -> list of matching L{JiraIssue}
+
+        @precondition: match_level in es_util.ALL_MATCH_LEVELS
+        @postcondition: set(return.keys()) == set(traceback_texts)
+    """
+    return jira_issue_match.search_matching_jira_issues(es, tracer, traceback_texts, match_level)
+
+
+@DOGPILE_REGION.cache_on_arguments()
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def get_jira_issues(es, tracer, issue_keys:tuple) -> Dict[str, JiraIssue]:
+    """
+        Retrieves the jira issues with the given keys in a single request
+
+        Takes a tuple (instead of a list) so we can be cached. Keys we don't have an issue for are
+        left out of the returned dict.
+
+        @rtype: dict
+        @postcondition: all(isinstance(v, JiraIssue) for v in return.values())
+    """
+    if not issue_keys:
+        return {}
+
+    tracer = tracer or opentracing.tracer
+    root_span = get_current_span()
+    with tracer.start_span('elasticsearch', child_of=root_span):
+        try:
+            raw_es_response = es.mget(
+                index=INDEX,
+                doc_type=DOC_TYPE,
+                body={"ids": list(issue_keys)}
+            )
+        except elasticsearch.exceptions.NotFoundError:
+            logger.warning('jira index not found. has it been created?')
+            return {}
+    res = {}
+    for raw_jira_issue in raw_es_response['docs']:
+        if raw_jira_issue.get('found'):
+            res[raw_jira_issue['_id']] = generate_from_source(raw_jira_issue['_source'])
     return res
 
 
+@DOGPILE_REGION.cache_on_arguments()
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def get_jira_issues_referencing(es, tracer, papertrail_id:int) -> List[JiraIssue]:
+    """
+        Retrieves the jira issues whose description or comments reference the given papertrail id
+
+        @rtype: list
+        @postcondition: all(isinstance(v, JiraIssue) for v in return)
+    """
+    tracer = tracer or opentracing.tracer
+    root_span = get_current_span()
+    with tracer.start_span('elasticsearch', child_of=root_span):
+        try:
+            raw_es_response = es.search(
+                index=INDEX,
+                doc_type=DOC_TYPE,
+                body={
+                    "_source": {"excludes": TRACEBACK_FIELDS},
+                    "query": {
+                        "constant_score": {"filter": {"term": {"referenced_ids": papertrail_id}}}
+                    },
+                },
+                size=1000
+            )
+        except elasticsearch.exceptions.NotFoundError:
+            logger.warning('jira index not found. has it been created?')
+            return []
+    return [
+        generate_from_source(raw_jira_issue['_source'])
+        for raw_jira_issue in raw_es_response['hits']['hits']
+    ]
+
+
+def iter_jira_issues(es, tracer, page_size:int=SCROLL_PAGE_SIZE) -> Iterator[JiraIssue]:
+    """
+        Iterates over every jira issue in the database
+
+        Pages through the issues with a scroll of L{page_size} hits per request and decodes them
+        one by one, so memory use is bounded by the page size. Issues are returned in no particular
+        order. Not cached.
+    """
+    return _scan(es, tracer, {"query": {"match_all": {}}}, page_size)
+
+
+def iter_matching_jira_issues(
+        es, tracer, traceback_text:str, match_level:int, page_size:int=SCROLL_PAGE_SIZE,
+) -> Iterator[JiraIssue]:
+    """
+        Iterates over every jira issue that includes the traceback_text
+
+        Unbounded form of L{get_matching_jira_issues}, which stops at 1000 issues. Issues are
+        returned in no particular order. Not cached.
+
+        @precondition: match_level in es_util.ALL_MATCH_LEVELS
+    """
+    assert isinstance(traceback_text, str), (type(traceback_text), traceback_text)
+    assert match_level in es_util.ALL_MATCH_LEVELS, (match_level, es_util.ALL_MATCH_LEVELS)
+
+    body = jira_issue_match.generate_match_payload(traceback_text, match_level)
+    return jira_issue_match.generate_matches(
+        traceback_text, match_level, _scan_raw(es, tracer, body, page_size)
+    )
+
+
+def _scan(es, tracer, body:dict, page_size:int) -> Iterator[JiraIssue]:
+    """
+        Scrolls through every hit of the given search body, decoding each one as a L{JiraIssue}
+    """
+    for raw_jira_issue in _scan_raw(es, tracer, body, page_size):
+        yield generate_from_source(raw_jira_issue['_source'])
+
+
+def _scan_raw(es, tracer, body:dict, page_size:int) -> Iterator[dict]:
+    """
+        Scrolls through every hit of the given search body
+
+        The whole scroll is recorded as one span. Its scroll context is cleared once we're done,
+        even if the caller stops iterating early.
+    """
+    tracer = tracer or opentracing.tracer
+    root_span = get_current_span()
+    with tracer.start_span('elasticsearch scroll', child_of=root_span) as span:
+        count = 0
+        try:
+            for raw_jira_issue in elasticsearch.helpers.scan(
+                    es,
+                    index=INDEX,
+                    doc_type=DOC_TYPE,
+                    query=body,
+                    size=page_size,
+                    scroll=SCROLL_TIMEOUT,
+            ):
+                count += 1
+                yield raw_jira_issue
+        except elasticsearch.exceptions.NotFoundError:
+            logger.warning('jira index not found. has it been created?')
+        span.set_tag('hits', count)
+
+
 def search_jira_issues(es, search_phrase:str, max_count:int) -> List[JiraIssue]:
     """
         Searches our jira issue database for issues that match the given L{search_phrase}.
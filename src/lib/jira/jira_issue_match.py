@@ -0,0 +1,127 @@
+"""
+    Builds and runs the ES searches that find the jira issues matching a traceback
+
+    Kept apart from L{jira_issue_db} so that L{traceback_db} can look up the issues matching its
+    new signatures without importing jira_issue_db (which imports the traceback modules itself).
+    Nothing here is cached.
+
+    For all functions, `es` must be an instance of Elasticsearch
+"""
+
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+)
+
+import elasticsearch
+
+import opentracing
+
+from lib.jira.jira_issue import JiraIssue, generate_from_source
+from lib.traceback import traceback_minhash
+from lib.traceback.traceback import generate_signature
+from common_util import (
+    es_util,
+    retry,
+)
+
+
+INDEX = 'jira-issue-index'
+DOC_TYPE = 'jira-issue'
+
+TRACEBACK_FIELDS = ["traceback_signatures", "traceback_minhashes", "minhash_band_keys"]
+"""
+    The fields we save on a jira issue's document to find it by the tracebacks it references. Not
+    part of L{JiraIssue.document}, so we leave them out of the _source we fetch
+"""
+
+MAX_MATCHES = 1000
+"""
+    Max number of jira issues we fetch for a single traceback text
+"""
+
+
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def search_matching_jira_issues(es, tracer, traceback_texts:Iterable[str], match_level:int
+) -> Dict[str, List[JiraIssue]]:
+    """
+        Finds the jira issues matching each of the given traceback_texts
+
+        Duplicate texts are only searched for once, and all the searches are sent together with
+        msearch.
+
+        @return: a dict of traceback text -> list of matching L{JiraIssue}
+
+        @precondition: match_level in es_util.ALL_MATCH_LEVELS
+        @postcondition: set(return.keys()) == set(traceback_texts)
+    """
+    assert match_level in es_util.ALL_MATCH_LEVELS, (match_level, es_util.ALL_MATCH_LEVELS)
+
+    tracer = tracer or opentracing.tracer
+
+    distinct_texts = sorted(set(traceback_texts))
+    bodies = []
+    for traceback_text in distinct_texts:
+        body = generate_match_payload(traceback_text, match_level)
+        body['size'] = MAX_MATCHES
+        bodies.append(body)
+    responses = es_util.msearch(es, tracer, INDEX, DOC_TYPE, bodies)
+
+    res: Dict[str, List[JiraIssue]] = {}
+    for traceback_text, raw_es_response in zip(distinct_texts, responses):
+        if raw_es_response is None:
+            res[traceback_text] = []
+            continue
+        res[traceback_text] = list(
+            generate_matches(traceback_text, match_level, raw_es_response['hits']['hits'])
+        )
+    return res
+
+
+def generate_match_payload(traceback_text:str, match_level:int) -> dict:
+    """
+        Creates the ES query payload that finds the jira issues matching traceback_text at
+        match_level. For SIMILAR_MATCH it only finds candidates: pass the hits through
+        L{generate_matches}
+    """
+    if match_level == es_util.EXACT_MATCH:
+        return {
+            "_source": {"excludes": TRACEBACK_FIELDS},
+            "query": {
+                "constant_score": {
+                    "filter": {"term": {"traceback_signatures": generate_signature(traceback_text)}}
+                }
+            },
+        }
+    minhash = traceback_minhash.generate_minhash(traceback_text)
+    return {
+        "_source": {"excludes": ["traceback_signatures", "minhash_band_keys"]},
+        "query": {
+            "constant_score": {
+                "filter": {"terms": {"minhash_band_keys": traceback_minhash.generate_band_keys(
+                    minhash
+                )}}
+            }
+        },
+    }
+
+
+def generate_matches(traceback_text:str, match_level:int, raw_jira_issues:Iterable[dict]
+) -> Iterator[JiraIssue]:
+    """
+        Decodes the hits of a L{generate_match_payload} query. For SIMILAR_MATCH, skips the
+        candidates without a traceback similar enough to traceback_text
+    """
+    minhash = None
+    if match_level == es_util.SIMILAR_MATCH:
+        minhash = traceback_minhash.generate_minhash(traceback_text)
+    for raw_jira_issue in raw_jira_issues:
+        source = raw_jira_issue['_source']
+        if minhash is not None and not any(
+                traceback_minhash.is_similar(minhash, sketch['minhash'])
+                for sketch in source.get('traceback_minhashes', [])
+        ):
+            continue
+        yield generate_from_source(source)
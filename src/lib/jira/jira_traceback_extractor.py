@@ -0,0 +1,91 @@
+"""
+    Pulls the tracebacks people pasted into jira issues out of the surrounding text.
+
+    Jira descriptions and comments are mostly prose, wiki markup and log lines. We sketch each
+    traceback on its own (see L{traceback_minhash}), so a long issue with a pasted traceback is as
+    similar to that traceback as the traceback itself.
+"""
+import re
+import typing
+
+from lib.jira.jira_issue import JiraIssue
+
+
+TRACEBACK_START = 'Traceback (most recent call last)'
+
+MAX_TRACEBACKS = 20
+"""
+    Max number of tracebacks we pull out of a single text
+"""
+
+__FRAME_REGEX = re.compile(r'^\s*File ".*", line \d+')
+"""
+    Matches the first line of a stack frame, for example:
+        File "/opt/wordstream/engine/rpc.py", line 12, in handle
+"""
+
+__EXCEPTION_REGEX = re.compile(r'^[A-Za-z_][\w.]*(?::|$)')
+"""
+    Matches the exception line that ends a traceback, for example:
+        KeyError: 'campaign_id'
+"""
+
+__MARKUP_REGEX = re.compile(r'^\s*\{(?:noformat|code|quote)[^}]*\}\s*$')
+"""
+    Matches a line that is only a jira wiki markup tag, like {noformat} or {code:python}
+"""
+
+
+def extract_traceback_texts(text:typing.Optional[str]) -> typing.List[str]:
+    """
+        Finds every python traceback in the given text
+
+        A traceback runs from its 'Traceback (most recent call last)' line through its stack frames
+        to the first line that isn't part of a frame: the exception line. Jira markup tags inside
+        or after a traceback end it.
+
+        @return: the text of each traceback, in the order they appear
+        @postcondition: len(return) <= MAX_TRACEBACKS
+    """
+    if not text:
+        return []
+
+    res: typing.List[str] = []
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines) and len(res) < MAX_TRACEBACKS:
+        start = lines[i].find(TRACEBACK_START)
+        if start == -1:
+            i += 1
+            continue
+
+        traceback_lines = [lines[i][start:]]
+        i += 1
+        in_frame = False
+        while i < len(lines):
+            line = lines[i]
+            if re.match(__MARKUP_REGEX, line) or TRACEBACK_START in line:
+                break
+            i += 1
+            if not line.strip():
+                continue
+            traceback_lines.append(line)
+            if re.match(__FRAME_REGEX, line):
+                in_frame = True
+            elif in_frame and (line[0].isspace() or not re.match(__EXCEPTION_REGEX, line)):
+                in_frame = False # the source line of the frame
+            else:
+                break # the exception line
+        res.append('\n'.join(traceback_lines))
+    return res
+
+
+def extract_issue_traceback_texts(jira_issue:JiraIssue) -> typing.List[str]:
+    """
+        Finds every python traceback in the jira issue's description and comments, with any
+        papertrail metadata already filtered out
+    """
+    return (
+        extract_traceback_texts(jira_issue.description_filtered)
+        + extract_traceback_texts(jira_issue.comments_filtered)
+    )
@@ -0,0 +1,53 @@
+import datetime
+import json
+import unittest
+
+from lib.jira.jira_issue import JiraIssue, generate_from_source
+
+
+DESCRIPTION = '''Error observed in production.
+
+Hits on this error:
+- https://papertrailapp.com/systems/1234/events?centered_on_id=926890000000000001
+- https://tracebacks.example.com/traceback/926890000000000003
+'''
+
+COMMENTS = 'seen again: https://papertrailapp.com/events?focus=926890000000000002&q=foo'
+
+
+def make_issue(**kwargs):
+    return JiraIssue(
+        'PPC-123', '', 'campaign loader is broken', DESCRIPTION, DESCRIPTION, COMMENTS, COMMENTS,
+        'Bug', '', 'Open',
+        datetime.datetime(2018, 4, 18, 11, 19, 55, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2018, 4, 18, 11, 19, 55, tzinfo=datetime.timezone.utc),
+        [], **kwargs
+    )
+
+
+class TestJiraIssue(unittest.TestCase):
+    def test_referenced_ids(self):
+        issue = make_issue()
+        self.assertEqual(
+            issue.referenced_ids,
+            [926890000000000001, 926890000000000002, 926890000000000003]
+        )
+        self.assertEqual(issue.latest_referenced_id, 926890000000000003)
+
+    def test_no_referenced_ids(self):
+        issue = make_issue(referenced_ids=[])
+        self.assertEqual(issue.latest_referenced_id, None)
+
+    def test_round_trip(self):
+        """
+            The ids are read from the document, and found again for documents saved without them
+        """
+        document = json.loads(json.dumps(
+            make_issue(referenced_ids=[926890000000000005]).document(),
+            default=lambda value: value.strftime('%Y-%m-%dT%H:%M:%S.%f%z'),
+        ))
+        self.assertEqual(generate_from_source(document).latest_referenced_id, 926890000000000005)
+
+        del document['referenced_ids']
+        del document['latest_referenced_id']
+        self.assertEqual(generate_from_source(document).latest_referenced_id, 926890000000000003)
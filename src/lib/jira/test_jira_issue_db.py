@@ -0,0 +1,60 @@
+import datetime
+import unittest
+
+import elasticsearch
+
+from lib.jira import jira_issue_db
+from lib.jira.jira_issue import JiraIssue
+
+
+def make_issue(key):
+    return JiraIssue(
+        key, '', 'campaign loader is broken', 'description', 'description', '', '', 'Bug', '',
+        'Open', datetime.datetime(2018, 4, 18, 11, 19, 55, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2018, 4, 18, 11, 19, 55, tzinfo=datetime.timezone.utc), [],
+    )
+
+
+class FakeIndices():
+    def __init__(self, es):
+        self.es = es
+
+    def put_mapping(self, index, doc_type, body): # pylint: disable=unused-argument
+        if any(field in self.es.dynamic_fields for field in body['properties']):
+            raise elasticsearch.exceptions.RequestError(400, 'illegal_argument_exception')
+        self.es.calls.append('put_mapping')
+
+
+class FakeElasticsearch():
+    """ An existing jira index, created before it mapped the traceback fields """
+    def __init__(self):
+        self.calls = []
+        self.dynamic_fields = set()
+        self.indices = FakeIndices(self)
+
+    def index(self, index, doc_type, id, body): # pylint: disable=unused-argument
+        if 'put_mapping' not in self.calls:
+            # ES would guess a mapping for every new field in the document
+            self.dynamic_fields.update(body)
+        self.calls.append('index')
+
+
+class TestSaveJiraIssue(unittest.TestCase):
+    def setUp(self):
+        self.original_match_jira_issue = jira_issue_db.match_jira_issue
+        self.original_invalidate_cache = jira_issue_db.invalidate_cache
+        jira_issue_db.match_jira_issue = lambda es, jira_issue: None
+        jira_issue_db.invalidate_cache = lambda: None
+        jira_issue_db._mapping_put = False
+
+    def tearDown(self):
+        jira_issue_db.match_jira_issue = self.original_match_jira_issue
+        jira_issue_db.invalidate_cache = self.original_invalidate_cache
+        jira_issue_db._mapping_put = False
+
+    def test_maps_fields_of_existing_index_before_first_save(self):
+        es = FakeElasticsearch()
+        jira_issue_db.save_jira_issue(es, make_issue('PPC-1'))
+        jira_issue_db.save_jira_issue(es, make_issue('PPC-2'))
+        self.assertEqual(es.calls, ['put_mapping', 'index', 'index'])
+        self.assertEqual(es.dynamic_fields, set())
@@ -0,0 +1,34 @@
+import unittest
+
+from lib.jira.jira_traceback_extractor import extract_traceback_texts
+
+
+TRACEBACK_TEXT = '''Traceback (most recent call last):
+  File "/opt/wordstream/engine/rpc.py", line 12, in handle
+    return self.do_stuff(fields, params)
+  File "/opt/wordstream/engine/campaigns.py", line 88, in do_stuff
+KeyError: 'campaign_id\''''
+
+ISSUE_TEXT = '''We hit this again after the deploy:
+{noformat}
+%s
+some unrelated log line
+{noformat}
+Looks like the same thing as last week.
+''' % TRACEBACK_TEXT
+
+
+class TestJiraTracebackExtractor(unittest.TestCase):
+    def test_extracts_traceback_from_markup(self):
+        """
+            Frames without a source line are kept, and the exception line ends the traceback
+        """
+        self.assertEqual(extract_traceback_texts(ISSUE_TEXT), [TRACEBACK_TEXT])
+
+    def test_extracts_every_traceback(self):
+        text = '\n'.join((ISSUE_TEXT, 'and then', 'Jan 02 10:00:00 ' + TRACEBACK_TEXT))
+        self.assertEqual(extract_traceback_texts(text), [TRACEBACK_TEXT, TRACEBACK_TEXT])
+
+    def test_no_tracebacks(self):
+        self.assertEqual(extract_traceback_texts(None), [])
+        self.assertEqual(extract_traceback_texts('nothing to see here'), [])
@@ -8,18 +8,12 @@ import time
 from common_util import (
     time_util,
 )
-from lib.api_call import (
-    api_call_db,
-)
 from lib.common import (
-    cache_util,
+    ingest_spool,
 )
 from lib.papertrail import (
     json_parser,
 )
-from lib.traceback import (
-    traceback_db,
-)
 import tasks
 
 
@@ -51,19 +45,20 @@ def run(ES, start_time, end_time):
         return
 
     tracebacks, api_calls = json_parser.parse_json_file(local_file.name)
-    count = 0
-    for tb in tracebacks:
-        count += 1
-        traceback_db.save_traceback(ES, tb)
-    logger.info("saved %s tracebacks", count)
+    count, spooled_count, errors = ingest_spool.save_tracebacks(ES, tracebacks)
+    logger.info("saved %s tracebacks, spooled %s", count, spooled_count)
+    if errors:
+        logger.error("failed to save %s tracebacks. %s to %s", len(errors), start_time, end_time)
 
     if count > 0:
-        logger.info('invalidating traceback cache')
-        cache_util.invalidate_cache('traceback')
+        # save_tracebacks already invalidated the traceback cache. re-hydrate it
+        tasks.hydrate_cache.apply_async(tuple(), expires=60) # expire after a minute
 
     if api_calls:
         logger.info('saving %s api calls', len(api_calls))
-        api_call_db.save(ES, api_calls)
+        _, _, errors = ingest_spool.save_api_calls(ES, api_calls)
+        if errors:
+            logger.error("failed to save %s api calls. %s to %s", len(errors), start_time, end_time)
     else:
         logger.info('no api calls found. %s to %s', start_time, end_time)
 
@@ -0,0 +1,78 @@
+"""
+    L{StorageBackend} that stores everything in ES, through our existing db modules
+"""
+import datetime
+import typing
+
+import elasticsearch
+import opentracing
+
+from lib.api_call import api_call_db
+from lib.api_call.api_call import ApiCall
+from lib.jira import jira_issue_db
+from lib.jira.jira_issue import JiraIssue
+from lib.storage.storage_backend import StorageBackend
+from lib.traceback import traceback_db
+from lib.traceback.traceback import Traceback
+
+
+class ElasticsearchBackend(StorageBackend):
+    """
+        Delegates every call to the matching function of L{traceback_db}, L{jira_issue_db} or
+        L{api_call_db}, so it behaves (and caches) exactly like calling them directly.
+
+        `es` must be an instance of Elasticsearch. `tracer` is the opentracing tracer our queries'
+        spans are recorded with; the global tracer by default.
+    """
+    def __init__(self, es, tracer=None):
+        self._es = es
+        self._tracer = tracer or opentracing.tracer
+
+    @property
+    def es(self):
+        return self._es
+
+    def save_tracebacks(self, tracebacks:typing.Iterable[Traceback]
+    ) -> typing.Tuple[int, typing.List[dict]]:
+        return traceback_db.save_tracebacks(self._es, tracebacks)
+
+    def get_traceback(self, id_:int) -> typing.Optional[Traceback]:
+        try:
+            return traceback_db.get_traceback(self._es, id_)
+        except elasticsearch.exceptions.NotFoundError:
+            return None
+
+    def get_tracebacks(self, start_date:typing.Optional[datetime.date]=None,
+                       end_date:typing.Optional[datetime.date]=None, num_matches:int=100
+    ) -> typing.List[Traceback]:
+        return traceback_db.get_tracebacks(
+            self._es, self._tracer, start_date, end_date, num_matches
+        )
+
+    def get_matching_tracebacks(self, traceback_text:str, match_level:int, num_matches:int
+    ) -> typing.List[Traceback]:
+        return traceback_db.get_matching_tracebacks(
+            self._es, self._tracer, traceback_text, match_level, num_matches
+        )
+
+    def save_jira_issue(self, jira_issue:JiraIssue):
+        jira_issue_db.save_jira_issue(self._es, jira_issue)
+
+    def remove_jira_issue(self, issue_key:str):
+        jira_issue_db.remove_jira_issue(self._es, issue_key)
+
+    def get_matching_jira_issues(self, traceback_text:str, match_level:int
+    ) -> typing.List[JiraIssue]:
+        return jira_issue_db.get_matching_jira_issues(
+            self._es, self._tracer, traceback_text, match_level
+        )
+
+    def search_jira_issues(self, search_phrase:str, max_count:int) -> typing.List[JiraIssue]:
+        return jira_issue_db.search_jira_issues(self._es, search_phrase, max_count)
+
+    def get_num_jira_issues(self) -> int:
+        return jira_issue_db.get_num_jira_issues(self._es)
+
+    def save_api_calls(self, api_calls:typing.Iterable[ApiCall]
+    ) -> typing.Tuple[int, typing.List[dict]]:
+        return api_call_db.save(self._es, api_calls)
@@ -0,0 +1,364 @@
+"""
+    L{StorageBackend} that stores everything in a single SQLite database file.
+
+    Only used by our storage benchmark and by tests, to run our queries without an ES cluster. It
+    answers them the same way our ES mappings do:
+    - tracebacks are looked up by their signature and timestamp, which have B-tree indexes
+    - jira issues are looked up by the signatures of the tracebacks they quote, kept in their own
+      indexed table
+    - SIMILAR_MATCH lookups use the same minhash band keys as ES (see L{traceback_minhash}), kept
+      in their own indexed tables
+    - jira issue searches use an FTS5 full text table
+
+    One difference: FTS5 folds case, so jira issue searches are case insensitive here.
+"""
+import datetime
+import json
+import re
+import sqlite3
+import threading
+import typing
+
+from common_util import es_util
+from lib.api_call.api_call import ApiCall
+from lib.jira import jira_traceback_extractor
+from lib.jira.jira_issue import JiraIssue, generate_from_source
+from lib.storage.storage_backend import StorageBackend
+from lib.traceback import traceback_minhash
+from lib.traceback.traceback import (
+    Traceback,
+    generate_signature,
+    generate_traceback_from_source,
+)
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tracebacks (
+    origin_papertrail_id INTEGER PRIMARY KEY,
+    traceback_signature TEXT NOT NULL,
+    origin_timestamp TEXT NOT NULL,
+    document TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tracebacks_by_timestamp
+    ON tracebacks (origin_timestamp);
+CREATE INDEX IF NOT EXISTS tracebacks_by_signature
+    ON tracebacks (traceback_signature, origin_timestamp);
+
+CREATE TABLE IF NOT EXISTS traceback_minhashes (
+    traceback_signature TEXT PRIMARY KEY,
+    minhash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS traceback_band_keys (
+    band_key TEXT NOT NULL,
+    traceback_signature TEXT NOT NULL,
+    PRIMARY KEY (band_key, traceback_signature)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS jira_issues (
+    key TEXT PRIMARY KEY,
+    document TEXT NOT NULL,
+    traceback_minhashes TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jira_band_keys (
+    band_key TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (band_key, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS jira_signatures (
+    traceback_signature TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (traceback_signature, key)
+) WITHOUT ROWID;
+CREATE VIRTUAL TABLE IF NOT EXISTS jira_issue_search USING fts5(
+    key, summary, description, comments
+);
+
+CREATE TABLE IF NOT EXISTS api_calls (
+    papertrail_id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    api_name TEXT,
+    document TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS api_calls_by_timestamp
+    ON api_calls (timestamp);
+'''
+"""
+    Our tables. Timestamps are saved in utc, as 'YYYY-MM-DDTHH:MM:SS' strings, so they sort (and
+    compare with dates) correctly. Documents are the JSON form of each entity's document()
+"""
+
+SEARCH_COLUMN_WEIGHTS = (10.0, 5.0, 1.0, 1.0)
+"""
+    bm25 weights of the key, summary, description and comments columns when searching jira issues.
+    Mirrors the field boosts of L{jira_issue_db.search_jira_issues}
+"""
+
+MAX_SIMILAR_CANDIDATES = 1000
+"""
+    Max number of signatures (or jira issues) sharing a minhash band key that we compare against
+    when looking for similar ones
+"""
+
+_SEARCH_TOKEN_REGEX = re.compile(r'\w+')
+
+
+class SqliteBackend(StorageBackend):
+    """
+        Stores everything in the SQLite database at `path`, creating its tables if needed. Pass
+        ':memory:' for a throwaway in-memory database.
+
+        The connection is shared by every thread using this backend, one statement at a time.
+    """
+    def __init__(self, path:str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+
+    def __repr__(self) -> str:
+        return '%s(%r)' % (self.__class__.__name__, self._path)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def save_tracebacks(self, tracebacks:typing.Iterable[Traceback]
+    ) -> typing.Tuple[int, typing.List[dict]]:
+        rows = []
+        texts_by_signature = {}
+        for traceback in tracebacks:
+            assert isinstance(traceback, Traceback), (type(traceback), traceback)
+            rows.append((
+                traceback.origin_papertrail_id,
+                traceback.traceback_signature,
+                _to_utc_string(traceback.origin_timestamp),
+                json.dumps(traceback.document()),
+            ))
+            texts_by_signature[traceback.traceback_signature] = traceback.traceback_text
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO tracebacks VALUES (?, ?, ?, ?)', rows
+            )
+            new_signatures = set(texts_by_signature) - set(
+                row[0] for row in self._select_in(
+                    'SELECT traceback_signature FROM traceback_minhashes '
+                    'WHERE traceback_signature IN (%s)',
+                    texts_by_signature
+                )
+            )
+            for signature in new_signatures:
+                minhash = traceback_minhash.generate_minhash(texts_by_signature[signature])
+                self._connection.execute(
+                    'INSERT INTO traceback_minhashes VALUES (?, ?)',
+                    (signature, json.dumps(minhash))
+                )
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO traceback_band_keys VALUES (?, ?)',
+                    ((key, signature) for key in traceback_minhash.generate_band_keys(minhash))
+                )
+        return len(rows), []
+
+    def get_traceback(self, id_:int) -> typing.Optional[Traceback]:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT document FROM tracebacks WHERE origin_papertrail_id = ?', (id_,)
+            ).fetchone()
+        if row is None:
+            return None
+        return generate_traceback_from_source(json.loads(row[0]))
+
+    def get_tracebacks(self, start_date:typing.Optional[datetime.date]=None,
+                       end_date:typing.Optional[datetime.date]=None, num_matches:int=100
+    ) -> typing.List[Traceback]:
+        conditions = []
+        params: typing.List[object] = []
+        if start_date is not None:
+            conditions.append('origin_timestamp >= ?')
+            params.append(start_date.isoformat())
+        if end_date is not None:
+            conditions.append('origin_timestamp < ?')
+            params.append((end_date + datetime.timedelta(days=1)).isoformat())
+        query = 'SELECT document FROM tracebacks'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY origin_timestamp DESC LIMIT ?'
+        params.append(num_matches)
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+        return [generate_traceback_from_source(json.loads(row[0])) for row in rows]
+
+    def get_matching_tracebacks(self, traceback_text:str, match_level:int, num_matches:int
+    ) -> typing.List[Traceback]:
+        assert match_level in es_util.ALL_MATCH_LEVELS, (match_level, es_util.ALL_MATCH_LEVELS)
+
+        signatures = {generate_signature(traceback_text)}
+        with self._lock:
+            if match_level == es_util.SIMILAR_MATCH:
+                signatures.update(self._find_similar_signatures(traceback_text))
+            rows = list(self._select_in(
+                'SELECT document FROM tracebacks WHERE traceback_signature IN (%s) '
+                'ORDER BY origin_timestamp DESC LIMIT ?',
+                signatures, (num_matches,)
+            ))
+        return [generate_traceback_from_source(json.loads(row[0])) for row in rows]
+
+    def _find_similar_signatures(self, traceback_text:str) -> typing.List[str]:
+        minhash = traceback_minhash.generate_minhash(traceback_text)
+        candidates = self._select_in(
+            'SELECT traceback_signature, minhash FROM traceback_minhashes '
+            'WHERE traceback_signature IN ('
+            '  SELECT DISTINCT traceback_signature FROM traceback_band_keys '
+            '  WHERE band_key IN (%s) LIMIT ?'
+            ')',
+            traceback_minhash.generate_band_keys(minhash), (MAX_SIMILAR_CANDIDATES,)
+        )
+        return [
+            signature for signature, candidate_minhash in candidates
+            if traceback_minhash.is_similar(minhash, json.loads(candidate_minhash))
+        ]
+
+    def save_jira_issue(self, jira_issue:JiraIssue):
+        assert isinstance(jira_issue, JiraIssue), (type(jira_issue), jira_issue)
+        traceback_texts = jira_traceback_extractor.extract_issue_traceback_texts(jira_issue)
+        signatures = set(generate_signature(text) for text in traceback_texts)
+        minhashes = [
+            minhash for minhash in (
+                traceback_minhash.generate_minhash(text) for text in traceback_texts
+            )
+            if minhash
+        ]
+        band_keys = set(
+            key for minhash in minhashes for key in traceback_minhash.generate_band_keys(minhash)
+        )
+        with self._lock, self._connection:
+            self._delete_jira_issue(jira_issue.key)
+            self._connection.execute(
+                'INSERT INTO jira_issues VALUES (?, ?, ?)',
+                (
+                    jira_issue.key,
+                    json.dumps(jira_issue.document(), default=_serialize_datetime),
+                    json.dumps(minhashes),
+                )
+            )
+            self._connection.executemany(
+                'INSERT INTO jira_band_keys VALUES (?, ?)',
+                ((key, jira_issue.key) for key in band_keys)
+            )
+            self._connection.executemany(
+                'INSERT INTO jira_signatures VALUES (?, ?)',
+                ((signature, jira_issue.key) for signature in signatures)
+            )
+            self._connection.execute(
+                'INSERT INTO jira_issue_search VALUES (?, ?, ?, ?)',
+                (
+                    jira_issue.key,
+                    jira_issue.summary,
+                    jira_issue.description,
+                    jira_issue.comments,
+                )
+            )
+
+    def remove_jira_issue(self, issue_key:str):
+        with self._lock, self._connection:
+            self._delete_jira_issue(issue_key)
+
+    def _delete_jira_issue(self, issue_key:str):
+        for table in ('jira_issues', 'jira_band_keys', 'jira_signatures', 'jira_issue_search'):
+            self._connection.execute('DELETE FROM %s WHERE key = ?' % table, (issue_key,))
+
+    def get_matching_jira_issues(self, traceback_text:str, match_level:int
+    ) -> typing.List[JiraIssue]:
+        assert match_level in es_util.ALL_MATCH_LEVELS, (match_level, es_util.ALL_MATCH_LEVELS)
+
+        if match_level == es_util.EXACT_MATCH:
+            with self._lock:
+                rows = self._connection.execute(
+                    'SELECT document FROM jira_issues WHERE key IN ('
+                    '  SELECT key FROM jira_signatures WHERE traceback_signature = ?'
+                    ')',
+                    (generate_signature(traceback_text),)
+                ).fetchall()
+            return [generate_from_source(json.loads(row[0])) for row in rows]
+
+        minhash = traceback_minhash.generate_minhash(traceback_text)
+        with self._lock:
+            candidates = list(self._select_in(
+                'SELECT document, traceback_minhashes FROM jira_issues WHERE key IN ('
+                '  SELECT DISTINCT key FROM jira_band_keys WHERE band_key IN (%s) LIMIT ?'
+                ')',
+                traceback_minhash.generate_band_keys(minhash), (MAX_SIMILAR_CANDIDATES,)
+            ))
+        return [
+            generate_from_source(json.loads(document))
+            for document, minhashes in candidates
+            if any(
+                traceback_minhash.is_similar(minhash, candidate_minhash)
+                for candidate_minhash in json.loads(minhashes)
+            )
+        ]
+
+    def search_jira_issues(self, search_phrase:str, max_count:int) -> typing.List[JiraIssue]:
+        tokens = re.findall(_SEARCH_TOKEN_REGEX, search_phrase)
+        if not tokens:
+            return []
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT jira_issues.document FROM jira_issue_search '
+                'JOIN jira_issues ON jira_issues.key = jira_issue_search.key '
+                'WHERE jira_issue_search MATCH ? '
+                'ORDER BY bm25(jira_issue_search, %s) LIMIT ?' % (
+                    ', '.join(str(weight) for weight in SEARCH_COLUMN_WEIGHTS)
+                ),
+                ('"%s" *' % ' '.join(tokens), max_count)
+            ).fetchall()
+        return [generate_from_source(json.loads(row[0])) for row in rows]
+
+    def get_num_jira_issues(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM jira_issues').fetchone()[0]
+
+    def save_api_calls(self, api_calls:typing.Iterable[ApiCall]
+    ) -> typing.Tuple[int, typing.List[dict]]:
+        rows = []
+        for api_call in api_calls:
+            document = api_call.document()
+            rows.append((
+                document['papertrail_id'],
+                _to_utc_string(api_call.timestamp),
+                document['api_name'],
+                json.dumps(document),
+            ))
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO api_calls VALUES (?, ?, ?, ?)', rows
+            )
+        return len(rows), []
+
+    def _select_in(self, query:str, values:typing.Iterable, extra_params:tuple=()
+    ) -> typing.List[tuple]:
+        """
+            Runs a query with one 'IN (%s)' clause, filled in with a placeholder per value
+        """
+        values = list(values)
+        if not values:
+            return []
+        return self._connection.execute(
+            query % ', '.join('?' * len(values)), values + list(extra_params)
+        ).fetchall()
+
+
+def _to_utc_string(timestamp:datetime.datetime) -> str:
+    if timestamp.tzinfo is not None:
+        # timestamps without timezone info are already in utc
+        timestamp = timestamp.astimezone(datetime.timezone.utc)
+    return timestamp.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def _serialize_datetime(value):
+    if isinstance(value, datetime.datetime):
+        # the format L{jira_issue.generate_from_source} parses
+        return value.strftime('%Y-%m-%dT%H:%M:%S.%f%z')
+    raise TypeError('%r is not JSON serializable' % value)
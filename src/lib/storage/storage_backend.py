@@ -0,0 +1,94 @@
+"""
+    The interface our storage backends implement.
+
+    Our code talks to ES through the module functions in L{traceback_db},
+    L{jira_issue_db} and L{api_call_db}. A L{StorageBackend} bundles the core of those functions -
+    saving what we parse, and the lookups our pages are built from - behind one object, so we can
+    compare ES against other stores. The app itself always uses the db modules directly; backends
+    are only used by scripts/benchmarks/storage_backends.py and by tests.
+"""
+import datetime
+import typing
+
+from lib.api_call.api_call import ApiCall
+from lib.jira.jira_issue import JiraIssue
+from lib.traceback.traceback import Traceback
+
+
+class StorageBackend():
+    """
+        Base class of our storage backends. Every method must be implemented by subclasses.
+
+        The semantics of each method are those of the module function it's named after:
+        - match levels are the ones in L{es_util.ALL_MATCH_LEVELS}, and mean the same thing in
+          every backend
+        - date ranges are inclusive, and either end may be None
+        - lists of tracebacks are sorted latest first
+    """
+    def save_tracebacks(self, tracebacks:typing.Iterable[Traceback]
+    ) -> typing.Tuple[int, typing.List[dict]]:
+        """
+            Saves the given tracebacks, replacing any saved tracebacks with the same ids
+
+            @return: a tuple of (number of tracebacks saved, list of per-item error dicts)
+        """
+        raise NotImplementedError()
+
+    def get_traceback(self, id_:int) -> typing.Optional[Traceback]:
+        """
+            Returns the traceback with the given origin_papertrail_id, or None if we don't have it
+        """
+        raise NotImplementedError()
+
+    def get_tracebacks(self, start_date:typing.Optional[datetime.date]=None,
+                       end_date:typing.Optional[datetime.date]=None, num_matches:int=100
+    ) -> typing.List[Traceback]:
+        """
+            Returns up to num_matches tracebacks from the given date range
+        """
+        raise NotImplementedError()
+
+    def get_matching_tracebacks(self, traceback_text:str, match_level:int, num_matches:int
+    ) -> typing.List[Traceback]:
+        """
+            Returns up to num_matches tracebacks that match traceback_text at match_level
+        """
+        raise NotImplementedError()
+
+    def save_jira_issue(self, jira_issue:JiraIssue):
+        """
+            Saves the given jira issue, replacing any saved issue with the same key
+        """
+        raise NotImplementedError()
+
+    def remove_jira_issue(self, issue_key:str):
+        """
+            Removes the jira issue with the given key. It's fine if we don't have it
+        """
+        raise NotImplementedError()
+
+    def get_matching_jira_issues(self, traceback_text:str, match_level:int
+    ) -> typing.List[JiraIssue]:
+        """
+            Returns the jira issues that include traceback_text at match_level
+        """
+        raise NotImplementedError()
+
+    def search_jira_issues(self, search_phrase:str, max_count:int) -> typing.List[JiraIssue]:
+        """
+            Returns up to max_count jira issues whose key, summary, description or comments start
+            with search_phrase, best matches first
+        """
+        raise NotImplementedError()
+
+    def get_num_jira_issues(self) -> int:
+        raise NotImplementedError()
+
+    def save_api_calls(self, api_calls:typing.Iterable[ApiCall]
+    ) -> typing.Tuple[int, typing.List[dict]]:
+        """
+            Saves the given api calls, replacing any saved api calls with the same ids
+
+            @return: a tuple of (number of api calls saved, list of per-item error dicts)
+        """
+        raise NotImplementedError()
@@ -0,0 +1,97 @@
+import datetime
+import unittest
+
+from common_util import es_util
+from common_util.testing_util import make_traceback
+from lib.jira.jira_issue import JiraIssue
+from lib.storage.sqlite_backend import SqliteBackend
+
+
+TRACEBACK_TEXT = '''Traceback (most recent call last):
+  File "/opt/wordstream/engine/rpc.py", line 12, in handle
+    return self.do_stuff(fields, params)
+  File "/opt/wordstream/engine/campaigns.py", line 88, in do_stuff
+    campaign = self.load_campaign(params['campaign_id'])
+KeyError: 'campaign_id\''''
+
+SIMILAR_TRACEBACK_TEXT = TRACEBACK_TEXT.replace("'campaign_id'", "'account_id'")
+
+UNRELATED_TRACEBACK_TEXT = '''Traceback (most recent call last):
+  File "/opt/wordstream/reporting/views.py", line 5, in render
+    template.render(context)
+ValueError: bad template'''
+
+
+def make_jira_issue(key, summary, description):
+    return JiraIssue(
+        key, 'https://jira/browse/%s' % key, summary, description, description, '', '', 'Bug',
+        'someone', 'Open', '2018-04-18T11:19:55.000-0400', '2018-04-19T11:19:55.000-0400', [],
+    )
+
+
+class TestSqliteBackend(unittest.TestCase):
+    def setUp(self):
+        self.backend = SqliteBackend(':memory:')
+        self.backend.save_tracebacks([
+            make_traceback(1, TRACEBACK_TEXT, datetime.datetime(2018, 4, 1, 10)),
+            make_traceback(2, TRACEBACK_TEXT, datetime.datetime(2018, 4, 2, 10)),
+            make_traceback(3, SIMILAR_TRACEBACK_TEXT, datetime.datetime(2018, 4, 3, 10)),
+            make_traceback(4, UNRELATED_TRACEBACK_TEXT, datetime.datetime(2018, 4, 4, 10)),
+        ])
+
+    def tearDown(self):
+        self.backend.close()
+
+    def test_get_tracebacks(self):
+        self.assertEqual(self.backend.get_traceback(2).traceback_text, TRACEBACK_TEXT)
+        self.assertIsNone(self.backend.get_traceback(5))
+        ids = [tb.origin_papertrail_id for tb in self.backend.get_tracebacks(
+            datetime.date(2018, 4, 2), datetime.date(2018, 4, 3)
+        )]
+        self.assertEqual(ids, [3, 2])
+
+    def test_get_matching_tracebacks(self):
+        exact = self.backend.get_matching_tracebacks(TRACEBACK_TEXT, es_util.EXACT_MATCH, 10)
+        self.assertEqual([tb.origin_papertrail_id for tb in exact], [2, 1])
+        similar = self.backend.get_matching_tracebacks(TRACEBACK_TEXT, es_util.SIMILAR_MATCH, 10)
+        self.assertEqual([tb.origin_papertrail_id for tb in similar], [3, 2, 1])
+
+    def test_jira_issues(self):
+        self.backend.save_jira_issue(make_jira_issue(
+            'PPC-1', 'campaign loading is broken', 'we see this a lot:\n' + TRACEBACK_TEXT
+        ))
+        self.backend.save_jira_issue(make_jira_issue('PPC-2', 'reports', UNRELATED_TRACEBACK_TEXT))
+        self.assertEqual(self.backend.get_num_jira_issues(), 2)
+
+        def keys(jira_issues):
+            return sorted(jira_issue.key for jira_issue in jira_issues)
+        self.assertEqual(
+            keys(self.backend.get_matching_jira_issues(TRACEBACK_TEXT, es_util.EXACT_MATCH)),
+            ['PPC-1']
+        )
+        self.assertEqual(
+            keys(self.backend.get_matching_jira_issues(
+                SIMILAR_TRACEBACK_TEXT, es_util.EXACT_MATCH
+            )),
+            []
+        )
+        self.assertEqual(
+            keys(self.backend.get_matching_jira_issues(
+                TRACEBACK_TEXT.replace('line 88', 'line 90'), es_util.EXACT_MATCH
+            )),
+            ['PPC-1']
+        )
+        self.assertEqual(
+            keys(self.backend.get_matching_jira_issues(
+                SIMILAR_TRACEBACK_TEXT, es_util.SIMILAR_MATCH
+            )),
+            ['PPC-1']
+        )
+        self.assertEqual(keys(self.backend.search_jira_issues('campaign load', 10)), ['PPC-1'])
+        self.assertEqual(keys(self.backend.search_jira_issues('PPC-2', 10)), ['PPC-2'])
+
+        self.backend.remove_jira_issue('PPC-1')
+        self.assertEqual(self.backend.get_num_jira_issues(), 1)
+        self.assertEqual(
+            self.backend.get_matching_jira_issues(TRACEBACK_TEXT, es_util.EXACT_MATCH), []
+        )
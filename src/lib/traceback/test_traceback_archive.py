@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+
+from lib.traceback import traceback_archive
+
+
+def make_source(id_, signature):
+    return {
+        "origin_papertrail_id": id_,
+        "traceback_signature": signature,
+        "traceback_text": "Traceback (most recent call last):\nKeyError: %s" % id_,
+    }
+
+
+class TestTracebackArchive(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+        traceback_archive.write_segment(2018, 3, (
+            make_source(id_, 'abc' if id_ % 2 else 'def') for id_ in range(1, 251)
+        ), self.path)
+        traceback_archive.write_segment(2018, 4, [
+            make_source(id_, 'abc') for id_ in range(300, 310)
+        ], self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_source(self):
+        self.assertEqual(traceback_archive.get_segments(self.path), [(2018, 4), (2018, 3)])
+        self.assertEqual(traceback_archive.get_source(123, self.path), make_source(123, 'abc'))
+        self.assertEqual(traceback_archive.get_source(305, self.path), make_source(305, 'abc'))
+        self.assertIsNone(traceback_archive.get_source(299, self.path))
+
+    def test_get_matching_sources(self):
+        sources = traceback_archive.get_matching_sources(['abc'], 15, self.path)
+        self.assertEqual(
+            [source['origin_papertrail_id'] for source in sources],
+            list(range(309, 299, -1)) + [249, 247, 245, 243, 241]
+        )
+        self.assertEqual(traceback_archive.get_matching_sources(['xyz'], 15, self.path), [])
+
+    def test_rewrite_segment(self):
+        count = traceback_archive.write_segment(2018, 4, (
+            make_source(id_, 'xyz') for id_ in (305, 310)
+        ), self.path)
+        self.assertEqual(count, 2)
+        self.assertEqual(
+            len(traceback_archive.get_matching_sources(['abc', 'xyz'], 11, self.path)), 11
+        )
+        self.assertEqual(traceback_archive.get_matching_sources(['xyz'], 11, self.path), [
+            make_source(310, 'xyz'), make_source(305, 'xyz')
+        ])
+        self.assertEqual(traceback_archive.get_source(305, self.path), make_source(305, 'xyz'))
+        self.assertEqual(traceback_archive.get_source(301, self.path), make_source(301, 'abc'))
+        self.assertEqual(len([
+            name for name in os.listdir(self.path) if name.startswith('tracebacks-2018-04')
+        ]), 2)
+
+        self.assertEqual(
+            traceback_archive.delete_segments_before((2018, 4), self.path), [(2018, 3)]
+        )
+        self.assertEqual(traceback_archive.get_segments(self.path), [(2018, 4)])
+        self.assertIsNone(traceback_archive.get_source(123, self.path))
+
+    def test_is_persistent(self):
+        self.assertFalse(traceback_archive.is_persistent('traceback-archive'))
+        self.assertFalse(traceback_archive.is_persistent(os.path.sep))
@@ -0,0 +1,33 @@
+import datetime
+import unittest
+
+from lib.traceback import traceback_db
+
+
+class FakeElasticsearch():
+    """ A cluster without any partition covering the dates we search """
+    def search(self, **kwargs): # pylint: disable=unused-argument
+        return {
+            "took": 1,
+            "timed_out": False,
+            "_shards": {"total": 0, "successful": 0, "skipped": 0, "failed": 0},
+            "hits": {"total": 0, "max_score": 0.0, "hits": []},
+        }
+
+
+class TestGetTracebacksWithCounts(unittest.TestCase):
+    def test_no_partitions(self):
+        day = datetime.date(2001, 2, 3)
+        self.assertEqual(
+            traceback_db.get_tracebacks_with_counts(FakeElasticsearch(), None, day, day),
+            ([], 0, {}),
+        )
+
+
+class TestCountOccurrences(unittest.TestCase):
+    def test_no_partitions(self):
+        self.assertEqual(traceback_db._count_occurrences(
+            FakeElasticsearch(), None, ['abc'], 'hour',
+            datetime.datetime(2001, 2, 3, tzinfo=datetime.timezone.utc),
+            datetime.datetime(2001, 2, 4, tzinfo=datetime.timezone.utc),
+        ), {})
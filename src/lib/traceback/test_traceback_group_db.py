@@ -0,0 +1,83 @@
+import json
+import unittest
+
+import elasticsearch.serializer
+
+from common_util.testing_util import make_traceback
+from lib.traceback import traceback_group_db
+
+
+class FakeTransport():
+    serializer = elasticsearch.serializer.JSONSerializer()
+
+
+class FakeElasticsearch():
+    """ Runs the bulk requests of our occurrence claims and group upserts """
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.claims = set()
+        self.counts = {}
+        self.unavailable_signatures = set()
+
+    def bulk(self, body, **kwargs): # pylint: disable=unused-argument
+        lines = [json.loads(line) for line in body.splitlines() if line]
+        items = []
+        while lines:
+            op_type, action = next(iter(lines.pop(0).items()))
+            result = {"_id": action['_id'], "status": 200}
+            if op_type == 'delete':
+                self.claims.discard(action['_id'])
+            elif op_type == 'create':
+                lines.pop(0)
+                if action['_id'] in self.claims:
+                    result.update(status=409, error={"type": 'version_conflict_engine_exception'})
+                else:
+                    self.claims.add(action['_id'])
+                    result.update(status=201)
+            elif action['_id'] in self.unavailable_signatures:
+                lines.pop(0)
+                result.update(status=503, error={"type": 'unavailable_shards_exception'})
+            else:
+                occurrences = lines.pop(0)['script']['params']['occurrences']
+                self.counts[action['_id']] = self.counts.get(action['_id'], 0) + len(occurrences)
+            items.append({op_type: result})
+        return {
+            "took": 1,
+            "errors": any(next(iter(item.values()))['status'] >= 300 for item in items),
+            "items": items,
+        }
+
+
+class TestAddOccurrences(unittest.TestCase):
+    def setUp(self):
+        self.original_invalidate_cache = traceback_group_db.invalidate_cache
+        traceback_group_db.invalidate_cache = lambda: None
+        self.es = FakeElasticsearch()
+        self.tracebacks = [
+            make_traceback(1, 'KeyError: 1'),
+            make_traceback(2, 'KeyError: 1'),
+            make_traceback(3, 'ValueError: 2'),
+        ]
+        self.signatures = [tb.traceback_signature for tb in self.tracebacks]
+
+    def tearDown(self):
+        traceback_group_db.invalidate_cache = self.original_invalidate_cache
+
+    def test_counts_each_traceback_once(self):
+        self.assertEqual(traceback_group_db.add_occurrences(self.es, self.tracebacks), (3, []))
+        self.assertEqual(traceback_group_db.add_occurrences(self.es, self.tracebacks), (0, []))
+        self.assertEqual(self.es.counts, {self.signatures[0]: 2, self.signatures[2]: 1})
+
+    def test_failed_groups_are_counted_when_tried_again(self):
+        self.es.unavailable_signatures.add(self.signatures[0])
+        num_added, errors = traceback_group_db.add_occurrences(self.es, self.tracebacks)
+        self.assertEqual(num_added, 1)
+        self.assertEqual(
+            sorted((error['update']['_id'], error['update']['status']) for error in errors),
+            [('1', 503), ('2', 503)],
+        )
+        self.assertEqual(self.es.claims, {'3'})
+
+        self.es.unavailable_signatures.clear()
+        self.assertEqual(traceback_group_db.add_occurrences(self.es, self.tracebacks), (2, []))
+        self.assertEqual(self.es.counts, {self.signatures[0]: 2, self.signatures[2]: 1})
@@ -0,0 +1,75 @@
+import unittest
+
+from lib.traceback import traceback_minhash
+
+
+TRACEBACK_TEXT = '''Traceback (most recent call last):
+  File "/opt/wordstream/engine/rpc.py", line 12, in handle
+    return self.do_stuff(fields, params)
+  File "/opt/wordstream/engine/campaigns.py", line 88, in do_stuff
+    campaign = self.load_campaign(params['campaign_id'])
+  File "/opt/wordstream/engine/campaigns.py", line 120, in load_campaign
+    return self.cache[campaign_id]
+KeyError: 'campaign_id'
+'''
+
+DIFFERENT_LINE_NUMBER = TRACEBACK_TEXT.replace('line 120', 'line 1337')
+
+DIFFERENT_MESSAGE = TRACEBACK_TEXT.replace("KeyError: 'campaign_id'", "KeyError: 'account_id'")
+
+DIFFERENT_FRAME = TRACEBACK_TEXT.replace(
+    '''  File "/opt/wordstream/engine/campaigns.py", line 120, in load_campaign
+    return self.cache[campaign_id]
+''',
+    '''  File "/opt/wordstream/engine/cache.py", line 20, in get_cached
+    value = self.store.fetch(key)
+'''
+)
+
+UNRELATED_TRACEBACK = '''Traceback (most recent call last):
+  File "/opt/wordstream/reporting/views.py", line 5, in render
+    template.render(context)
+ValueError: bad template
+'''
+
+
+class TestTracebackMinhash(unittest.TestCase):
+    def assertSimilarity(self, text_a, text_b, is_similar):
+        minhash_a = traceback_minhash.generate_minhash(text_a)
+        minhash_b = traceback_minhash.generate_minhash(text_b)
+        self.assertEqual(traceback_minhash.is_similar(minhash_a, minhash_b), is_similar)
+        # similar texts must also be found through their band keys
+        shares_band_key = bool(
+            set(traceback_minhash.generate_band_keys(minhash_a))
+            & set(traceback_minhash.generate_band_keys(minhash_b))
+        )
+        if is_similar:
+            self.assertTrue(shares_band_key)
+
+    def test_minhash_is_stable(self):
+        minhash = traceback_minhash.generate_minhash(TRACEBACK_TEXT)
+        self.assertEqual(len(minhash), traceback_minhash.NUM_HASHES)
+        self.assertEqual(minhash, traceback_minhash.generate_minhash(TRACEBACK_TEXT))
+        self.assertEqual(
+            traceback_minhash.estimate_similarity(
+                minhash, traceback_minhash.generate_minhash(DIFFERENT_LINE_NUMBER)
+            ),
+            1.0
+        )
+
+    def test_similar_tracebacks(self):
+        """
+            Tracebacks with a different exception message or frame are similar. The old 'drop the
+            last word' phrase query misses the different frame
+        """
+        self.assertSimilarity(TRACEBACK_TEXT, DIFFERENT_MESSAGE, True)
+        self.assertSimilarity(TRACEBACK_TEXT, DIFFERENT_FRAME, True)
+
+    def test_unrelated_tracebacks(self):
+        self.assertSimilarity(TRACEBACK_TEXT, UNRELATED_TRACEBACK, False)
+
+    def test_empty_text(self):
+        minhash = traceback_minhash.generate_minhash('')
+        self.assertEqual(minhash, [])
+        self.assertEqual(traceback_minhash.generate_band_keys(minhash), [])
+        self.assertFalse(traceback_minhash.is_similar(minhash, minhash))
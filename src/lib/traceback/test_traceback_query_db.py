@@ -0,0 +1,37 @@
+import unittest
+
+from common_util import es_util
+from common_util.testing_util import make_traceback
+from lib.jira import jira_issue_match
+from lib.traceback import traceback_query_db
+
+
+class FakeElasticsearch():
+    """ Records the searches we send, and finds nothing """
+    def __init__(self):
+        self.searches = []
+
+    def msearch(self, body):
+        self.searches.extend(zip(body[::2], body[1::2]))
+        return {"responses": [
+            {"hits": {"total": 0, "max_score": 0.0, "hits": []}} for _ in body[1::2]
+        ]}
+
+
+class TestSearchMatchingJiraIssues(unittest.TestCase):
+    def test_uses_the_registered_query(self):
+        traceback = make_traceback(1)
+        es = FakeElasticsearch()
+        self.assertEqual(
+            traceback_query_db.search_matching_jira_issues(
+                es, [traceback.traceback_text], es_util.EXACT_MATCH
+            ),
+            {traceback.traceback_text: []},
+        )
+
+        self.assertEqual(len(es.searches), 1)
+        header, body = es.searches[0]
+        self.assertEqual(header['index'], jira_issue_match.INDEX)
+        self.assertEqual(body['query'], traceback_query_db.generate_query(
+            traceback.traceback_text, es_util.EXACT_MATCH
+        ))
@@ -0,0 +1,46 @@
+import unittest
+
+from lib.traceback.traceback import generate_signature
+
+
+TRACEBACK_TEXT = '''Traceback (most recent call last):
+  File "/opt/wordstream/engine/rpc.py", line 12, in handle
+    return self.do_stuff(fields, params)
+KeyError: 'campaign_id'
+'''
+
+SAME_TRACEBACK_DIFFERENT_LINE_NUMBER = TRACEBACK_TEXT.replace('line 12', 'line 1337')
+
+SAME_TRACEBACK_DIFFERENT_WHITESPACE = TRACEBACK_TEXT.replace('\n  ', '\n\t').rstrip()
+
+DIFFERENT_TRACEBACK = TRACEBACK_TEXT.replace('KeyError', 'ValueError')
+
+
+class TestTracebackSignature(unittest.TestCase):
+    def test_signature_is_stable(self):
+        """
+            The same text always generates the same signature
+        """
+        self.assertEqual(generate_signature(TRACEBACK_TEXT), generate_signature(TRACEBACK_TEXT))
+
+    def test_signature_ignores_numbers_and_whitespace(self):
+        """
+            Line numbers and whitespace don't change the signature, just like our ES analyzer
+        """
+        self.assertEqual(
+            generate_signature(TRACEBACK_TEXT),
+            generate_signature(SAME_TRACEBACK_DIFFERENT_LINE_NUMBER)
+        )
+        self.assertEqual(
+            generate_signature(TRACEBACK_TEXT),
+            generate_signature(SAME_TRACEBACK_DIFFERENT_WHITESPACE)
+        )
+
+    def test_different_tracebacks_have_different_signatures(self):
+        """
+            A change to the words of the traceback changes the signature
+        """
+        self.assertNotEqual(
+            generate_signature(TRACEBACK_TEXT),
+            generate_signature(DIFFERENT_TRACEBACK)
+        )
@@ -0,0 +1,80 @@
+import pickle
+import unittest
+
+from lib.traceback import traceback
+from lib.traceback.traceback import (
+    HEAVY_TEXT_FIELDS,
+    generate_traceback_from_source,
+)
+
+
+SOURCE: dict = {
+    "traceback_text": "Traceback (most recent call last):\nKeyError: 'campaign_id'\n",
+    "origin_papertrail_id": 700594297938165774,
+    "origin_timestamp": "2016-08-12T03:18:39",
+    "instance_id": "i-2ee330b7",
+    "program_name": "manager.debug",
+    "profile_name": "some_profile",
+    "username": None,
+}
+
+TEXT_FIELDS = {
+    "traceback_plus_context_text": "context\n" + SOURCE["traceback_text"],
+    "raw_traceback_text": "raw " + SOURCE["traceback_text"],
+    "raw_full_text": "raw context\nraw " + SOURCE["traceback_text"],
+}
+
+
+class TestTracebackTextLoading(unittest.TestCase):
+    def setUp(self):
+        self.loaded_ids = []
+        def loader(id_):
+            self.loaded_ids.append(id_)
+            return TEXT_FIELDS
+        traceback.set_text_loader(loader)
+
+    def tearDown(self):
+        traceback.set_text_loader(None)
+
+    def test_text_is_loaded_once_on_first_access(self):
+        """
+            Unloaded text fields are fetched together, the first time one of them is read
+        """
+        tb = generate_traceback_from_source(SOURCE, HEAVY_TEXT_FIELDS)
+        self.assertEqual(tb.traceback_text, SOURCE["traceback_text"])
+        self.assertEqual(self.loaded_ids, [])
+
+        self.assertEqual(tb.raw_full_text, TEXT_FIELDS["raw_full_text"])
+        self.assertEqual(tb.traceback_plus_context_text, TEXT_FIELDS["traceback_plus_context_text"])
+        self.assertEqual(self.loaded_ids, [SOURCE["origin_papertrail_id"]])
+
+    def test_loaded_fields_are_not_replaced(self):
+        """
+            Fields that our query did return are kept as they were
+        """
+        source = dict(SOURCE, traceback_plus_context_text='from the query')
+        tb = generate_traceback_from_source(source, ('raw_traceback_text', 'raw_full_text'))
+        self.assertEqual(tb.raw_full_text, TEXT_FIELDS["raw_full_text"])
+        self.assertEqual(tb.traceback_plus_context_text, 'from the query')
+
+    def test_document_includes_loaded_text(self):
+        """
+            Saving a partially loaded traceback doesn't erase its text
+        """
+        tb = generate_traceback_from_source(SOURCE, HEAVY_TEXT_FIELDS)
+        document = tb.document()
+        for field, value in TEXT_FIELDS.items():
+            self.assertEqual(document[field], value)
+
+    def test_unpickled_traceback_loads_text(self):
+        """
+            Tracebacks read back from our cache can still load their text
+        """
+        tb = pickle.loads(pickle.dumps(generate_traceback_from_source(SOURCE, HEAVY_TEXT_FIELDS)))
+        self.assertEqual(tb.raw_full_text, TEXT_FIELDS["raw_full_text"])
+        self.assertEqual(self.loaded_ids, [SOURCE["origin_papertrail_id"]])
+
+    def test_repr_does_not_load_text(self):
+        tb = generate_traceback_from_source(SOURCE, HEAVY_TEXT_FIELDS)
+        repr(tb)
+        self.assertEqual(self.loaded_ids, [])
@@ -0,0 +1,126 @@
+import datetime
+import unittest
+
+from dogpile.cache import make_region
+
+from lib.traceback import (
+    traceback_db,
+    traceback_timeseries,
+)
+from lib.traceback.traceback import Traceback
+
+
+UTC = datetime.timezone.utc
+
+
+class TestTracebackTimeseries(unittest.TestCase):
+    def test_day_buckets(self):
+        buckets = traceback_timeseries.get_buckets(
+            'day', datetime.date(2018, 4, 29), datetime.date(2018, 5, 1)
+        )
+        self.assertEqual([start.day for start, _ in buckets], [29, 30, 1])
+        self.assertEqual(buckets[-1][1], datetime.datetime(2018, 5, 2, tzinfo=UTC))
+
+    def test_buckets_cover_whole_intervals(self):
+        weeks = traceback_timeseries.get_buckets(
+            'week', datetime.date(2018, 4, 4), datetime.date(2018, 4, 9)
+        )
+        self.assertEqual(weeks, [
+            (datetime.datetime(2018, 4, 2, tzinfo=UTC), datetime.datetime(2018, 4, 9, tzinfo=UTC)),
+            (datetime.datetime(2018, 4, 9, tzinfo=UTC), datetime.datetime(2018, 4, 16, tzinfo=UTC)),
+        ])
+        months = traceback_timeseries.get_buckets(
+            'month', datetime.date(2017, 12, 15), datetime.date(2018, 1, 3)
+        )
+        self.assertEqual([start.month for start, _ in months], [12, 1])
+        self.assertEqual(months[-1][1], datetime.datetime(2018, 2, 1, tzinfo=UTC))
+
+    def test_bucket_start_is_utc(self):
+        eastern = datetime.timezone(datetime.timedelta(hours=-4))
+        self.assertEqual(
+            traceback_timeseries.get_bucket_start(
+                'hour', datetime.datetime(2018, 4, 1, 22, 30, tzinfo=eastern)
+            ),
+            datetime.datetime(2018, 4, 2, 2, tzinfo=UTC)
+        )
+        self.assertEqual(
+            traceback_timeseries.get_bucket_start('day', datetime.datetime(2018, 4, 1, 22, 30)),
+            datetime.datetime(2018, 4, 1, tzinfo=UTC)
+        )
+
+    def test_too_many_buckets(self):
+        with self.assertRaises(ValueError):
+            traceback_timeseries.get_buckets(
+                'hour', datetime.date(2017, 1, 1), datetime.date(2018, 1, 1)
+            )
+
+
+class TestOccurrenceCountCache(unittest.TestCase):
+    def setUp(self):
+        self.original_region = traceback_db.TIMESERIES_DOGPILE_REGION
+        self.original_count_occurrences = traceback_db._count_occurrences
+        traceback_db.TIMESERIES_DOGPILE_REGION = make_region().configure('dogpile.cache.memory')
+        traceback_db._count_occurrences = self.count_occurrences
+        self.counted = []
+        self.tracebacks = []
+
+    def tearDown(self):
+        traceback_db.TIMESERIES_DOGPILE_REGION = self.original_region
+        traceback_db._count_occurrences = self.original_count_occurrences
+
+    def count_occurrences(self, es, tracer, signatures, interval, start, end):
+        # pylint: disable=unused-argument
+        self.counted.append((start, end))
+        counts = {}
+        for traceback in self.tracebacks:
+            key = (
+                traceback.traceback_signature,
+                traceback_timeseries.get_bucket_start(interval, traceback.origin_timestamp),
+            )
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def save(self, timestamp):
+        traceback = Traceback(
+            'KeyError: 1', 'KeyError: 1', 'KeyError: 1', 'KeyError: 1', 1, timestamp,
+            'i-2ee330b7', 'manager.debug',
+        )
+        self.tracebacks.append(traceback)
+        traceback_db._invalidate_timeseries_buckets([traceback])
+        return traceback.traceback_signature
+
+    def get_counts(self, signature, day):
+        return [
+            count for _, count in traceback_db.get_occurrence_counts(
+                None, None, [signature], 'hour', day, day
+            )[signature]
+        ]
+
+    def test_caches_settled_buckets(self):
+        day = datetime.date(2018, 4, 1)
+        signature = self.save(datetime.datetime(2018, 4, 1, 3, 30, tzinfo=UTC))
+        self.assertEqual(sum(self.get_counts(signature, day)), 1)
+        self.assertEqual(sum(self.get_counts(signature, day)), 1)
+        self.assertEqual(len(self.counted), 1)
+
+        # a late traceback drops the bucket it falls in, and only that bucket is counted again
+        self.save(datetime.datetime(2018, 4, 1, 3, 45, tzinfo=UTC))
+        self.assertEqual(sum(self.get_counts(signature, day)), 2)
+        self.assertEqual(self.counted[1], (
+            datetime.datetime(2018, 4, 1, 3, tzinfo=UTC),
+            datetime.datetime(2018, 4, 1, 4, tzinfo=UTC),
+        ))
+
+    def test_recent_buckets_are_not_cached(self):
+        now = datetime.datetime.now(UTC)
+        signature = self.save(now)
+        self.assertEqual(sum(self.get_counts(signature, now.date())), 1)
+        # the count ES gave before its refresh isn't kept
+        self.save(now)
+        self.assertEqual(sum(self.get_counts(signature, now.date())), 2)
+        self.assertEqual(
+            [end for _, end in self.counted],
+            [traceback_timeseries.get_bucket_end('day', traceback_timeseries.get_bucket_start(
+                'day', now
+            ))] * 2,
+        )
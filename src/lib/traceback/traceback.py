@@ -1,6 +1,52 @@
 import datetime
+import hashlib
+import re
 import typing
 
+from common_util import cache_serializer
+
+
+HEAVY_TEXT_FIELDS = (
+    'traceback_plus_context_text',
+    'raw_traceback_text',
+    'raw_full_text',
+)
+"""
+    The L{Traceback} fields that hold context text. They make up most of a traceback document, so
+    list and search queries may leave them out; those Tracebacks load them on first access.
+"""
+
+_text_loader: typing.Optional[typing.Callable[[int], dict]] = None
+
+
+def set_text_loader(loader:typing.Callable[[int], dict]):
+    """
+        Registers the function L{Traceback}s use to load text fields their query left out
+
+        The loader takes an origin_papertrail_id and returns the source dict of that traceback.
+        It's module-level (rather than held by each Traceback) so that Tracebacks we've pickled
+        into the cache can still load their text.
+    """
+    global _text_loader
+    _text_loader = loader
+
+
+SIGNATURE_FILTER_REGEX = re.compile(
+    '_|args|File|framework_cherrypy.py|handler_wrapper|hooks|in|kwargs|lib|line|local|newrelic|'
+    'opt|packages|python2.7|return|site|venv|wordstream_virtualenv|wrapped'
+)
+"""
+    Substrings we strip from traceback text before building its signature.
+
+    This mirrors the 'newrelic_and_underscore_filter' char filter in our ES mappings, so that two
+    tracebacks that the 'traceback_filtered' analyzer considers identical get identical signatures.
+"""
+
+SIGNATURE_TOKEN_REGEX = re.compile(r'[^\W\d_]+')
+"""
+    Matches runs of letters. Mirrors the 'letter' tokenizer used by our ES mappings.
+"""
+
 
 class Traceback():
     """
@@ -36,6 +82,11 @@ class Traceback():
             program name. example: manager.debug
         - profile_name: the profile name that hit the error. may be None
         - username: the user name that hit the error. may be None
+        - traceback_signature: a hash of the normalized traceback_text. tracebacks with the same
+            signature are considered an exact match of each other. see L{generate_signature}
+
+        The L{HEAVY_TEXT_FIELDS} named in L{unloaded_fields} were left out of the query that built
+        this Traceback. They're loaded (all together) the first time one of them is read.
     """
     def __init__(
             self,
@@ -49,6 +100,7 @@ class Traceback():
             program_name,
             profile_name=None,
             username=None,
+            unloaded_fields=frozenset(),
     ):
         assert isinstance(origin_timestamp, datetime.datetime), (
             type(origin_timestamp), origin_timestamp
@@ -64,9 +116,28 @@ class Traceback():
         self._program_name = program_name
         self._profile_name = profile_name
         self._username = username
+        self._unloaded_fields = frozenset(unloaded_fields)
 
     def __repr__(self) -> str:
-        return str(self.document())
+        # don't load our text just to print ourselves
+        return str(self._fields())
+
+    def _load_text_fields(self):
+        if not self._unloaded_fields:
+            return
+        if _text_loader is None:
+            raise RuntimeError(
+                'traceback %s was loaded without %s and no text loader is registered' %
+                (self._origin_papertrail_id, sorted(self._unloaded_fields))
+            )
+        source = _text_loader(self._origin_papertrail_id)
+        if 'traceback_plus_context_text' in self._unloaded_fields:
+            self._traceback_plus_context_text = source.get("traceback_plus_context_text", None)
+        if 'raw_traceback_text' in self._unloaded_fields:
+            self._raw_traceback_text = source.get("raw_traceback_text", None)
+        if 'raw_full_text' in self._unloaded_fields:
+            self._raw_full_text = source.get("raw_full_text", 'raw_text')
+        self._unloaded_fields = frozenset()
 
     @property
     def traceback_text(self) -> str:
@@ -74,14 +145,20 @@ class Traceback():
 
     @property
     def traceback_plus_context_text(self) -> str:
+        self._load_text_fields()
         # not guaranteed to exist
         if self._traceback_plus_context_text is None:
             return self.traceback_text
 
         return self._traceback_plus_context_text
 
+    @property
+    def traceback_signature(self) -> str:
+        return generate_signature(self._traceback_text)
+
     @property
     def raw_traceback_text(self) -> str:
+        self._load_text_fields()
         # not guaranteed to exist
         if self._raw_full_text is None:
             return self.traceback_text
@@ -90,6 +167,7 @@ class Traceback():
 
     @property
     def raw_full_text(self) -> str:
+        self._load_text_fields()
         return self._raw_full_text
 
     @property
@@ -128,10 +206,16 @@ class Traceback():
         """
             Returns the document form of this logline for ElasticSearch.
 
-            Document form is a dictionary of <field name>: <value> pairs.
+            Document form is a dictionary of <field name>: <value> pairs. Loads any text fields
+            that were left out of our query, so that saving the document doesn't erase them.
         """
+        self._load_text_fields()
+        return self._fields()
+
+    def _fields(self) -> dict:
         return {
             "traceback_text": self._traceback_text,
+            "traceback_signature": self.traceback_signature,
             "traceback_plus_context_text": self._traceback_plus_context_text,
             "raw_traceback_text": self._raw_traceback_text,
             "raw_full_text": self._raw_full_text,
@@ -144,10 +228,39 @@ class Traceback():
         }
 
 
-def generate_traceback_from_source(source:dict) -> Traceback:
+def generate_signature(traceback_text:str) -> str:
+    """
+        Creates the signature of the given traceback text.
+
+        The text is normalized the same way our ES analyzer would see it (noise substrings removed,
+        split into runs of letters) and the resulting tokens are hashed. Line numbers, whitespace
+        and punctuation therefore do not change a signature.
+
+        @return: the hex digest of the normalized text
+    """
+    normalized_text = ' '.join(generate_tokens(traceback_text))
+    return hashlib.sha1(normalized_text.encode('utf-8')).hexdigest()
+
+
+def generate_tokens(traceback_text:str) -> typing.List[str]:
+    """
+        Splits the given traceback text into the tokens our ES analyzer would see: noise substrings
+        removed, then split into runs of letters
+    """
+    filtered_text = re.sub(SIGNATURE_FILTER_REGEX, '', traceback_text)
+    return re.findall(SIGNATURE_TOKEN_REGEX, filtered_text)
+
+
+def generate_traceback_from_source(source:dict, unloaded_fields:typing.Iterable[str]=()
+) -> Traceback:
     """
         L{source} is a dictionary (from ElasticSearch) containing the fields of a L{Traceback}
+
+        L{unloaded_fields} are the L{HEAVY_TEXT_FIELDS} that our query excluded from L{source}
     """
+    unloaded_fields = frozenset(unloaded_fields)
+    assert unloaded_fields <= frozenset(HEAVY_TEXT_FIELDS), unloaded_fields
+
     # We get the datetime as a string, we need to parse it out
     try:
         timestamp = datetime.datetime.strptime(
@@ -172,4 +285,28 @@ def generate_traceback_from_source(source:dict) -> Traceback:
         source["program_name"],
         source.get("profile_name", None),  # not guaranteed to exist
         source.get("username", None),  # not guaranteed to exist
+        unloaded_fields,
     )
+
+
+def _get_cache_fields(traceback:Traceback) -> tuple:
+    """
+        The fields we cache a L{Traceback} as, in the order its constructor takes them. Text fields
+        its query left out stay unloaded
+    """
+    return (
+        traceback._traceback_text,
+        traceback._traceback_plus_context_text,
+        traceback._raw_traceback_text,
+        traceback._raw_full_text,
+        traceback._origin_papertrail_id,
+        traceback._origin_timestamp,
+        traceback._instance_id,
+        traceback._program_name,
+        traceback._profile_name,
+        traceback._username,
+        sorted(traceback._unloaded_fields),
+    )
+
+
+cache_serializer.register_type('traceback', Traceback, _get_cache_fields)
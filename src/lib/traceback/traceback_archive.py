@@ -0,0 +1,279 @@
+"""
+    Our cold tier: tracebacks too old to keep in ES, saved as compressed JSON lines on disk.
+
+    Each month of tracebacks is one segment, made of two files:
+    - tracebacks-YYYY-MM.index.json.gz: the name of the segment's data file, the offset and length
+      of each of its blocks, the block each traceback id is in, and the ids of the tracebacks with
+      each signature
+    - tracebacks-YYYY-MM.<generation>.jsonl.gz: the data file. The ES _source of each traceback,
+      one per line. Lines are compressed in blocks of L{BLOCK_SIZE}, each its own gzip member, so
+      the file is still a plain .jsonl.gz but we only need to decompress one block to read a
+      traceback
+
+    Reads are much slower than ES (we load an index and decompress a block per lookup), which is
+    fine for the old tracebacks we only need for the occasional jira hit list.
+"""
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+
+import cachetools
+
+from common_util import (
+    config_util,
+    file_util,
+)
+
+
+ARCHIVE_PATH = config_util.get('TRACEBACK_ARCHIVE_PATH')
+"""
+    Directory we keep the archive segments in. Must be on a volume that's shared by our web servers
+    and workers, and outlives them (see L{is_persistent})
+"""
+
+BLOCK_SIZE = 100
+"""
+    Number of tracebacks we compress together. Bigger blocks compress better, but we have to
+    decompress a whole block to read one traceback
+"""
+
+SEGMENT_TEMPLATE = 'tracebacks-%04d-%02d'
+
+SEGMENT_REGEX = re.compile(r'^tracebacks-(\d{4})-(\d{2})\.index\.json\.gz$')
+"""
+    Matches the name of a segment's index file. We write the index after the data file, so a
+    segment only counts once its index exists
+"""
+
+INDEX_CACHE_SIZE = 16
+"""
+    Number of segment indices we keep loaded. An index holds the block of every traceback id in its
+    month, so they can be big
+"""
+
+logger = logging.getLogger()
+
+_indices: cachetools.LRUCache = cachetools.LRUCache(maxsize=INDEX_CACHE_SIZE)
+"""
+    Index path -> (modification time of the index file, the loaded index). We reload an index once
+    its segment is rewritten
+"""
+_indices_lock = threading.Lock()
+
+
+def is_persistent(path:str=ARCHIVE_PATH) -> bool:
+    """
+        Returns True if the archive is on a mounted volume. Otherwise it's on the container's own
+        disk, where it would be lost with the container (and our other containers can't read it)
+    """
+    return file_util.is_on_volume(path)
+
+
+def write_segment(year:int, month:int, sources:Iterable[dict], path:str=ARCHIVE_PATH) -> int:
+    """
+        Writes the given traceback sources to the segment of the given month
+
+        Sources are written as they come, a block at a time, so we never hold more than a block of
+        them in memory. If the month already has a segment, its tracebacks are copied over after
+        them, unless one of the given sources has the same id. The new segment gets a new data
+        file, and its index is written under a temporary name and then moved into place, so readers
+        never see a partial segment.
+
+        Returns the number of the given sources we wrote. Their ids must be unique
+    """
+    os.makedirs(path, exist_ok=True)
+    index_path = _get_index_path(year, month, path)
+    old_index = _read_index(index_path)
+    generation = 0
+    if old_index is not None:
+        generation = old_index['generation'] + 1
+
+    data_file = '%s.%s.jsonl.gz' % (SEGMENT_TEMPLATE % (year, month), generation)
+
+    blocks: List[Tuple[int, int]] = []
+    ids: Dict[str, int] = {}
+    signatures: Dict[str, List[int]] = {}
+    with open(os.path.join(path, data_file), 'wb') as f:
+        def write_block(block_sources:List[dict]):
+            data = gzip.compress(''.join(
+                json.dumps(source, sort_keys=True) + '\n' for source in block_sources
+            ).encode('utf-8'))
+            for source in block_sources:
+                id_ = int(source['origin_papertrail_id'])
+                ids[str(id_)] = len(blocks)
+                signatures.setdefault(source['traceback_signature'], []).append(id_)
+            blocks.append((f.tell(), len(data)))
+            f.write(data)
+
+        new_ids = set()
+        block_sources: List[dict] = []
+        for source in sources:
+            new_ids.add(str(source['origin_papertrail_id']))
+            block_sources.append(source)
+            if len(block_sources) == BLOCK_SIZE:
+                write_block(block_sources)
+                block_sources = []
+        if old_index is not None:
+            for source in _read_all(path, old_index):
+                if str(source['origin_papertrail_id']) in new_ids:
+                    continue
+                block_sources.append(source)
+                if len(block_sources) == BLOCK_SIZE:
+                    write_block(block_sources)
+                    block_sources = []
+        if block_sources:
+            write_block(block_sources)
+    index = {
+        "generation": generation,
+        "data_file": data_file,
+        "blocks": blocks,
+        "ids": ids,
+        "signatures": {
+            signature: sorted(signature_ids, reverse=True)
+            for signature, signature_ids in signatures.items()
+        },
+    }
+    with gzip.open(index_path + '.tmp', 'wt') as index_file:
+        json.dump(index, index_file)
+    os.replace(index_path + '.tmp', index_path)
+    if old_index is not None:
+        os.remove(os.path.join(path, old_index['data_file']))
+    logger.info(
+        'wrote %s tracebacks to archive segment %s, %s of them new',
+        len(ids), data_file, len(new_ids),
+    )
+    return len(new_ids)
+
+
+def get_segments(path:str=ARCHIVE_PATH) -> List[Tuple[int, int]]:
+    """
+        Returns the (year, month) of every segment in the archive, newest first
+    """
+    try:
+        names = os.listdir(path)
+    except FileNotFoundError:
+        return []
+    months = []
+    for name in names:
+        match = SEGMENT_REGEX.match(name)
+        if match is not None:
+            months.append((int(match.group(1)), int(match.group(2))))
+    return sorted(months, reverse=True)
+
+
+def delete_segments_before(oldest_month_to_keep:Tuple[int, int], path:str=ARCHIVE_PATH
+) -> List[Tuple[int, int]]:
+    """
+        Deletes every segment older than the given (year, month)
+
+        Returns the (year, month) of the segments we deleted
+    """
+    deleted = []
+    for year, month in get_segments(path):
+        if (year, month) < oldest_month_to_keep:
+            index_path = _get_index_path(year, month, path)
+            index = _read_index(index_path)
+            os.remove(index_path)
+            if index is not None:
+                os.remove(os.path.join(path, index['data_file']))
+            deleted.append((year, month))
+    return deleted
+
+
+def get_source(id_:int, path:str=ARCHIVE_PATH) -> Optional[dict]:
+    """
+        Returns the source of the archived traceback with the given id, or None if it isn't in the
+        archive
+    """
+    for year, month in get_segments(path):
+        index = _read_index(_get_index_path(year, month, path))
+        if index is None:
+            continue
+        block = index['ids'].get(str(id_))
+        if block is None:
+            continue
+        for source in _read_block(path, index, block):
+            if int(source['origin_papertrail_id']) == id_:
+                return source
+    return None
+
+
+def get_matching_sources(signatures:Iterable[str], num_matches:int, path:str=ARCHIVE_PATH
+) -> List[dict]:
+    """
+        Returns the sources of the newest L{num_matches} archived tracebacks with any of the given
+        signatures, newest first
+    """
+    signatures = set(signatures)
+    res: List[dict] = []
+    for year, month in get_segments(path):
+        if len(res) >= num_matches:
+            break
+        index = _read_index(_get_index_path(year, month, path))
+        if index is None:
+            continue
+        # papertrail ids increase over time, so the biggest ids are the newest tracebacks
+        ids = sorted(
+            (id_ for signature in signatures for id_ in index['signatures'].get(signature, ())),
+            reverse=True
+        )[:num_matches - len(res)]
+        if not ids:
+            continue
+        wanted_ids = set(ids)
+        sources: List[dict] = []
+        for block in sorted(set(index['ids'][str(id_)] for id_ in ids)):
+            sources.extend(
+                source for source in _read_block(path, index, block)
+                if int(source['origin_papertrail_id']) in wanted_ids
+            )
+        sources.sort(key=lambda source: int(source['origin_papertrail_id']), reverse=True)
+        res.extend(sources)
+    return res
+
+
+def _get_index_path(year:int, month:int, path:str) -> str:
+    return os.path.join(path, '%s.index.json.gz' % (SEGMENT_TEMPLATE % (year, month)))
+
+
+def _read_index(index_path:str) -> Optional[dict]:
+    """
+        Returns the index of a segment, or None if the segment doesn't exist (or was just deleted)
+
+        Indices are cached in L{_indices} until their file changes
+    """
+    try:
+        mtime = os.path.getmtime(index_path)
+        with _indices_lock:
+            cached = _indices.get(index_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with gzip.open(index_path, 'rt') as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return None
+    with _indices_lock:
+        _indices[index_path] = (mtime, index)
+    return index
+
+
+def _read_block(path:str, index:dict, block:int) -> List[dict]:
+    offset, length = index['blocks'][block]
+    with open(os.path.join(path, index['data_file']), 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    return [json.loads(line) for line in gzip.decompress(data).decode('utf-8').splitlines()]
+
+
+def _read_all(path:str, index:dict) -> Iterable[dict]:
+    for block in range(len(index['blocks'])):
+        yield from _read_block(path, index, block)
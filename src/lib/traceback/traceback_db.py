@@ -3,18 +3,53 @@
 
     For all functions, `es` must be an instance of Elasticsearch
 """
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+import collections
+import datetime
+import functools
 import logging
+import re
+import time
 
+from dogpile.cache.api import NO_VALUE
 import elasticsearch
+import elasticsearch.helpers
 
 from opentracing_instrumentation.request_context import get_current_span
+import opentracing
 
 from common_util import (
+    config_util,
+    elasticsearch_config,
     es_util,
     redis_util,
     retry,
+    time_util,
+)
+from lib.jira import (
+    jira_issue_match,
+)
+from lib.traceback import (
+    traceback_archive,
+    traceback_group_db,
+    traceback_query_db,
+    traceback_timeseries,
+)
+from lib.traceback.traceback import (
+    HEAVY_TEXT_FIELDS,
+    Traceback,
+    generate_signature,
+    generate_traceback_from_source,
+    set_text_loader,
 )
-from lib.traceback.traceback import Traceback, generate_traceback_from_source
 
 
 logger = logging.getLogger()
@@ -25,15 +60,139 @@ DOGPILE_REGION = redis_util.make_dogpile_region(DOGPILE_REGION_PREFIX)
 def invalidate_cache():
     redis_util.force_redis_cache_invalidation(DOGPILE_REGION_PREFIX)
 
+TIMESERIES_DOGPILE_REGION_PREFIX = 'dogpile:timeseries'
+TIMESERIES_DOGPILE_REGION = redis_util.make_dogpile_region(
+    TIMESERIES_DOGPILE_REGION_PREFIX,
+    expiration_time=60*60*24*7,  # 1 week
+    redis_expiration_time=60*60*24*8,  # 8 days
+    local_cache_size=10000,  # each value is a single count
+)
+"""
+    Caches the occurrence count of each settled time series bucket (see L{get_occurrence_counts}).
+    Not cleared by L{invalidate_cache}: saving tracebacks only drops the buckets they fall in
+"""
+def invalidate_timeseries_cache():
+    redis_util.force_redis_cache_invalidation(TIMESERIES_DOGPILE_REGION_PREFIX)
+
+TIMESERIES_CACHE_DELAY_SECONDS = config_util.get('TIMESERIES_CACHE_DELAY_SECONDS')
+"""
+    How long after a time series bucket ends before we cache its count. Tracebacks reach ES a while
+    after they happen, and are only searchable after its next refresh, so we keep counting the
+    buckets that just ended
+"""
+
+
+INDEX = 'tracebacks'
+"""
+    Read alias over all of our traceback partitions. Added to each partition by our index template
+"""
+
+MAPPING_VERSION = 2
+"""
+    Version of scripts/es_mappings/traceback_index_template.json. Bump it (and the template's
+    index_patterns) whenever the mapping changes, then run L{reindex_partitions}
+"""
+
+INDEX_TEMPLATE = 'tracebacks-v%s-%%04d-%%02d' % MAPPING_VERSION
+"""
+    Template for the name of the partition a traceback is written to.
+
+    Takes the form tracebacks-vVERSION-YEAR-MONTH, where VERSION is our L{MAPPING_VERSION}, YEAR is
+    a 4 digit number and MONTH is 2. The year and month are taken from the traceback's
+    origin_timestamp
+"""
+
+READ_INDEX_TEMPLATE = 'tracebacks-*%04d-%02d'
+"""
+    Matches every partition for a given month, whatever its mapping version. While we reindex a
+    month it has a partition for both versions. Wildcards only expand to open indices, so the old
+    partitions that L{reindex_partitions} keeps (closed) are never read
+"""
+
+PARTITION_PATTERN = 'tracebacks-*'
+"""
+    Matches every partition of every month, open or closed
+"""
+
+INDEX_TEMPLATE_NAME = 'tracebacks-v%s' % MAPPING_VERSION
+"""
+    Name of the ES index template that holds the mapping and alias for our partitions. Created by
+    scripts/setup-es-database.sh
+"""
+
+PREVIOUS_INDEX_TEMPLATE_NAME = 'tracebacks'
+"""
+    Name of the index template of our first, unversioned partitions (tracebacks-YEAR-MONTH)
+"""
+
+PARTITION_REGEX = re.compile(r'^tracebacks-(?:v(\d+)-)?(\d{4})-(\d{2})$')
+"""
+    Matches the name of a partition of any mapping version. Unversioned partitions are version 1
+"""
+
+LEGACY_INDEX = 'traceback-index'
+"""
+    The single, unpartitioned index we used to save all tracebacks in
+"""
 
-INDEX = 'traceback-index'
 DOC_TYPE = 'traceback'
 
+TRACEBACK_RETENTION_MONTHS = config_util.get('TRACEBACK_RETENTION_MONTHS')
+"""
+    How many months of tracebacks to keep, including the current month. 0 keeps them forever
+"""
+
+TRACEBACK_ARCHIVE_MONTHS = config_util.get('TRACEBACK_ARCHIVE_MONTHS')
+"""
+    How many months of tracebacks to keep in ES, including the current month. Older months are
+    moved to our cold tier (see L{traceback_archive}). 0 keeps them all in ES
+"""
+
+BULK_CHUNK_SIZE = 500
+"""
+    Default number of tracebacks we send to ES in a single bulk request
+"""
+
+LIST_EXCLUDED_FIELDS = ('raw_traceback_text', 'raw_full_text')
+"""
+    Text fields we leave out of L{get_tracebacks}. The day view shows traceback_plus_context_text,
+    so we keep that one
+"""
+
+MATCH_EXCLUDED_FIELDS = HEAVY_TEXT_FIELDS
+"""
+    Text fields we leave out of our matching queries. Their callers only list the matches
+"""
+
+MAX_SIGNATURE_COUNTS = 10000
+"""
+    Max number of distinct signatures L{get_tracebacks_with_counts} counts. Days with more than
+    this leave the rarest signatures out
+"""
+
+SCROLL_PAGE_SIZE = 1000
+"""
+    Default number of tracebacks we fetch per request when iterating over a large result set
+"""
+
+SCROLL_TIMEOUT = '5m'
+"""
+    How long ES keeps a scroll alive between two of our page requests
+"""
+
+
+def register_text_loader(es):
+    """
+        Lets L{Traceback}s we loaded without their context text fetch it from L{es} when needed
+    """
+    set_text_loader(functools.partial(get_traceback_text_fields, es))
+
 
 @retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
 def save_traceback(es, traceback):
     """
-        Takes a L{Traceback} and saves it to the database
+        Takes a L{Traceback} and saves it to the database. If it's new, adds it to its traceback
+        group, and registers the jira queries for its signature if it's the first of its group
 
         Invalidates the dogpile cache.
 
@@ -42,15 +201,226 @@ def save_traceback(es, traceback):
     assert isinstance(traceback, Traceback), (type(traceback), traceback)
     doc = traceback.document()
     res = es.index(
-        index=INDEX,
+        index=_get_partition(traceback),
         doc_type=DOC_TYPE,
         id=traceback.origin_papertrail_id,
         body=doc
     )
     invalidate_cache()
+    if res.get('result') == 'created':
+        _, errors = add_to_groups(es, [traceback])
+        if not errors:
+            register_queries(es, [traceback])
     return res
 
 
+def save_tracebacks(es, tracebacks:Iterable[Traceback], chunk_size:int=BULK_CHUNK_SIZE
+) -> Tuple[int, List[dict]]:
+    """
+        Takes an iterable of L{Traceback} and saves them to the database using the bulk API
+
+        Tracebacks are sent to ES in requests of L{chunk_size} documents. A failure to index one
+        traceback does not stop the others from being saved; each failed item is logged and
+        returned to the caller.
+
+        Every traceback that's new to ES is then added to its traceback group, and we register the
+        jira queries of any signature we haven't seen before. Tracebacks we're saving again (a
+        reparse of logs we already loaded, say) only have their documents updated.
+
+        Invalidates the dogpile cache once, after the whole batch has been sent.
+
+        Returns a tuple of (number of tracebacks saved, list of per-item error dicts from ES)
+    """
+    saved_tracebacks, new_tracebacks, errors = index_tracebacks(es, tracebacks, chunk_size)
+    _, group_errors = add_to_groups(es, new_tracebacks, chunk_size)
+    register_queries(es, get_grouped(new_tracebacks, group_errors), chunk_size)
+    return len(saved_tracebacks), errors
+
+
+def index_tracebacks(es, tracebacks:Iterable[Traceback], chunk_size:int=BULK_CHUNK_SIZE
+) -> Tuple[List[Traceback], List[Traceback], List[dict]]:
+    """
+        The first half of L{save_tracebacks}: saves the tracebacks' own documents, and invalidates
+        the caches they change. Pass the new tracebacks to L{add_to_groups}, and then to
+        L{register_queries}
+
+        Saving a traceback twice does no harm, so this is safe to retry.
+
+        Returns a tuple of (tracebacks saved, the saved tracebacks ES didn't have before, list of
+        per-item error dicts from ES)
+    """
+    tracebacks_by_id = collections.OrderedDict(
+        (str(tb.origin_papertrail_id), tb) for tb in tracebacks
+    )
+    created_ids: Set[str] = set()
+    saved_tracebacks, errors = _bulk_index(es, tracebacks_by_id, chunk_size, created_ids)
+    if saved_tracebacks:
+        invalidate_cache()
+        _invalidate_timeseries_buckets(saved_tracebacks)
+    return saved_tracebacks, [
+        tb for tb in saved_tracebacks if str(tb.origin_papertrail_id) in created_ids
+    ], errors
+
+
+def add_to_groups(es, tracebacks:List[Traceback], chunk_size:int=BULK_CHUNK_SIZE
+) -> Tuple[int, List[dict]]:
+    """
+        The second stage of L{save_tracebacks}: adds the given tracebacks to their traceback
+        groups. Pass the ones we added (see L{get_grouped}) to L{register_queries}
+
+        Tracebacks that were added to their groups before are skipped (see
+        L{traceback_group_db.add_occurrences}), so this is safe to call again with the same
+        tracebacks.
+
+        Returns a tuple of (number of tracebacks added, list of per-item error dicts from ES). Each
+        error is for one traceback, with its papertrail id as the _id
+    """
+    if not tracebacks:
+        return 0, []
+    num_added, errors = traceback_group_db.add_occurrences(es, tracebacks, chunk_size)
+    if errors:
+        logger.error('failed to add %s tracebacks to their groups', len(errors))
+    return num_added, errors
+
+
+def get_grouped(tracebacks:Iterable[Traceback], errors:Iterable[dict]) -> List[Traceback]:
+    """
+        Returns the given tracebacks that L{add_to_groups} didn't fail to add, given its errors.
+        That includes the tracebacks that were added before
+    """
+    failed_ids = set(str(next(iter(error.values()))['_id']) for error in errors)
+    return [tb for tb in tracebacks if str(tb.origin_papertrail_id) not in failed_ids]
+
+
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def _bulk_index(es, tracebacks_by_id:Dict[str, Traceback], chunk_size:int, created_ids:Set[str]
+) -> Tuple[List[Traceback], List[dict]]:
+    """
+        Sends the given tracebacks to ES in bulk requests of L{chunk_size} documents
+
+        streaming_bulk only retries the items ES rejects with a 429. A bulk request that times out
+        raises, and we send the whole batch again: documents are keyed by papertrail id, so
+        resending the chunks that already made it does no harm. The ids of the documents ES
+        created are added to created_ids, which outlives our retries: the chunks we resend come
+        back as updated
+
+        Returns a tuple of (tracebacks saved, list of per-item error dicts from ES)
+    """
+    saved_tracebacks = []
+    errors = []
+    for ok, item in elasticsearch.helpers.streaming_bulk(
+            es,
+            _create_documents(tracebacks_by_id.values()),
+            chunk_size=chunk_size,
+            raise_on_error=False,
+            max_retries=3,
+            request_timeout=elasticsearch_config.REQUEST_TIMEOUTS['bulk'],
+    ):
+        if ok:
+            saved_tracebacks.append(tracebacks_by_id[item['index']['_id']])
+            if item['index'].get('result') == 'created':
+                created_ids.add(item['index']['_id'])
+        else:
+            logger.error('failed to save traceback: %s', item)
+            errors.append(item)
+    return saved_tracebacks, errors
+
+
+def _invalidate_timeseries_buckets(tracebacks:Iterable[Traceback]):
+    """
+        Drops the cached time series buckets the given tracebacks fall in, at every interval
+
+        Only settled buckets are ever cached (see L{get_occurrence_counts}), so a batch of recent
+        tracebacks drops nothing. Late ones (backfills, replays) are dropped with a single delete,
+        which every process hears about in a single message.
+
+        ES may not have refreshed yet, so a count taken right now could miss these tracebacks and
+        be cached again. Bulk loads turn refreshes off altogether: they clear the whole region once
+        their indices are refreshed (see L{invalidate_timeseries_cache}).
+    """
+    settled_before = _get_settled_before()
+    keys = set()
+    for traceback in tracebacks:
+        signature = traceback.traceback_signature
+        for interval in traceback_timeseries.INTERVALS:
+            bucket_start = traceback_timeseries.get_bucket_start(
+                interval, traceback.origin_timestamp
+            )
+            if traceback_timeseries.get_bucket_end(interval, bucket_start) <= settled_before:
+                keys.add(traceback_timeseries.get_cache_key(signature, interval, bucket_start))
+    if keys:
+        TIMESERIES_DOGPILE_REGION.delete_multi(sorted(keys))
+
+
+def _get_settled_before() -> datetime.datetime:
+    """
+        Returns the time by which a time series bucket must have ended for us to cache its count
+    """
+    return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        seconds=TIMESERIES_CACHE_DELAY_SECONDS
+    )
+
+
+def register_queries(es, tracebacks:List[Traceback], chunk_size:int=BULK_CHUNK_SIZE,
+                     match_existing_jira_issues:bool=True):
+    """
+        The last stage of L{save_tracebacks}: registers the percolator queries for the signatures
+        of the given tracebacks, which must already be in their groups
+
+        Jira issues are matched against those queries when they're saved, so a new signature
+        doesn't know about issues that were saved before it. If match_existing_jira_issues is
+        True, we search for those issues once, and save their keys on the new traceback groups.
+
+        We search before we register, so if either fails, the signature is still new when we try
+        again. A jira issue saved between the two isn't matched.
+
+        Changes nothing but jira issue keys, so this is safe to call again with the same tracebacks
+    """
+    new_tracebacks = traceback_query_db.get_unregistered(es, tracebacks)
+    if not new_tracebacks:
+        return
+    if match_existing_jira_issues:
+        _match_existing_jira_issues(es, new_tracebacks)
+    traceback_query_db.register_queries(es, new_tracebacks, chunk_size)
+
+
+def _match_existing_jira_issues(es, new_tracebacks:List[Traceback]):
+    """
+        Saves the keys of the jira issues that match the given tracebacks on their groups
+
+        Match levels with a registered query are searched with that same query, so an issue
+        matches a signature no matter whether it was saved before or after the signature's query
+    """
+    traceback_texts = set(tb.traceback_text for tb in new_tracebacks)
+    keys_by_signature: Dict[str, Dict[int, List[str]]] = collections.defaultdict(dict)
+    for match_level in es_util.ALL_MATCH_LEVELS:
+        if match_level in traceback_query_db.QUERY_MATCH_LEVELS:
+            jira_issues = traceback_query_db.search_matching_jira_issues(
+                es, traceback_texts, match_level
+            )
+        else:
+            jira_issues = jira_issue_match.search_matching_jira_issues(
+                es, None, traceback_texts, match_level
+            )
+        for traceback in new_tracebacks:
+            keys = [jira_issue.key for jira_issue in jira_issues[traceback.traceback_text]]
+            if keys:
+                keys_by_signature[traceback.traceback_signature][match_level] = keys
+    if keys_by_signature:
+        traceback_group_db.add_jira_issue_keys(es, keys_by_signature)
+
+
+def _create_documents(tracebacks:Iterable[Traceback]):
+    for traceback in tracebacks:
+        assert isinstance(traceback, Traceback), (type(traceback), traceback)
+        yield {
+            "_index": _get_partition(traceback),
+            "_type": DOC_TYPE,
+            "_id": traceback.origin_papertrail_id,
+            "_source": traceback.document(),
+        }
+
+
 @retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
 def refresh(es):
     """
@@ -68,7 +438,7 @@ def get_tracebacks(es, tracer, start_date=None, end_date=None, num_matches=100):
         Queries the database for L{Traceback} from a given date range.
 
         Both dates are inclusive. Date filtering is done on the 'origin_timestamp' field of the
-        Traceback.
+        Traceback. If both dates are given, we only search the partitions that cover them.
 
         All filtering params are optional. Any params that are None are ignored.
 
@@ -82,44 +452,92 @@ def get_tracebacks(es, tracer, start_date=None, end_date=None, num_matches=100):
         @postcondition: all(isinstance(v, Traceback) for v in return)
         @postcondition: len(return) <= num_matches
     """
-    params_list = {}
-    if start_date is not None:
-        params_list['gte'] = "%s||/d" % start_date
-    if end_date is not None:
-        params_list['lte'] = "%s||/d" % end_date
+    raw_tracebacks = _search_date_range(
+        es, tracer, start_date, end_date, _generate_date_range_payload(start_date, end_date),
+        num_matches
+    )
+    if raw_tracebacks is None:
+        return []
+    return [
+        generate_traceback_from_source(raw_traceback['_source'], LIST_EXCLUDED_FIELDS)
+        for raw_traceback in raw_tracebacks['hits']['hits']
+    ]
 
-    if params_list:
-        body = {
-            "query": {
-                "range": {
-                    "origin_timestamp": params_list
-                }
+
+@DOGPILE_REGION.cache_on_arguments()
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def get_tracebacks_with_counts(es, tracer, start_date=None, end_date=None, num_matches=100,
+                               hidden_signatures:tuple=()
+) -> Tuple[List[Traceback], int, Dict[str, int]]:
+    """
+        L{get_tracebacks}, plus exact counts of the tracebacks in the date range
+
+        The counts come from the same search, with a terms aggregation on traceback_signature, so
+        they cost no extra round trip.
+
+        Tracebacks with any of the hidden_signatures are left out of the search, so they're neither
+        returned nor counted.
+
+        @return: a tuple of (up to num_matches tracebacks, the number of tracebacks in the date
+            range, a dict of signature -> number of tracebacks with that signature in the range)
+        @postcondition: len(return[0]) <= num_matches
+    """
+    body = _generate_date_range_payload(start_date, end_date)
+    if hidden_signatures:
+        body['query'] = {
+            "bool": {
+                "filter": body['query'],
+                "must_not": {"terms": {"traceback_signature": list(hidden_signatures)}},
             }
         }
-    else:
-        body = {
-            "query": {
-                "match_all": {}
-            }
+    body['aggs'] = {
+        "signatures": {
+            "terms": {"field": "traceback_signature", "size": MAX_SIGNATURE_COUNTS},
         }
+    }
+    raw_tracebacks = _search_date_range(es, tracer, start_date, end_date, body, num_matches)
+    if raw_tracebacks is None:
+        return [], 0, {}
+    tracebacks = [
+        generate_traceback_from_source(raw_traceback['_source'], LIST_EXCLUDED_FIELDS)
+        for raw_traceback in raw_tracebacks['hits']['hits']
+    ]
+    # ES leaves out the aggregations when no partition covers the date range
+    counts = {
+        bucket['key']: bucket['doc_count']
+        for bucket in raw_tracebacks.get('aggregations', {}).get('signatures', {}).get(
+            'buckets', []
+        )
+    }
+    return tracebacks, raw_tracebacks['hits']['total'], counts
+
+
+def _search_date_range(es, tracer, start_date, end_date, body:dict, num_matches:int
+) -> Optional[dict]:
+    """
+        Runs the given search body against the partitions that cover the date range, for the
+        latest num_matches tracebacks without their L{LIST_EXCLUDED_FIELDS}
+
+        @return: the raw ES response, or None if we have no traceback index
+    """
+    body['_source'] = {"excludes": list(LIST_EXCLUDED_FIELDS)}
 
+    tracer = tracer or opentracing.tracer
     root_span = get_current_span()
     with tracer.start_span('elasticsearch', child_of=root_span):
         try:
-            raw_tracebacks = es.search(
-                index=INDEX,
+            return es.search(
+                index=_get_indices_for_date_range(start_date, end_date),
                 doc_type=DOC_TYPE,
                 body=body,
                 sort='origin_timestamp:desc',
-                size=num_matches
+                size=num_matches,
+                ignore_unavailable=True,
+                allow_no_indices=True,
             )
         except elasticsearch.exceptions.NotFoundError:
             logger.warning('traceback index not found. has it been created?')
-            return []
-    res = []
-    for raw_traceback in raw_tracebacks['hits']['hits']:
-        res.append(generate_traceback_from_source(raw_traceback['_source']))
-    return res
+            return None
 
 
 @DOGPILE_REGION.cache_on_arguments()
@@ -128,8 +546,15 @@ def get_matching_tracebacks(es, tracer, traceback_text, match_level, num_matches
     """
         Queries the database for any tracebacks with identical traceback_text
 
+        EXACT_MATCH lookups are a term query against the keyword traceback_signature field.
+        SIMILAR_MATCH lookups are a terms query for the signatures of the similar traceback groups,
+        found through their minhashes (see L{traceback_minhash}).
+
+        If ES has fewer than L{num_matches} matches we add the newest ones from our archive (see
+        L{traceback_archive}).
+
         Returns a list (instead of a generator) so we can be cached. Returns up to L{num_matches}
-        tracebacks
+        tracebacks. Their context text is loaded on first access (see L{MATCH_EXCLUDED_FIELDS})
 
         @type traceback_text: str
         @rtype: list
@@ -140,7 +565,8 @@ def get_matching_tracebacks(es, tracer, traceback_text, match_level, num_matches
     """
     assert match_level in es_util.ALL_MATCH_LEVELS, (match_level, es_util.ALL_MATCH_LEVELS)
 
-    body = es_util.generate_text_match_payload(traceback_text, ["traceback_text"], match_level)
+    body = _generate_match_payload(es, tracer, traceback_text, match_level)
+    body['_source'] = {"excludes": list(MATCH_EXCLUDED_FIELDS)}
 
     root_span = get_current_span()
     with tracer.start_span('elasticsearch', child_of=root_span):
@@ -153,15 +579,871 @@ def get_matching_tracebacks(es, tracer, traceback_text, match_level, num_matches
         )
     res = []
     for raw_traceback in raw_es_response['hits']['hits']:
-        res.append(generate_traceback_from_source(raw_traceback['_source']))
+        res.append(generate_traceback_from_source(raw_traceback['_source'], MATCH_EXCLUDED_FIELDS))
+    return _add_archived_matches(es, tracer, res, traceback_text, match_level, num_matches)
+
+
+@DOGPILE_REGION.cache_on_arguments()
+def get_matching_tracebacks_for_texts(es, tracer, traceback_texts:tuple, match_level, num_matches
+) -> Dict[str, List[Traceback]]:
+    """
+        Batched form of L{get_matching_tracebacks}: finds the tracebacks matching each of the given
+        traceback_texts. Only searches ES (see L{get_matching_tracebacks_with_counts_for_texts})
+
+        Takes a tuple (instead of a list) so we can be cached.
+
+        @return: a dict of traceback text -> list of up to num_matches matching L{Traceback}
+
+        @precondition: match_level in es_util.ALL_MATCH_LEVELS
+        @postcondition: set(return.keys()) == set(traceback_texts)
+    """
+    return {
+        traceback_text: tracebacks
+        for traceback_text, (tracebacks, _) in get_matching_tracebacks_with_counts_for_texts(
+            es, tracer, traceback_texts, match_level, num_matches
+        ).items()
+    }
+
+
+@DOGPILE_REGION.cache_on_arguments()
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def get_matching_tracebacks_with_counts_for_texts(
+        es, tracer, traceback_texts:tuple, match_level, num_matches,
+) -> Dict[str, Tuple[List[Traceback], int]]:
+    """
+        Finds the tracebacks matching each of the given traceback_texts, and counts all of them
+
+        Duplicate texts are only searched for once, and all the searches are sent together with
+        msearch. The counts are the total hits of those searches. Takes a tuple (instead of a list)
+        so we can be cached.
+
+        Unlike L{get_matching_tracebacks}, we only search ES: this is what the day view renders
+        for every traceback it shows, and reading our archive for each of them would make it far
+        slower.
+
+        @return: a dict of traceback text -> (list of up to num_matches matching L{Traceback},
+            number of matching tracebacks)
+
+        @precondition: match_level in es_util.ALL_MATCH_LEVELS
+        @postcondition: set(return.keys()) == set(traceback_texts)
+    """
+    assert match_level in es_util.ALL_MATCH_LEVELS, (match_level, es_util.ALL_MATCH_LEVELS)
+
+    distinct_texts = sorted(set(traceback_texts))
+    bodies = []
+    for traceback_text in distinct_texts:
+        body = _generate_match_payload(es, tracer, traceback_text, match_level)
+        body['_source'] = {"excludes": list(MATCH_EXCLUDED_FIELDS)}
+        body['sort'] = [{"origin_timestamp": "desc"}]
+        body['size'] = num_matches
+        bodies.append(body)
+    responses = es_util.msearch(es, tracer, INDEX, DOC_TYPE, bodies)
+
+    res: Dict[str, Tuple[List[Traceback], int]] = {}
+    for traceback_text, raw_es_response in zip(distinct_texts, responses):
+        if raw_es_response is None:
+            res[traceback_text] = ([], 0)
+            continue
+        tracebacks = [
+            generate_traceback_from_source(raw_traceback['_source'], MATCH_EXCLUDED_FIELDS)
+            for raw_traceback in raw_es_response['hits']['hits']
+        ]
+        res[traceback_text] = (tracebacks, raw_es_response['hits']['total'])
+    return res
+
+
+def _add_archived_matches(es, tracer, tracebacks:List[Traceback], traceback_text:str,
+                          match_level:int, num_matches:int) -> List[Traceback]:
+    """
+        Tops up the given matches from ES with the newest matching tracebacks in our archive, up
+        to num_matches. The archived tracebacks are all older than the ones in ES
+    """
+    if len(tracebacks) >= num_matches or not traceback_archive.get_segments():
+        return tracebacks
+    seen_ids = set(int(tb.origin_papertrail_id) for tb in tracebacks)
+    signatures = get_matching_signatures(es, tracer, traceback_text, match_level)
+    for source in traceback_archive.get_matching_sources(signatures, num_matches):
+        if len(tracebacks) >= num_matches:
+            break
+        if int(source['origin_papertrail_id']) not in seen_ids:
+            tracebacks.append(generate_traceback_from_source(source))
+    return tracebacks
+
+
+def iter_tracebacks(
+        es, tracer, start_date=None, end_date=None, page_size:int=SCROLL_PAGE_SIZE,
+        excluded_fields:Iterable[str]=LIST_EXCLUDED_FIELDS,
+) -> Iterator[Traceback]:
+    """
+        Iterates over every L{Traceback} from a given date range, with no limit on their number
+
+        Takes the same date params as L{get_tracebacks}, but pages through the results with a
+        scroll of L{page_size} hits per request and decodes them one by one. Memory use is bounded
+        by the page size, and there is no result window to run past.
+
+        Tracebacks are returned in no particular order. Not cached.
+
+        L{excluded_fields} are left out of the query and loaded on first access. Pass an empty
+        tuple if the caller reads the context text of every traceback.
+    """
+    excluded_fields = tuple(excluded_fields)
+    body = _generate_date_range_payload(start_date, end_date)
+    if excluded_fields:
+        body['_source'] = {"excludes": list(excluded_fields)}
+    for raw_traceback in _scan(
+            es, tracer, _get_indices_for_date_range(start_date, end_date), body, page_size
+    ):
+        yield generate_traceback_from_source(raw_traceback['_source'], excluded_fields)
+
+
+def iter_matching_tracebacks(
+        es, tracer, traceback_text:str, match_level:int, page_size:int=SCROLL_PAGE_SIZE,
+) -> Iterator[Traceback]:
+    """
+        Iterates over every traceback that matches traceback_text, with no limit on their number
+
+        Unbounded form of L{get_matching_tracebacks}: pages through the matches with a scroll and
+        decodes them one by one. Tracebacks are returned in no particular order. Not cached.
+
+        @precondition: match_level in es_util.ALL_MATCH_LEVELS
+    """
+    assert match_level in es_util.ALL_MATCH_LEVELS, (match_level, es_util.ALL_MATCH_LEVELS)
+
+    body = _generate_match_payload(es, tracer, traceback_text, match_level)
+    body['_source'] = {"excludes": list(MATCH_EXCLUDED_FIELDS)}
+    for raw_traceback in _scan(es, tracer, INDEX, body, page_size):
+        yield generate_traceback_from_source(raw_traceback['_source'], MATCH_EXCLUDED_FIELDS)
+
+
+def get_matching_signatures(es, tracer, traceback_text:str, match_level:int) -> List[str]:
+    """
+        Returns the signatures of the tracebacks that match traceback_text at match_level
+
+        For EXACT_MATCH that's traceback_text's own signature. For SIMILAR_MATCH we add the
+        signatures of the similar traceback groups
+
+        @precondition: match_level in es_util.ALL_MATCH_LEVELS
+    """
+    assert match_level in es_util.ALL_MATCH_LEVELS, (match_level, es_util.ALL_MATCH_LEVELS)
+
+    signatures = {generate_signature(traceback_text)}
+    if match_level == es_util.SIMILAR_MATCH:
+        signatures.update(traceback_group_db.get_similar_signatures(es, tracer, traceback_text))
+    return sorted(signatures)
+
+
+def get_occurrence_counts(es, tracer, signatures:Iterable[str], interval:str,
+                          start_date:datetime.date, end_date:datetime.date
+) -> Dict[str, List[Tuple[datetime.datetime, int]]]:
+    """
+        Counts the tracebacks with each of the given signatures in every time bucket from
+        start_date to end_date (inclusive). See L{traceback_timeseries} for how the buckets are
+        laid out
+
+        Counts come from date_histogram aggregations; no tracebacks are fetched. The count of each
+        bucket that ended more than L{TIMESERIES_CACHE_DELAY_SECONDS} ago is cached on its own in
+        L{TIMESERIES_DOGPILE_REGION}, so we only ask ES about the buckets we haven't counted before
+        (and the recent ones).
+
+        @return: a dict of signature -> list of (bucket start, count), in bucket order
+        @precondition: interval in traceback_timeseries.INTERVALS
+    """
+    signatures = sorted(set(signatures))
+    buckets = traceback_timeseries.get_buckets(interval, start_date, end_date)
+    settled_before = _get_settled_before()
+
+    counts = {}  # (signature, bucket start) -> count
+    cacheable = [
+        (signature, bucket_start)
+        for signature in signatures
+        for bucket_start, bucket_end in buckets
+        if bucket_end <= settled_before
+    ]
+    if cacheable:
+        cached_counts = TIMESERIES_DOGPILE_REGION.get_multi([
+            traceback_timeseries.get_cache_key(signature, interval, bucket_start)
+            for signature, bucket_start in cacheable
+        ])
+        for key, count in zip(cacheable, cached_counts):
+            if count is not NO_VALUE:
+                counts[key] = count
+
+    missing = [
+        (signature, bucket_start, bucket_end)
+        for signature in signatures
+        for bucket_start, bucket_end in buckets
+        if (signature, bucket_start) not in counts
+    ]
+    if missing:
+        new_counts = _count_occurrences(
+            es, tracer, sorted(set(signature for signature, _, _ in missing)), interval,
+            min(bucket_start for _, bucket_start, _ in missing),
+            max(bucket_end for _, _, bucket_end in missing),
+        )
+        finished_counts = {}
+        for signature, bucket_start, bucket_end in missing:
+            count = new_counts.get((signature, bucket_start), 0)
+            counts[(signature, bucket_start)] = count
+            if bucket_end <= settled_before:
+                finished_counts[
+                    traceback_timeseries.get_cache_key(signature, interval, bucket_start)
+                ] = count
+        if finished_counts:
+            TIMESERIES_DOGPILE_REGION.set_multi(finished_counts)
+
+    return {
+        signature: [
+            (bucket_start, counts[(signature, bucket_start)]) for bucket_start, _ in buckets
+        ]
+        for signature in signatures
+    }
+
+
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def _count_occurrences(es, tracer, signatures:List[str], interval:str,
+                       start:datetime.datetime, end:datetime.datetime
+) -> Dict[Tuple[str, datetime.datetime], int]:
+    """
+        Counts the tracebacks with each of the given signatures in every interval bucket from start
+        (inclusive) to end (exclusive), with a terms aggregation on the signature and a
+        date_histogram under it. Buckets without any tracebacks are left out
+
+        @return: a dict of (signature, bucket start) -> count
+    """
+    tracer = tracer or opentracing.tracer
+    body = {
+        "size": 0,
+        "query": {
+            "bool": {
+                "filter": [
+                    {"terms": {"traceback_signature": signatures}},
+                    {"range": {"origin_timestamp": {
+                        "gte": start.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                        "lt": end.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    }}},
+                ]
+            }
+        },
+        "aggs": {
+            "signatures": {
+                "terms": {"field": "traceback_signature", "size": len(signatures)},
+                "aggs": {
+                    "occurrences": {
+                        "date_histogram": {
+                            "field": "origin_timestamp",
+                            "interval": interval,
+                            "min_doc_count": 1,
+                        }
+                    }
+                },
+            }
+        },
+    }
+
+    root_span = get_current_span()
+    with tracer.start_span('elasticsearch', child_of=root_span):
+        try:
+            raw_es_response = es.search(
+                index=_get_indices_for_date_range(
+                    start.date(), (end - datetime.timedelta(microseconds=1)).date()
+                ),
+                doc_type=DOC_TYPE,
+                body=body,
+                ignore_unavailable=True,
+                allow_no_indices=True,
+            )
+        except elasticsearch.exceptions.NotFoundError:
+            logger.warning('traceback index not found. has it been created?')
+            return {}
+    res = {}
+    # ES leaves out the aggregations when no partition covers the range
+    for signature_bucket in raw_es_response.get('aggregations', {}).get('signatures', {}).get(
+            'buckets', []
+    ):
+        for bucket in signature_bucket['occurrences']['buckets']:
+            bucket_start = datetime.datetime.fromtimestamp(
+                bucket['key'] / 1000, datetime.timezone.utc
+            )
+            res[(signature_bucket['key'], bucket_start)] = bucket['doc_count']
     return res
 
 
+def _scan(es, tracer, index, body:dict, page_size:int) -> Iterator[dict]:
+    """
+        Scrolls through every hit of the given search body, L{page_size} hits per request
+
+        The whole scroll is recorded as one span. Its scroll context is cleared once we're done,
+        even if the caller stops iterating early.
+    """
+    tracer = tracer or opentracing.tracer
+    root_span = get_current_span()
+    with tracer.start_span('elasticsearch scroll', child_of=root_span) as span:
+        count = 0
+        for raw_traceback in elasticsearch.helpers.scan(
+                es,
+                index=index,
+                doc_type=DOC_TYPE,
+                query=body,
+                size=page_size,
+                scroll=SCROLL_TIMEOUT,
+                ignore_unavailable=True,
+                allow_no_indices=True,
+        ):
+            count += 1
+            yield raw_traceback
+        span.set_tag('hits', count)
+
+
 def get_traceback(es, id_: int) -> Traceback:
-    """ Retrieves the traceback referenced by the given ID """
-    raw_es_response = es.get(
+    """
+        Retrieves the traceback referenced by the given ID
+
+        We don't know which partition the traceback lives in, so we search the read alias for it,
+        then our archive.
+
+        @raises elasticsearch.exceptions.NotFoundError if there is no traceback with that ID
+    """
+    return generate_traceback_from_source(_get_traceback_source(es, id_))
+
+
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def get_traceback_text_fields(es, id_: int) -> dict:
+    """
+        Retrieves only the L{HEAVY_TEXT_FIELDS} of the traceback referenced by the given ID
+
+        This is the loader we register with L{register_text_loader}.
+
+        @raises elasticsearch.exceptions.NotFoundError if there is no traceback with that ID
+    """
+    return _get_traceback_source(es, id_, HEAVY_TEXT_FIELDS)
+
+
+def _get_traceback_source(es, id_: int, fields:Optional[Iterable[str]]=None) -> dict:
+    """
+        Searches the read alias for the traceback with the given ID and returns its _source. Falls
+        back to our archive (see L{traceback_archive}) if it isn't in ES.
+
+        If fields is given, only those fields are fetched.
+    """
+    body: Dict[str, object] = {
+        "query": {
+            "ids": {"values": [str(id_)]}
+        }
+    }
+    if fields is not None:
+        body['_source'] = list(fields)
+    raw_es_response = es.search(
         index=INDEX,
         doc_type=DOC_TYPE,
-        id=id_
+        body=body,
+        size=1
+    )
+    hits = raw_es_response['hits']['hits']
+    if hits:
+        return hits[0]['_source']
+    source = traceback_archive.get_source(id_)
+    if source is None:
+        raise elasticsearch.exceptions.NotFoundError(404, 'traceback %s not found' % id_)
+    if fields is not None:
+        source = {field: source[field] for field in fields if field in source}
+    return source
+
+
+def _get_partition(traceback:Traceback) -> str:
+    """ Returns the name of the partition the given traceback is saved in """
+    return INDEX_TEMPLATE % (traceback.origin_timestamp.year, traceback.origin_timestamp.month)
+
+
+def _get_indices_for_date_range(start_date, end_date) -> str:
+    """
+        Returns the indices to search for tracebacks between start_date and end_date (inclusive)
+
+        Partitions are split on the traceback's own (local) month, but ES compares our date range
+        in UTC. We widen the range by a day on each side so that we always include the partitions
+        of tracebacks near a month boundary.
+
+        Each month is matched with L{READ_INDEX_TEMPLATE}, so we read whichever mapping versions
+        of its partition exist.
+
+        If either date is missing we return the read alias, which covers every partition.
+    """
+    if start_date is None or end_date is None:
+        return INDEX
+
+    first_day = start_date - datetime.timedelta(days=1)
+    last_day = end_date + datetime.timedelta(days=1)
+    return ','.join(
+        READ_INDEX_TEMPLATE % (year, month)
+        for year, month in time_util.get_months(first_day, last_day)
     )
-    return generate_traceback_from_source(raw_es_response['_source'])
+
+
+def get_partitions_for_date_range(start_date:datetime.date, end_date:datetime.date) -> List[str]:
+    """
+        Returns the names of the partitions that tracebacks from start_date to end_date (inclusive)
+        are written to. The partitions may not exist yet
+    """
+    return [INDEX_TEMPLATE % month for month in time_util.get_months(start_date, end_date)]
+
+
+def _generate_date_range_payload(start_date, end_date) -> dict:
+    """
+        Creates the ES query payload that finds tracebacks between start_date and end_date
+        (inclusive). Either date may be None
+    """
+    params_list = {}
+    if start_date is not None:
+        params_list['gte'] = "%s||/d" % start_date
+    if end_date is not None:
+        params_list['lte'] = "%s||/d" % end_date
+
+    if params_list:
+        return {
+            "query": {
+                "range": {
+                    "origin_timestamp": params_list
+                }
+            }
+        }
+    return {
+        "query": {
+            "match_all": {}
+        }
+    }
+
+
+def _generate_match_payload(es, tracer, traceback_text:str, match_level:int) -> dict:
+    """
+        Creates the ES query payload that finds tracebacks matching traceback_text at match_level
+
+        Both match levels end up as keyword queries on traceback_signature. For SIMILAR_MATCH we
+        first look up the signatures of the similar traceback groups
+    """
+    if match_level == es_util.EXACT_MATCH:
+        return {
+            "query": {
+                "term": {
+                    "traceback_signature": generate_signature(traceback_text)
+                }
+            }
+        }
+    # includes traceback_text's own signature, in case its group hasn't been saved yet
+    signatures = get_matching_signatures(es, tracer, traceback_text, match_level)
+    return {
+        "query": {
+            "terms": {
+                "traceback_signature": signatures
+            }
+        }
+    }
+
+
+def backfill_signatures(es, chunk_size:int=BULK_CHUNK_SIZE) -> int:
+    """
+        Adds the traceback_signature field to every saved traceback that doesn't have one yet
+
+        Adds the keyword mapping for the field first, so this is safe to run against an index that
+        was created before the field existed. Only fetches the traceback_text of each document.
+
+        Invalidates the dogpile cache if any document was updated.
+
+        Returns the number of tracebacks updated
+    """
+    es.indices.put_mapping(
+        index=INDEX,
+        doc_type=DOC_TYPE,
+        body={
+            "properties": {
+                "traceback_signature": {"type": "keyword"}
+            }
+        }
+    )
+
+    missing_signature_query = {
+        "_source": ["traceback_text"],
+        "query": {
+            "bool": {
+                "must_not": {"exists": {"field": "traceback_signature"}}
+            }
+        }
+    }
+    actions = (
+        {
+            "_op_type": "update",
+            "_index": raw_traceback['_index'],
+            "_type": DOC_TYPE,
+            "_id": raw_traceback['_id'],
+            "doc": {
+                "traceback_signature": generate_signature(
+                    raw_traceback['_source']['traceback_text']
+                )
+            },
+        }
+        for raw_traceback in elasticsearch.helpers.scan(
+            es, index=INDEX, doc_type=DOC_TYPE, query=missing_signature_query, size=chunk_size
+        )
+    )
+    num_updated = 0
+    for ok, item in elasticsearch.helpers.streaming_bulk(
+            es, actions, chunk_size=chunk_size, raise_on_error=False, max_retries=3,
+            request_timeout=elasticsearch_config.REQUEST_TIMEOUTS['bulk'],
+    ):
+        if ok:
+            num_updated += 1
+        else:
+            logger.error('failed to backfill traceback signature: %s', item)
+        if num_updated and num_updated % 10000 == 0:
+            logger.info('backfilled %s traceback signatures', num_updated)
+
+    logger.info('backfilled %s traceback signatures', num_updated)
+    if num_updated:
+        invalidate_cache()
+    return num_updated
+
+
+def rebuild_traceback_groups(es, chunk_size:int=BULK_CHUNK_SIZE) -> int:
+    """
+        Rebuilds every traceback group from the tracebacks saved in the database
+
+        Removes all existing groups and their occurrence claims first, since adding a traceback to
+        a group twice would count it twice. Tracebacks we save while we rebuild claim their
+        occurrences as usual, so we skip them when we reach them. Only fetches the metadata fields
+        of each traceback.
+
+        Also registers the jira queries of every signature. The groups' jira issue keys are left
+        empty: run L{jira_issue_db.match_all_jira_issues} afterwards to fill them in.
+
+        Returns the number of tracebacks added to groups
+    """
+    traceback_group_db.put_mapping(es)
+    traceback_group_db.clear(es)
+
+    query = {
+        "_source": {
+            "excludes": list(HEAVY_TEXT_FIELDS)
+        },
+        "query": {
+            "match_all": {}
+        }
+    }
+    count = 0
+    batch = []
+    for raw_traceback in elasticsearch.helpers.scan(
+            es, index=INDEX, doc_type=DOC_TYPE, query=query, size=chunk_size
+    ):
+        batch.append(generate_traceback_from_source(raw_traceback['_source'], HEAVY_TEXT_FIELDS))
+        if len(batch) >= chunk_size:
+            count += _rebuild_groups(es, batch, chunk_size)
+            batch = []
+            logger.info('added %s tracebacks to groups', count)
+    if batch:
+        count += _rebuild_groups(es, batch, chunk_size)
+
+    logger.info('rebuilt traceback groups from %s tracebacks', count)
+    return count
+
+
+def _rebuild_groups(es, tracebacks:List[Traceback], chunk_size:int) -> int:
+    num_added, errors = traceback_group_db.add_occurrences(es, tracebacks, chunk_size)
+    if errors:
+        logger.error('failed to add %s tracebacks to their groups', len(errors))
+    register_queries(es, tracebacks, chunk_size, match_existing_jira_issues=False)
+    return num_added
+
+
+def get_partitions(es) -> List[str]:
+    """
+        Returns the names of all our traceback partitions, oldest month first
+    """
+    try:
+        indices = es.indices.get_alias(index=INDEX)
+    except elasticsearch.exceptions.NotFoundError:
+        return []
+    return sorted(
+        (index for index in indices if PARTITION_REGEX.match(index)),
+        key=_parse_partition,
+    )
+
+
+def get_closed_partitions(es) -> List[str]:
+    """
+        Returns the names of the closed traceback partitions, oldest month first. These are the
+        old partitions that L{reindex_partitions} kept instead of deleting: they're out of the read
+        alias, so L{get_partitions} doesn't list them
+    """
+    indices = es.cat.indices(index=PARTITION_PATTERN, format='json', h='index,status')
+    return sorted(
+        (
+            index['index'] for index in indices
+            if index['status'] == 'close' and PARTITION_REGEX.match(index['index'])
+        ),
+        key=_parse_partition,
+    )
+
+
+def _parse_partition(partition:str) -> Tuple[int, int, int]:
+    """ Returns the (year, month, mapping version) of the given partition name """
+    match = PARTITION_REGEX.match(partition)
+    assert match is not None, partition
+    version, year, month = match.groups()
+    return int(year), int(month), int(version or 1)
+
+
+def drop_expired_partitions(es, retention_months:int=TRACEBACK_RETENTION_MONTHS) -> List[str]:
+    """
+        Deletes every traceback partition older than L{retention_months}, including the current
+        month. Deleting a whole index is far cheaper than deleting its documents one by one. Any
+        archive segments that old are deleted too, and so are the closed partitions that
+        L{reindex_partitions} kept and the occurrence claims of their tracebacks (see
+        L{traceback_group_db.add_occurrences}).
+
+        Does nothing if retention_months is 0.
+
+        Returns the names of the partitions we deleted
+    """
+    if not retention_months:
+        logger.info('traceback retention is turned off')
+        return []
+
+    oldest_month_to_keep = _get_oldest_month_to_keep(retention_months)
+    for year, month in traceback_archive.delete_segments_before(oldest_month_to_keep):
+        logger.info('deleted expired traceback archive segment %04d-%02d', year, month)
+    traceback_group_db.delete_occurrences_before(es, datetime.date(*oldest_month_to_keep, 1))
+
+    dropped = []
+    for partition in get_partitions(es) + get_closed_partitions(es):
+        if _parse_partition(partition)[:2] < oldest_month_to_keep:
+            logger.info('dropping expired traceback partition %s', partition)
+            es.indices.delete(index=partition)
+            dropped.append(partition)
+    if dropped:
+        invalidate_cache()
+        invalidate_timeseries_cache()
+    return dropped
+
+
+def archive_partitions(es, archive_months:int=TRACEBACK_ARCHIVE_MONTHS) -> List[str]:
+    """
+        Moves every traceback partition older than L{archive_months}, including the current month,
+        to our cold tier (see L{traceback_archive})
+
+        Each month's tracebacks are streamed into its archive segment. Its partitions are only
+        deleted once we've written as many tracebacks as ES counts in them.
+
+        Does nothing if archive_months is 0, or if the archive isn't on a persistent volume (see
+        L{traceback_archive.is_persistent}): we'd lose the tracebacks along with the container.
+
+        Returns the names of the partitions we archived
+    """
+    if not archive_months:
+        logger.info('traceback archiving is turned off')
+        return []
+    if not traceback_archive.is_persistent():
+        logger.error(
+            'not archiving tracebacks: archive path %s is not on a persistent volume',
+            traceback_archive.ARCHIVE_PATH,
+        )
+        return []
+
+    oldest_month_to_keep = _get_oldest_month_to_keep(archive_months)
+    partitions_by_month: Dict[Tuple[int, int], List[str]] = collections.defaultdict(list)
+    for partition in get_partitions(es):
+        year_month = _parse_partition(partition)[:2]
+        if year_month < oldest_month_to_keep:
+            partitions_by_month[year_month].append(partition)
+
+    archived = []
+    for (year, month), partitions in sorted(partitions_by_month.items()):
+        index = ','.join(partitions)
+        expected_count = es.count(index=index, doc_type=DOC_TYPE)['count']
+        count = traceback_archive.write_segment(year, month, (
+            raw_traceback['_source'] for raw_traceback in _scan(
+                es, None, index, {"query": {"match_all": {}}}, SCROLL_PAGE_SIZE
+            )
+        ))
+        if count != expected_count:
+            # the segment keeps what we wrote. the next run writes the month again
+            logger.error(
+                'archived %s of the %s tracebacks in %s. not deleting them',
+                count, expected_count, index,
+            )
+            continue
+        for partition in partitions:
+            logger.info('deleting archived traceback partition %s', partition)
+            es.indices.delete(index=partition)
+            archived.append(partition)
+    if archived:
+        invalidate_cache()
+    return archived
+
+
+def _get_oldest_month_to_keep(months_to_keep:int) -> Tuple[int, int]:
+    """
+        Returns the (year, month) of the oldest month within the last months_to_keep months,
+        including the current month
+    """
+    today = datetime.date.today()
+    months_since_year_zero = today.year * 12 + today.month - 1 - (months_to_keep - 1)
+    return (months_since_year_zero // 12, months_since_year_zero % 12 + 1)
+
+
+MIGRATION_SCRIPT = "ctx._index = '%s' + ctx._source.origin_timestamp.substring(0, 7)" % (
+    INDEX_TEMPLATE.split('%')[0]
+)
+"""
+    Painless script that sends a legacy traceback to the partition for its origin_timestamp. Our
+    timestamps start with 'YYYY-MM', so this matches L{INDEX_TEMPLATE}
+"""
+
+
+def migrate_legacy_index(es, delete_legacy_index:bool=False, poll_seconds:int=30) -> dict:
+    """
+        Copies every traceback in our legacy unpartitioned index into its partition
+
+        Runs the copy as an ES reindex task and waits for it to finish. Tracebacks that already
+        exist in a partition (because they were re-saved after we started partitioning) are left
+        alone.
+
+        Our index template must already exist, otherwise the partitions would get dynamic mappings
+        and would not join the read alias.
+
+        If delete_legacy_index is True, deletes the legacy index once the copy succeeds.
+
+        Returns the status of the finished reindex task
+    """
+    _check_index_template(es)
+
+    res = es.reindex(
+        body={
+            "conflicts": "proceed",
+            "source": {
+                "index": LEGACY_INDEX,
+                "type": DOC_TYPE,
+            },
+            "dest": {
+                "index": INDEX_TEMPLATE % (1970, 1),  # replaced per document by our script
+                "op_type": "create",
+            },
+            "script": {
+                "source": MIGRATION_SCRIPT,
+                "lang": "painless",
+            },
+        },
+        wait_for_completion=False,
+    )
+    logger.info('started traceback migration as task %s', res['task'])
+    task = _wait_for_task(es, res['task'], poll_seconds)
+    status = task['task']['status']
+
+    failures = task.get('response', {}).get('failures') or task.get('error')
+    if failures:
+        logger.error('traceback migration failed: %s', failures)
+        return status
+
+    logger.info('migrated %s tracebacks', status.get('created'))
+    invalidate_cache()
+    if delete_legacy_index:
+        logger.info('deleting legacy traceback index %s', LEGACY_INDEX)
+        es.indices.delete(index=LEGACY_INDEX)
+    return status
+
+
+def reindex_partitions(es, delete_old_partitions:bool=True, poll_seconds:int=30) -> List[str]:
+    """
+        Copies every traceback partition that uses an older mapping into a partition that uses our
+        current L{MAPPING_VERSION}, one month at a time
+
+        Runs while ingestion keeps going: new tracebacks are already written to current partitions,
+        and every partition stays in the read alias throughout. For each month we:
+        - reindex the old partition into the current one. tracebacks that are already there are
+            left alone, since they were written more recently
+        - atomically remove the old partition from the read alias, and then delete it. If
+            delete_old_partitions is False we close it instead: it's kept on disk, but it's no
+            longer matched by L{READ_INDEX_TEMPLATE}, so its tracebacks aren't read (and counted)
+            twice. L{drop_expired_partitions} deletes it once its month expires
+
+        While a month is being copied both its partitions are readable, so reads of that month may
+        return some tracebacks twice until its alias swap.
+
+        Once no old partitions are left, deletes the index template of our unversioned partitions.
+
+        Returns the names of the partitions we reindexed
+    """
+    _check_index_template(es)
+
+    reindexed = []
+    for partition in get_partitions(es):
+        year, month, version = _parse_partition(partition)
+        if version >= MAPPING_VERSION:
+            continue
+        new_partition = INDEX_TEMPLATE % (year, month)
+        logger.info('reindexing traceback partition %s into %s', partition, new_partition)
+        res = es.reindex(
+            body={
+                "conflicts": "proceed",
+                "source": {
+                    "index": partition,
+                    "type": DOC_TYPE,
+                },
+                "dest": {
+                    "index": new_partition,
+                    "op_type": "create",
+                },
+            },
+            wait_for_completion=False,
+        )
+        task = _wait_for_task(es, res['task'], poll_seconds)
+        failures = task.get('response', {}).get('failures') or task.get('error')
+        if failures:
+            logger.error('failed to reindex traceback partition %s: %s', partition, failures)
+            break
+
+        es.indices.refresh(index=new_partition)
+        es.indices.update_aliases(body={
+            "actions": [
+                {"remove": {"index": partition, "alias": INDEX}},
+            ]
+        })
+        if delete_old_partitions:
+            es.indices.delete(index=partition)
+        else:
+            logger.info('closing old traceback partition %s', partition)
+            es.indices.close(index=partition)
+        invalidate_cache()
+        invalidate_timeseries_cache()
+        logger.info(
+            'reindexed traceback partition %s: %s', partition, task['task']['status'].get('created')
+        )
+        reindexed.append(partition)
+    else:
+        if es.indices.exists_template(name=PREVIOUS_INDEX_TEMPLATE_NAME):
+            logger.info('deleting index template %s', PREVIOUS_INDEX_TEMPLATE_NAME)
+            es.indices.delete_template(name=PREVIOUS_INDEX_TEMPLATE_NAME)
+    return reindexed
+
+
+def _check_index_template(es):
+    """
+        Our index template must exist before we write to a new partition, otherwise the partition
+        would get a dynamic mapping and would not join the read alias
+    """
+    if not es.indices.exists_template(name=INDEX_TEMPLATE_NAME):
+        raise RuntimeError(
+            'index template %s not found. run scripts/setup-es-database.sh first' %
+            INDEX_TEMPLATE_NAME
+        )
+
+
+def _wait_for_task(es, task_id:str, poll_seconds:int) -> dict:
+    """
+        Polls the given ES task (a reindex) until it completes, and returns the finished task
+    """
+    while True:
+        task = es.tasks.get(task_id=task_id)
+        if task.get('completed'):
+            return task
+        status = task['task']['status']
+        logger.info(
+            'task %s: created %s of %s', task_id, status.get('created'), status.get('total')
+        )
+        time.sleep(poll_seconds)
@@ -0,0 +1,75 @@
+import datetime
+import json
+import os
+
+from common_util import (
+    elasticsearch_config,
+    testing_util,
+)
+from lib.traceback import (
+    traceback_db,
+)
+
+ES = elasticsearch_config.get_db()
+
+INDEX_TEMPLATE_PATH = os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', 'scripts', 'es_mappings',
+    'traceback_index_template.json',
+)
+
+DAY = datetime.date(2001, 2, 3)
+
+
+def make_traceback(papertrail_id, text):
+    return testing_util.make_traceback(papertrail_id, text, datetime.datetime(
+        DAY.year, DAY.month, DAY.day, 12, tzinfo=datetime.timezone.utc
+    ))
+
+
+def test_reindex_keeping_old_partitions():
+    """ Counts are the same after a reindex that keeps the old partition """
+    old_partition = 'tracebacks-%04d-%02d' % (DAY.year, DAY.month)
+    new_partition = traceback_db.INDEX_TEMPLATE % (DAY.year, DAY.month)
+    with open(INDEX_TEMPLATE_PATH) as f:
+        template = json.load(f)
+    for partition in (old_partition, new_partition):
+        ES.indices.delete(index=partition, ignore=404)
+    ES.indices.create(index=old_partition, body={
+        "settings": template['settings'],
+        "mappings": template['mappings'],
+        "aliases": template['aliases'],
+    })
+
+    tracebacks = [
+        make_traceback(2001020301, 'KeyError: 1'),
+        make_traceback(2001020302, 'KeyError: 1'),
+        make_traceback(2001020303, 'ValueError: 2'),
+    ]
+    for traceback in tracebacks:
+        ES.index(
+            index=old_partition, doc_type=traceback_db.DOC_TYPE, id=traceback.origin_papertrail_id,
+            body=traceback.document(),
+        )
+    ES.indices.refresh(index=old_partition)
+    signatures = sorted(set(traceback.traceback_signature for traceback in tracebacks))
+
+    def get_counts():
+        traceback_db.invalidate_timeseries_cache()
+        _, total, counts = traceback_db.get_tracebacks_with_counts(ES, None, DAY, DAY)
+        timeseries = traceback_db.get_occurrence_counts(
+            ES, None, signatures, 'day', DAY, DAY
+        )
+        return total, counts, timeseries
+
+    try:
+        before = get_counts()
+        assert before[0] == 3
+        assert traceback_db.reindex_partitions(ES, delete_old_partitions=False, poll_seconds=1) == [
+            old_partition
+        ]
+        assert get_counts() == before
+        assert old_partition not in traceback_db.get_partitions(ES)
+        assert old_partition in traceback_db.get_closed_partitions(ES)
+    finally:
+        for partition in (old_partition, new_partition):
+            ES.indices.delete(index=partition, ignore=404)
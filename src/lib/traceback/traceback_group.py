@@ -0,0 +1,187 @@
+import datetime
+import typing
+
+from common_util import cache_serializer
+from lib.traceback.traceback import (
+    HEAVY_TEXT_FIELDS,
+    Traceback,
+    generate_traceback_from_source,
+)
+
+
+class TracebackGroup():
+    """
+        L{TracebackGroup} summarizes every L{Traceback} that shares a traceback_signature.
+
+        Groups are maintained at ingest time, so that reading a group replaces the query we'd
+        otherwise run to find all the tracebacks that match a given traceback text.
+
+        Fields:
+        - traceback_signature: the signature shared by every traceback in the group
+        - traceback_text: the traceback text of the group's tracebacks
+        - first_seen: datetime of the earliest traceback we've seen in this group. in utc
+        - last_seen: datetime of the latest traceback we've seen in this group. in utc
+        - total_count: the number of tracebacks we've seen in this group
+        - daily_counts: dict of 'YYYY-MM-DD' -> number of tracebacks seen on that day
+        - latest_occurrences: list of dicts describing the most recent tracebacks in this group,
+            latest first. each dict holds the metadata fields of a Traceback document (ids,
+            timestamp, instance, program, profile and user) but none of the traceback text
+        - profile_names: the distinct profile names that hit this group's traceback
+        - usernames: the distinct user names that hit this group's traceback
+        - jira_issue_keys: keys of the jira issues that are an exact match for this group's text
+        - similar_jira_issue_keys: keys of the jira issues that are a similar match for this
+            group's text. may include keys that are also in jira_issue_keys
+    """
+    def __init__(
+            self,
+            traceback_signature,
+            traceback_text,
+            first_seen,
+            last_seen,
+            total_count,
+            daily_counts,
+            latest_occurrences,
+            profile_names,
+            usernames,
+            jira_issue_keys=(),
+            similar_jira_issue_keys=(),
+    ):
+        self._traceback_signature = traceback_signature
+        self._traceback_text = traceback_text
+        self._first_seen = first_seen
+        self._last_seen = last_seen
+        self._total_count = total_count
+        self._daily_counts = daily_counts
+        self._latest_occurrences = latest_occurrences
+        self._profile_names = profile_names
+        self._usernames = usernames
+        self._jira_issue_keys = list(jira_issue_keys)
+        self._similar_jira_issue_keys = list(similar_jira_issue_keys)
+
+    def __repr__(self) -> str:
+        return '%s(%s, %s hits)' % (
+            self.__class__.__name__, self._traceback_signature, self._total_count
+        )
+
+    @property
+    def traceback_signature(self) -> str:
+        return self._traceback_signature
+
+    @property
+    def traceback_text(self) -> str:
+        return self._traceback_text
+
+    @property
+    def first_seen(self) -> datetime.datetime:
+        return self._first_seen
+
+    @property
+    def last_seen(self) -> datetime.datetime:
+        return self._last_seen
+
+    @property
+    def total_count(self) -> int:
+        return self._total_count
+
+    @property
+    def daily_counts(self) -> typing.Dict[str, int]:
+        return self._daily_counts
+
+    @property
+    def latest_occurrences(self) -> typing.List[dict]:
+        return self._latest_occurrences
+
+    @property
+    def profile_names(self) -> typing.List[str]:
+        return self._profile_names
+
+    @property
+    def usernames(self) -> typing.List[str]:
+        return self._usernames
+
+    @property
+    def jira_issue_keys(self) -> typing.List[str]:
+        return self._jira_issue_keys
+
+    @property
+    def similar_jira_issue_keys(self) -> typing.List[str]:
+        return self._similar_jira_issue_keys
+
+    def occurrences(self) -> typing.List[Traceback]:
+        """
+            Returns the group's latest occurrences as L{Traceback}s, latest first.
+
+            The returned Tracebacks carry the group's traceback_text. The context text fields are
+            only stored on the individual traceback documents, so they're loaded on first access.
+        """
+        res = []
+        for occurrence in self._latest_occurrences:
+            source = dict(occurrence)
+            source['traceback_text'] = self._traceback_text
+            res.append(generate_traceback_from_source(source, HEAVY_TEXT_FIELDS))
+        return res
+
+
+def generate_occurrence(traceback:Traceback) -> dict:
+    """
+        Creates the occurrence dict we save on a L{TracebackGroup} for the given L{Traceback}
+
+        On top of the Traceback's metadata fields we save the day the traceback happened on (in the
+        traceback's own timezone) and its timestamp in epoch millis, for sorting.
+    """
+    # read the fields directly: Traceback.document() would load text we don't save here
+    return {
+        "origin_papertrail_id": traceback.origin_papertrail_id,
+        "origin_timestamp": traceback.origin_timestamp.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "instance_id": traceback.instance_id,
+        "program_name": traceback.program_name,
+        "profile_name": traceback.profile_name,
+        "username": traceback.username,
+        "day": traceback.origin_timestamp.strftime('%Y-%m-%d'),
+        "timestamp_millis": _to_epoch_millis(traceback.origin_timestamp),
+    }
+
+
+def generate_group_from_source(source:dict) -> TracebackGroup:
+    """
+        L{source} is a dictionary (from ElasticSearch) containing the fields of a L{TracebackGroup}
+    """
+    return TracebackGroup(
+        source["traceback_signature"],
+        source["traceback_text"],
+        _from_epoch_millis(source["first_seen"]),
+        _from_epoch_millis(source["last_seen"]),
+        source["total_count"],
+        source.get("daily_counts", {}),
+        source.get("latest_occurrences", []),
+        source.get("profile_names", []),
+        source.get("usernames", []),
+        source.get("jira_issue_keys", []), # not present on groups saved before we tracked them
+        source.get("similar_jira_issue_keys", []),
+    )
+
+
+def _to_epoch_millis(timestamp:datetime.datetime) -> int:
+    if timestamp.tzinfo is None:
+        # timestamps without timezone info are in utc
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return int(timestamp.timestamp() * 1000)
+
+
+def _from_epoch_millis(millis:int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(millis / 1000, tz=datetime.timezone.utc)
+
+
+cache_serializer.register_type('traceback_group', TracebackGroup, lambda group: (
+    group.traceback_signature,
+    group.traceback_text,
+    group.first_seen,
+    group.last_seen,
+    group.total_count,
+    group.daily_counts,
+    group.latest_occurrences,
+    group.profile_names,
+    group.usernames,
+    group.jira_issue_keys,
+    group.similar_jira_issue_keys,
+))
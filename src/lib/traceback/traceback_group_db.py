@@ -0,0 +1,730 @@
+"""
+    Utility functions for performing actions on our ES database of traceback groups.
+
+    There is one L{TracebackGroup} document per traceback_signature. Groups are updated with
+    scripted upserts every time we save tracebacks, so reading a group is a single document lookup.
+
+    Each upsert adds to the group's counts, so a traceback must only be added to its group once.
+    Before we add a traceback we claim its occurrence (see L{claim_occurrences}): a document keyed
+    by its papertrail id in L{OCCURRENCE_INDEX}, which only the first claim can create.
+
+    Groups also hold the keys of the jira issues that match them. Those are updated when a jira
+    issue is saved (see L{set_jira_issue_matches}), not when a group is read.
+
+    For all functions, `es` must be an instance of Elasticsearch
+"""
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+import collections
+import datetime
+import logging
+
+import elasticsearch
+import elasticsearch.helpers
+
+from opentracing_instrumentation.request_context import get_current_span
+import opentracing
+
+from common_util import (
+    elasticsearch_config,
+    es_util,
+    redis_util,
+    retry,
+)
+from lib.traceback import traceback_minhash
+from lib.traceback.traceback import Traceback
+from lib.traceback.traceback_group import (
+    TracebackGroup,
+    generate_group_from_source,
+    generate_occurrence,
+)
+
+
+logger = logging.getLogger()
+
+
+DOGPILE_REGION_PREFIX = 'dogpile:traceback-group'
+DOGPILE_REGION = redis_util.make_dogpile_region(DOGPILE_REGION_PREFIX)
+def invalidate_cache():
+    redis_util.force_redis_cache_invalidation(DOGPILE_REGION_PREFIX)
+
+
+INDEX = 'traceback-group-index'
+DOC_TYPE = 'traceback-group'
+
+OCCURRENCE_INDEX = 'traceback-occurrence-index'
+OCCURRENCE_DOC_TYPE = 'traceback-occurrence'
+
+BULK_CHUNK_SIZE = 500
+"""
+    Default number of group upserts we send to ES in a single bulk request
+"""
+
+MAX_LATEST_OCCURRENCES = 100
+"""
+    How many of the most recent occurrences we keep on each group
+"""
+
+MAX_DISTINCT_VALUES = 1000
+"""
+    Max number of distinct profile names (and user names) we keep on each group
+"""
+
+MAX_SIMILAR_CANDIDATES = 1000
+"""
+    Max number of groups sharing a minhash band key that we compare against when looking for
+    similar groups
+"""
+
+UPSERT_SCRIPT = '''
+def group = ctx._source;
+if (group.traceback_signature == null) {
+    group.traceback_signature = params.traceback_signature;
+    group.traceback_text = params.traceback_text;
+    group.total_count = 0;
+    group.daily_counts = new HashMap();
+    group.latest_occurrences = new ArrayList();
+    group.profile_names = new ArrayList();
+    group.usernames = new ArrayList();
+    group.jira_issue_keys = new ArrayList();
+    group.similar_jira_issue_keys = new ArrayList();
+}
+
+boolean changed = false;
+if (group.minhash_band_keys == null) {
+    group.minhash = params.minhash;
+    group.minhash_band_keys = params.minhash_band_keys;
+    changed = true;
+}
+
+Set seen_ids = new HashSet();
+for (def occurrence : group.latest_occurrences) {
+    seen_ids.add(occurrence.origin_papertrail_id);
+}
+
+for (def occurrence : params.occurrences) {
+    if (seen_ids.contains(occurrence.origin_papertrail_id)) {
+        continue;
+    }
+    seen_ids.add(occurrence.origin_papertrail_id);
+    changed = true;
+
+    group.total_count += 1;
+    group.daily_counts[occurrence.day] = group.daily_counts.getOrDefault(occurrence.day, 0) + 1;
+    if (group.first_seen == null || occurrence.timestamp_millis < group.first_seen) {
+        group.first_seen = occurrence.timestamp_millis;
+    }
+    if (group.last_seen == null || occurrence.timestamp_millis > group.last_seen) {
+        group.last_seen = occurrence.timestamp_millis;
+    }
+    if (occurrence.profile_name != null
+            && group.profile_names.size() < params.max_distinct_values
+            && !group.profile_names.contains(occurrence.profile_name)) {
+        group.profile_names.add(occurrence.profile_name);
+    }
+    if (occurrence.username != null
+            && group.usernames.size() < params.max_distinct_values
+            && !group.usernames.contains(occurrence.username)) {
+        group.usernames.add(occurrence.username);
+    }
+    group.latest_occurrences.add(occurrence);
+}
+
+if (!changed) {
+    ctx.op = 'noop';
+} else {
+    group.latest_occurrences.sort((a, b) ->
+        b.timestamp_millis < a.timestamp_millis ? -1 : (b.timestamp_millis > a.timestamp_millis ? 1 : 0)
+    );
+    if (group.latest_occurrences.size() > params.max_latest_occurrences) {
+        group.latest_occurrences = new ArrayList(
+            group.latest_occurrences.subList(0, params.max_latest_occurrences)
+        );
+    }
+}
+'''
+"""
+    Painless script that adds a batch of occurrences to a traceback group, creating it if needed.
+    Groups saved before we sketched their text get their minhash and band keys.
+
+    Occurrences whose ids are already in the group's latest_occurrences are skipped. That's only a
+    backstop: we only remember the latest occurrences, so it's our occurrence claims that keep a
+    re-saved traceback from being counted twice (see L{add_occurrences}).
+"""
+
+
+def add_occurrences(es, tracebacks:Iterable[Traceback], chunk_size:int=BULK_CHUNK_SIZE
+) -> Tuple[int, List[dict]]:
+    """
+        Adds the given L{Traceback}s to their groups, skipping any that were added before
+
+        We claim every traceback's occurrence, and only add the ones we claimed. If ES tells us a
+        group's upsert failed, we release the claims of its tracebacks, so they're added when we
+        try them again. A request that ES never answers may or may not have been applied: we keep
+        the claims of its tracebacks, so they're never counted twice, but may never be counted.
+
+        Returns a tuple of (number of tracebacks added, list of per-item error dicts from ES). Each
+        error is for one traceback, with its papertrail id as the _id
+    """
+    claimed, errors = claim_occurrences(es, tracebacks, chunk_size)
+    tracebacks_by_signature: Dict[str, List[Traceback]] = collections.OrderedDict()
+    for traceback in claimed:
+        tracebacks_by_signature.setdefault(traceback.traceback_signature, []).append(traceback)
+    signatures = list(tracebacks_by_signature)
+
+    num_added = 0
+    for start in range(0, len(signatures), chunk_size):
+        chunk = [
+            traceback
+            for signature in signatures[start:start + chunk_size]
+            for traceback in tracebacks_by_signature[signature]
+        ]
+        try:
+            _, group_errors = save_occurrences(es, chunk, chunk_size)
+        except elasticsearch.exceptions.TransportError as e:
+            unsent = [
+                traceback
+                for signature in signatures[start + chunk_size:]
+                for traceback in tracebacks_by_signature[signature]
+            ]
+            if isinstance(e, elasticsearch.exceptions.ConnectionError):
+                release_occurrences(es, unsent, chunk_size)
+            else:
+                release_occurrences(es, chunk + unsent, chunk_size)
+            raise
+
+        failed = []
+        for error in group_errors:
+            op_type, item = next(iter(error.items()))
+            for traceback in tracebacks_by_signature[item['_id']]:
+                failed.append(traceback)
+                errors.append({op_type: dict(item, _id=str(traceback.origin_papertrail_id))})
+        if failed:
+            release_occurrences(es, failed, chunk_size)
+        num_added += len(chunk) - len(failed)
+    return num_added, errors
+
+
+def claim_occurrences(es, tracebacks:Iterable[Traceback], chunk_size:int=BULK_CHUNK_SIZE
+) -> Tuple[List[Traceback], List[dict]]:
+    """
+        Claims the occurrence of each of the given tracebacks, by creating its document in
+        L{OCCURRENCE_INDEX}. Tracebacks that were claimed before are skipped
+
+        Not retried: a claim that was created before its request timed out would look like it was
+        someone else's.
+
+        Returns a tuple of (tracebacks we claimed, list of per-item error dicts from ES for the
+        tracebacks we failed to claim)
+    """
+    tracebacks_by_id = collections.OrderedDict(
+        (str(tb.origin_papertrail_id), tb) for tb in tracebacks
+    )
+    claimed: List[Traceback] = []
+    errors: List[dict] = []
+    try:
+        _claim(es, tracebacks_by_id, chunk_size, claimed, errors)
+    except elasticsearch.exceptions.TransportError:
+        # the claims we made are no use if we can't add their tracebacks
+        release_occurrences(es, claimed, chunk_size)
+        raise
+    return claimed, errors
+
+
+def _claim(es, tracebacks_by_id:Dict[str, Traceback], chunk_size:int, claimed:List[Traceback],
+           errors:List[dict]):
+    for ok, item in elasticsearch.helpers.streaming_bulk(
+            es,
+            (
+                {
+                    "_op_type": "create",
+                    "_index": OCCURRENCE_INDEX,
+                    "_type": OCCURRENCE_DOC_TYPE,
+                    "_id": papertrail_id,
+                    "_source": {
+                        "traceback_signature": traceback.traceback_signature,
+                        "origin_timestamp": traceback.origin_timestamp,
+                    },
+                }
+                for papertrail_id, traceback in tracebacks_by_id.items()
+            ),
+            chunk_size=chunk_size,
+            raise_on_error=False,
+            max_retries=3,
+            request_timeout=elasticsearch_config.REQUEST_TIMEOUTS['bulk'],
+    ):
+        if ok:
+            claimed.append(tracebacks_by_id[item['create']['_id']])
+        elif item['create'].get('status') != 409: # 409 means it was claimed before
+            logger.error('failed to claim traceback occurrence: %s', item)
+            errors.append(item)
+
+
+def release_occurrences(es, tracebacks:Iterable[Traceback], chunk_size:int=BULK_CHUNK_SIZE):
+    """
+        Deletes the claims of the given tracebacks, which we failed to add to their groups. If we
+        can't, they won't be counted when we try them again
+    """
+    try:
+        for ok, item in elasticsearch.helpers.streaming_bulk(
+                es,
+                (
+                    {
+                        "_op_type": "delete",
+                        "_index": OCCURRENCE_INDEX,
+                        "_type": OCCURRENCE_DOC_TYPE,
+                        "_id": str(traceback.origin_papertrail_id),
+                    }
+                    for traceback in tracebacks
+                ),
+                chunk_size=chunk_size,
+                raise_on_error=False,
+                max_retries=3,
+                request_timeout=elasticsearch_config.REQUEST_TIMEOUTS['bulk'],
+        ):
+            if not ok and item['delete'].get('status') != 404:
+                logger.error('failed to release traceback occurrence: %s', item)
+    except elasticsearch.exceptions.TransportError:
+        logger.error('failed to release traceback occurrences', exc_info=True)
+
+
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def delete_occurrences_before(es, day:datetime.date):
+    """
+        Deletes the claims of every traceback from before the given day, once their partitions are
+        gone. Tracebacks from then that we save again are counted again
+    """
+    es.delete_by_query(
+        index=OCCURRENCE_INDEX,
+        doc_type=OCCURRENCE_DOC_TYPE,
+        body={"query": {"range": {"origin_timestamp": {"lt": day.isoformat()}}}},
+        conflicts='proceed',
+        ignore_unavailable=True,
+        request_timeout=elasticsearch_config.REQUEST_TIMEOUTS['maintenance'],
+    )
+
+
+def save_occurrences(es, tracebacks:Iterable[Traceback], chunk_size:int=BULK_CHUNK_SIZE
+) -> Tuple[int, List[dict]]:
+    """
+        Adds the given L{Traceback}s to their L{TracebackGroup}s with bulk scripted upserts
+
+        Tracebacks are grouped by signature first, so each group gets a single upsert per call.
+
+        Invalidates the dogpile cache once, after the whole batch has been sent.
+
+        Returns a tuple of (number of groups updated, list of per-item error dicts from ES)
+    """
+    num_updated = 0
+    errors = []
+    for ok, item in elasticsearch.helpers.streaming_bulk(
+            es,
+            _create_upserts(tracebacks),
+            chunk_size=chunk_size,
+            raise_on_error=False,
+            max_retries=3,
+            request_timeout=elasticsearch_config.REQUEST_TIMEOUTS['bulk'],
+    ):
+        if ok:
+            num_updated += 1
+        else:
+            logger.error('failed to update traceback group: %s', item)
+            errors.append(item)
+    if num_updated:
+        invalidate_cache()
+    return num_updated, errors
+
+
+ADD_JIRA_ISSUE_KEYS_SCRIPT = '''
+def group = ctx._source;
+if (group.jira_issue_keys == null) {
+    group.jira_issue_keys = new ArrayList();
+}
+if (group.similar_jira_issue_keys == null) {
+    group.similar_jira_issue_keys = new ArrayList();
+}
+List old_keys = new ArrayList(group.jira_issue_keys);
+List old_similar_keys = new ArrayList(group.similar_jira_issue_keys);
+
+if (params.replaced_jira_issue_key != null) {
+    group.jira_issue_keys.removeIf(key -> key == params.replaced_jira_issue_key);
+    group.similar_jira_issue_keys.removeIf(key -> key == params.replaced_jira_issue_key);
+}
+for (def key : params.jira_issue_keys) {
+    if (!group.jira_issue_keys.contains(key)) {
+        group.jira_issue_keys.add(key);
+    }
+}
+for (def key : params.similar_jira_issue_keys) {
+    if (!group.similar_jira_issue_keys.contains(key)) {
+        group.similar_jira_issue_keys.add(key);
+    }
+}
+
+if (group.jira_issue_keys.equals(old_keys)
+        && group.similar_jira_issue_keys.equals(old_similar_keys)) {
+    ctx.op = 'noop';
+}
+'''
+"""
+    Painless script that adds jira issue keys (exact and similar matches) to a traceback group.
+
+    If replaced_jira_issue_key is set, that key is removed from the group first. That lets us move
+    an issue from the similar keys to the exact keys (or back) in one update.
+"""
+
+REMOVE_JIRA_ISSUE_KEY_SCRIPT = '''
+def group = ctx._source;
+if (group.jira_issue_keys != null) {
+    group.jira_issue_keys.removeIf(key -> key == params.jira_issue_key);
+}
+if (group.similar_jira_issue_keys != null) {
+    group.similar_jira_issue_keys.removeIf(key -> key == params.jira_issue_key);
+}
+'''
+"""
+    Painless script that removes a jira issue key from a traceback group
+"""
+
+
+def _create_upserts(tracebacks:Iterable[Traceback]):
+    tracebacks_by_signature: Dict[str, List[Traceback]] = collections.OrderedDict()
+    for traceback in tracebacks:
+        assert isinstance(traceback, Traceback), (type(traceback), traceback)
+        tracebacks_by_signature.setdefault(traceback.traceback_signature, []).append(traceback)
+
+    for signature, grouped_tracebacks in tracebacks_by_signature.items():
+        minhash = traceback_minhash.generate_minhash(grouped_tracebacks[0].traceback_text)
+        yield {
+            "_op_type": "update",
+            "_index": INDEX,
+            "_type": DOC_TYPE,
+            "_id": signature,
+            "retry_on_conflict": 5,
+            "scripted_upsert": True,
+            "upsert": {},
+            "script": {
+                "source": UPSERT_SCRIPT,
+                "lang": "painless",
+                "params": {
+                    "traceback_signature": signature,
+                    "traceback_text": grouped_tracebacks[0].traceback_text,
+                    "occurrences": [generate_occurrence(tb) for tb in grouped_tracebacks],
+                    "minhash": minhash,
+                    "minhash_band_keys": traceback_minhash.generate_band_keys(minhash),
+                    "max_latest_occurrences": MAX_LATEST_OCCURRENCES,
+                    "max_distinct_values": MAX_DISTINCT_VALUES,
+                },
+            },
+        }
+
+
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def get_traceback_group(es, traceback_signature:str) -> Optional[TracebackGroup]:
+    """
+        Retrieves the group with the given signature. Returns None if we haven't seen it
+    """
+    try:
+        raw_es_response = es.get(
+            index=INDEX,
+            doc_type=DOC_TYPE,
+            id=traceback_signature
+        )
+    except elasticsearch.exceptions.NotFoundError:
+        return None
+    return generate_group_from_source(raw_es_response['_source'])
+
+
+@DOGPILE_REGION.cache_on_arguments()
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def get_traceback_groups(es, tracer, traceback_signatures:tuple) -> Dict[str, TracebackGroup]:
+    """
+        Retrieves the groups for all the given signatures in a single request
+
+        Takes a tuple (instead of a list) so we can be cached. Signatures we haven't seen are left
+        out of the returned dict.
+
+        @rtype: dict
+        @postcondition: all(isinstance(v, TracebackGroup) for v in return.values())
+    """
+    if not traceback_signatures:
+        return {}
+
+    tracer = tracer or opentracing.tracer
+    root_span = get_current_span()
+    with tracer.start_span('elasticsearch', child_of=root_span):
+        try:
+            raw_es_response = es.mget(
+                index=INDEX,
+                doc_type=DOC_TYPE,
+                body={"ids": list(traceback_signatures)}
+            )
+        except elasticsearch.exceptions.NotFoundError:
+            logger.warning('traceback group index not found. has it been created?')
+            return {}
+    res = {}
+    for raw_group in raw_es_response['docs']:
+        if raw_group.get('found'):
+            res[raw_group['_id']] = generate_group_from_source(raw_group['_source'])
+    return res
+
+
+@DOGPILE_REGION.cache_on_arguments()
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def get_jira_issue_keys(es, tracer, traceback_signatures:tuple) -> Dict[str, List[str]]:
+    """
+        Retrieves the exact match jira issue keys of all the given signatures' groups in a single
+        request
+
+        A lighter L{get_traceback_groups}, for when we need the keys of many more groups than we
+        display: we only fetch that one field of each group. Takes a tuple (instead of a list) so
+        we can be cached. Signatures we haven't seen are left out of the returned dict.
+
+        @rtype: dict
+    """
+    if not traceback_signatures:
+        return {}
+
+    tracer = tracer or opentracing.tracer
+    root_span = get_current_span()
+    with tracer.start_span('elasticsearch', child_of=root_span):
+        try:
+            raw_es_response = es.mget(
+                index=INDEX,
+                doc_type=DOC_TYPE,
+                body={"ids": list(traceback_signatures)},
+                _source_include=['jira_issue_keys'],
+            )
+        except elasticsearch.exceptions.NotFoundError:
+            logger.warning('traceback group index not found. has it been created?')
+            return {}
+    return {
+        raw_group['_id']: raw_group['_source'].get('jira_issue_keys', [])
+        for raw_group in raw_es_response['docs']
+        if raw_group.get('found')
+    }
+
+
+@DOGPILE_REGION.cache_on_arguments()
+def get_similar_signatures(es, tracer, traceback_text:str) -> list:
+    """
+        Returns the signatures of the groups whose text is similar to the given traceback_text, as
+        judged by their minhashes (see L{traceback_minhash})
+
+        @rtype: list
+    """
+    similar = find_similar_groups(es, tracer, [traceback_minhash.generate_minhash(traceback_text)])
+    return sorted(similar)
+
+
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def find_similar_groups(es, tracer, minhashes:List[List[int]]) -> Dict[str, float]:
+    """
+        Finds the groups whose minhash is similar to any of the given minhashes
+
+        A single terms query finds the candidate groups, the ones that share a band key with one
+        of the minhashes. We keep the candidates whose estimated similarity is at least
+        L{traceback_minhash.SIMILARITY_THRESHOLD}. Not cached.
+
+        @return: a dict of traceback signature -> the group's best estimated similarity
+    """
+    minhashes = [minhash for minhash in minhashes if minhash]
+    band_keys = sorted(set(
+        key for minhash in minhashes for key in traceback_minhash.generate_band_keys(minhash)
+    ))
+    if not band_keys:
+        return {}
+
+    tracer = tracer or opentracing.tracer
+    root_span = get_current_span()
+    with tracer.start_span('elasticsearch', child_of=root_span) as span:
+        try:
+            raw_es_response = es.search(
+                index=INDEX,
+                doc_type=DOC_TYPE,
+                body={
+                    "_source": ["minhash"],
+                    "query": {
+                        "constant_score": {
+                            "filter": {"terms": {"minhash_band_keys": band_keys}}
+                        }
+                    },
+                },
+                size=MAX_SIMILAR_CANDIDATES,
+            )
+        except elasticsearch.exceptions.NotFoundError:
+            logger.warning('traceback group index not found. has it been created?')
+            return {}
+        span.set_tag('candidates', len(raw_es_response['hits']['hits']))
+    res = {}
+    for raw_group in raw_es_response['hits']['hits']:
+        similarity = max(
+            traceback_minhash.estimate_similarity(minhash, raw_group['_source'].get('minhash'))
+            for minhash in minhashes
+        )
+        if similarity >= traceback_minhash.SIMILARITY_THRESHOLD:
+            res[raw_group['_id']] = similarity
+    return res
+
+
+def add_jira_issue_keys(es, jira_issue_keys_by_signature:Dict[str, Dict[int, List[str]]],
+                        replaced_jira_issue_key:Optional[str]=None,
+                        chunk_size:int=BULK_CHUNK_SIZE) -> int:
+    """
+        Adds matching jira issue keys to the given traceback groups
+
+        L{jira_issue_keys_by_signature} is a dict of traceback signature -> dict of match level ->
+        jira issue keys. SIMILAR_MATCH keys are stored separately from EXACT_MATCH keys. Groups we
+        don't have are skipped.
+
+        If L{replaced_jira_issue_key} is given, it's removed from each group before we add keys.
+
+        Invalidates the dogpile cache once, after the whole batch has been sent.
+
+        Returns the number of groups updated
+    """
+    actions = (
+        {
+            "_op_type": "update",
+            "_index": INDEX,
+            "_type": DOC_TYPE,
+            "_id": signature,
+            "retry_on_conflict": 5,
+            "script": {
+                "source": ADD_JIRA_ISSUE_KEYS_SCRIPT,
+                "lang": "painless",
+                "params": {
+                    "jira_issue_keys": sorted(keys_by_level.get(es_util.EXACT_MATCH, [])),
+                    "similar_jira_issue_keys": sorted(
+                        keys_by_level.get(es_util.SIMILAR_MATCH, [])
+                    ),
+                    "replaced_jira_issue_key": replaced_jira_issue_key,
+                },
+            },
+        }
+        for signature, keys_by_level in jira_issue_keys_by_signature.items()
+    )
+    num_updated = 0
+    for ok, item in elasticsearch.helpers.streaming_bulk(
+            es, actions, chunk_size=chunk_size, raise_on_error=False, max_retries=3,
+            request_timeout=elasticsearch_config.REQUEST_TIMEOUTS['bulk'],
+    ):
+        if ok:
+            num_updated += 1
+        elif item['update'].get('status') != 404: # it's ok if we don't have the group
+            logger.error('failed to add jira issue keys to traceback group: %s', item)
+    if num_updated:
+        invalidate_cache()
+    return num_updated
+
+
+def set_jira_issue_matches(es, jira_issue_key:str, signatures_by_match_level:Dict[int, Set[str]]):
+    """
+        Records that the given jira issue matches exactly the given traceback groups
+
+        L{signatures_by_match_level} is a dict of match level -> traceback signatures, as returned
+        by L{traceback_query_db.percolate}. The key is added to each of those groups and removed
+        from any other group that had it, in case the issue's text changed.
+    """
+    all_signatures = set()
+    for signatures in signatures_by_match_level.values():
+        all_signatures.update(signatures)
+
+    keys_by_signature: Dict[str, Dict[int, List[str]]] = collections.defaultdict(dict)
+    for match_level, signatures in signatures_by_match_level.items():
+        for signature in signatures:
+            keys_by_signature[signature][match_level] = [jira_issue_key]
+    add_jira_issue_keys(es, keys_by_signature, replaced_jira_issue_key=jira_issue_key)
+    remove_jira_issue_key(es, jira_issue_key, all_signatures)
+
+
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def remove_jira_issue_key(es, jira_issue_key:str, keep_signatures:Iterable[str]=()):
+    """
+        Removes the given jira issue key from every traceback group that has it, except for the
+        groups in L{keep_signatures}
+
+        Invalidates the dogpile cache
+    """
+    query = {
+        "bool": {
+            "should": [
+                {"term": {"jira_issue_keys": jira_issue_key}},
+                {"term": {"similar_jira_issue_keys": jira_issue_key}},
+            ],
+            "minimum_should_match": 1,
+        }
+    }
+    keep_signatures = sorted(keep_signatures)
+    if keep_signatures:
+        query["bool"]["must_not"] = {"ids": {"values": keep_signatures}}
+    try:
+        res = es.update_by_query(
+            index=INDEX,
+            doc_type=DOC_TYPE,
+            body={
+                "query": query,
+                "script": {
+                    "source": REMOVE_JIRA_ISSUE_KEY_SCRIPT,
+                    "lang": "painless",
+                    "params": {"jira_issue_key": jira_issue_key},
+                },
+            },
+            conflicts='proceed',
+            request_timeout=elasticsearch_config.REQUEST_TIMEOUTS['maintenance'],
+        )
+    except elasticsearch.exceptions.NotFoundError:
+        logger.warning('traceback group index not found. has it been created?')
+        return
+    if res.get('updated'):
+        invalidate_cache()
+
+
+def put_mapping(es):
+    """
+        Adds the mappings for the jira issue key and minhash fields, so groups saved before we
+        tracked them can still be searched by them
+    """
+    es.indices.put_mapping(
+        index=INDEX,
+        doc_type=DOC_TYPE,
+        body={
+            "properties": {
+                "jira_issue_keys": {"type": "keyword"},
+                "similar_jira_issue_keys": {"type": "keyword"},
+                "minhash": {"type": "long", "index": False, "doc_values": False},
+                "minhash_band_keys": {"type": "keyword"},
+            }
+        }
+    )
+
+
+def clear(es):
+    """
+        Removes every traceback group, and every occurrence claim, from the database. Used before
+        rebuilding the groups
+    """
+    es.delete_by_query(
+        index=INDEX,
+        doc_type=DOC_TYPE,
+        body={"query": {"match_all": {}}},
+        conflicts='proceed',
+        request_timeout=elasticsearch_config.REQUEST_TIMEOUTS['maintenance'],
+    )
+    # delete_by_query only sees the claims that have been refreshed
+    es.indices.refresh(index=OCCURRENCE_INDEX, ignore_unavailable=True)
+    es.delete_by_query(
+        index=OCCURRENCE_INDEX,
+        doc_type=OCCURRENCE_DOC_TYPE,
+        body={"query": {"match_all": {}}},
+        conflicts='proceed',
+        ignore_unavailable=True,
+        request_timeout=elasticsearch_config.REQUEST_TIMEOUTS['maintenance'],
+    )
+    invalidate_cache()
@@ -0,0 +1,105 @@
+"""
+    MinHash sketches of traceback texts, for finding similar (not just identical) tracebacks.
+
+    A traceback's text is split into the tokens our ES analyzer sees (see
+    L{traceback.generate_tokens}) and then into overlapping shingles of L{SHINGLE_SIZE} tokens.
+    Its minhash is the minimum hash of those shingles under each of L{NUM_HASHES} hash functions
+    (multiply-add hashes of the shingles' crc32, which are cheap to compute in pure python).
+    The fraction of positions at which two minhashes agree estimates the Jaccard similarity of
+    the two shingle sets.
+
+    To look up similar tracebacks without comparing against every one of them, each minhash is cut
+    into bands of L{BAND_SIZE} values and each band is hashed into a keyword (locality sensitive
+    hashing). We store those band keys with the sketch: two texts that share any band key are
+    candidates, and we only compute the similarity estimate for candidates.
+"""
+import random
+import typing
+import zlib
+
+from lib.traceback.traceback import generate_tokens
+
+
+SHINGLE_SIZE = 3
+"""
+    Number of consecutive tokens in each shingle
+"""
+
+NUM_HASHES = 120
+"""
+    Number of hash functions, and so the number of values in each minhash
+"""
+
+BAND_SIZE = 3
+"""
+    Number of minhash values in each LSH band. With L{NUM_HASHES} we get 40 bands: texts with a
+    Jaccard similarity of 0.5 share a band key over 99% of the time, texts at 0.1 under 5%
+"""
+
+SIMILARITY_THRESHOLD = 0.5
+"""
+    Minimum estimated Jaccard similarity for two traceback texts to be a SIMILAR_MATCH. Tracebacks
+    that differ only in their exception message, or in one frame of a short stack, are above this
+"""
+
+_HASH_MASK = (1 << 63) - 1 # so every value fits in an ES long
+_HASH_SEED = 5381
+
+def _generate_hash_params() -> typing.List[typing.Tuple[int, int]]:
+    # the parameters are part of every sketch we've saved. changing them (or the seed) means every
+    # stored sketch has to be regenerated
+    rand = random.Random(_HASH_SEED)
+    return [(rand.getrandbits(64) | 1, rand.getrandbits(64)) for _ in range(NUM_HASHES)]
+
+_HASH_PARAMS = _generate_hash_params()
+
+
+def generate_minhash(traceback_text:str) -> typing.List[int]:
+    """
+        Creates the minhash of the given traceback text
+
+        @return: a list of L{NUM_HASHES} ints, or an empty list if the text has no tokens
+    """
+    shingles = _generate_shingle_hashes(traceback_text)
+    if not shingles:
+        return []
+    # list comprehensions, rather than generators, are measurably faster here
+    return [min([(a * shingle + b) & _HASH_MASK for shingle in shingles]) for a, b in _HASH_PARAMS]
+
+
+def _generate_shingle_hashes(traceback_text:str) -> typing.Set[int]:
+    tokens = generate_tokens(traceback_text)
+    # texts shorter than a shingle become a single shingle
+    num_shingles = max(1, len(tokens) - SHINGLE_SIZE + 1) if tokens else 0
+    return set(
+        zlib.crc32(' '.join(tokens[i:i + SHINGLE_SIZE]).encode('utf-8'))
+        for i in range(num_shingles)
+    )
+
+
+def generate_band_keys(minhash:typing.List[int]) -> typing.List[str]:
+    """
+        Cuts the given minhash into bands of L{BAND_SIZE} values and creates a keyword for each
+
+        Each key includes its band's number, so equal values in different bands don't collide.
+    """
+    keys = []
+    for band, start in enumerate(range(0, len(minhash), BAND_SIZE)):
+        values = ','.join(str(value) for value in minhash[start:start + BAND_SIZE])
+        keys.append('%02d-%08x' % (band, zlib.crc32(values.encode('utf-8'))))
+    return keys
+
+
+def estimate_similarity(minhash_a:typing.List[int], minhash_b:typing.List[int]) -> float:
+    """
+        Estimates the Jaccard similarity of the shingles of the two texts the minhashes came from
+
+        @return: a float between 0 and 1. 0 if either minhash is empty
+    """
+    if not minhash_a or not minhash_b or len(minhash_a) != len(minhash_b):
+        return 0.0
+    return sum(1 for a, b in zip(minhash_a, minhash_b) if a == b) / len(minhash_a)
+
+
+def is_similar(minhash_a:typing.List[int], minhash_b:typing.List[int]) -> bool:
+    return estimate_similarity(minhash_a, minhash_b) >= SIMILARITY_THRESHOLD
@@ -0,0 +1,230 @@
+"""
+    Utility functions for our ES percolator index of traceback queries.
+
+    We store the queries that find the jira issues exactly matching a traceback (one per
+    traceback_signature) instead of running them every time we render a traceback. When a jira
+    issue is saved we percolate it: ES tells us which stored queries match the issue, and so which
+    traceback groups the issue belongs to. Similar matches don't need stored queries; they're found
+    by comparing minhashes (see L{traceback_group_db.find_similar_groups}).
+
+    For all functions, `es` must be an instance of Elasticsearch
+"""
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Set,
+)
+import collections
+import logging
+
+import elasticsearch
+import elasticsearch.helpers
+
+import opentracing
+
+from common_util import (
+    elasticsearch_config,
+    es_util,
+    retry,
+)
+from lib.jira import jira_issue_match
+from lib.jira.jira_issue import JiraIssue, generate_from_source
+from lib.traceback.traceback import Traceback
+
+
+logger = logging.getLogger()
+
+
+INDEX = 'traceback-query-index'
+DOC_TYPE = 'traceback-query'
+
+JIRA_FIELDS = ["description_filtered", "comments_filtered"]
+"""
+    The jira issue fields our queries match against. Must be mapped in our index, with the same
+    analyzer as the jira issue index
+"""
+
+QUERY_MATCH_LEVELS = (es_util.EXACT_MATCH,)
+"""
+    The match levels we store queries for
+"""
+
+BULK_CHUNK_SIZE = 500
+"""
+    Default number of queries we send to ES in a single bulk request
+"""
+
+
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def get_unregistered(es, tracebacks:Iterable[Traceback]) -> List[Traceback]:
+    """
+        Returns one traceback for each signature of the given tracebacks that's missing any of its
+        L{QUERY_MATCH_LEVELS} queries, with a single mget
+    """
+    tracebacks_by_signature = collections.OrderedDict(
+        (tb.traceback_signature, tb) for tb in tracebacks
+    )
+    if not tracebacks_by_signature:
+        return []
+    try:
+        raw_es_response = es.mget(
+            index=INDEX,
+            doc_type=DOC_TYPE,
+            body={"ids": [
+                _get_query_id(signature, match_level)
+                for signature in tracebacks_by_signature
+                for match_level in QUERY_MATCH_LEVELS
+            ]},
+            _source=False,
+        )
+    except elasticsearch.exceptions.NotFoundError:
+        logger.warning('traceback query index not found. has it been created?')
+        return list(tracebacks_by_signature.values())
+    unregistered = collections.OrderedDict()
+    for raw_query in raw_es_response['docs']:
+        if not raw_query.get('found'):
+            signature = raw_query['_id'].rsplit('-', 1)[0]
+            unregistered[signature] = tracebacks_by_signature[signature]
+    return list(unregistered.values())
+
+
+def register_queries(es, tracebacks:Iterable[Traceback], chunk_size:int=BULK_CHUNK_SIZE
+) -> List[Traceback]:
+    """
+        Stores the L{QUERY_MATCH_LEVELS} queries for the signature of each given traceback
+
+        Signatures that already have their queries are left alone, so this is cheap to call with
+        every batch of tracebacks we save.
+
+        Returns one traceback for each signature we registered queries for. Jira issues saved
+        before now were never percolated against those queries; it's up to the caller to match
+        them.
+    """
+    tracebacks_by_signature = collections.OrderedDict(
+        (tb.traceback_signature, tb) for tb in tracebacks
+    )
+    registered = collections.OrderedDict()
+    for ok, item in elasticsearch.helpers.streaming_bulk(
+            es,
+            _create_queries(tracebacks_by_signature.values()),
+            chunk_size=chunk_size,
+            raise_on_error=False,
+            max_retries=3,
+            request_timeout=elasticsearch_config.REQUEST_TIMEOUTS['bulk'],
+    ):
+        if ok:
+            signature = item['create']['_id'].rsplit('-', 1)[0]
+            registered[signature] = tracebacks_by_signature[signature]
+        elif item['create'].get('status') != 409: # 409 means we already have this query
+            logger.error('failed to register traceback query: %s', item)
+    return list(registered.values())
+
+
+def _create_queries(tracebacks:Iterable[Traceback]):
+    for traceback in tracebacks:
+        assert isinstance(traceback, Traceback), (type(traceback), traceback)
+        for match_level in QUERY_MATCH_LEVELS:
+            yield {
+                "_op_type": "create",
+                "_index": INDEX,
+                "_type": DOC_TYPE,
+                "_id": _get_query_id(traceback.traceback_signature, match_level),
+                "_source": {
+                    "query": generate_query(traceback.traceback_text, match_level),
+                    "traceback_signature": traceback.traceback_signature,
+                    "match_level": match_level,
+                },
+            }
+
+
+def generate_query(traceback_text:str, match_level:int) -> dict:
+    """
+        Creates the query we store for traceback_text at match_level. Jira issues found by this
+        query are the same ones that match it when they're percolated
+    """
+    return es_util.generate_text_match_payload(traceback_text, JIRA_FIELDS, match_level)["query"]
+
+
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def search_matching_jira_issues(es, traceback_texts:Iterable[str], match_level:int
+) -> Dict[str, List[JiraIssue]]:
+    """
+        Finds the saved jira issues matching each of the given traceback_texts, using the same
+        query we register for them. Used to match the issues that were saved before a query was
+        registered, and so were never percolated against it
+
+        @return: a dict of traceback text -> list of matching L{JiraIssue}
+
+        @precondition: match_level in QUERY_MATCH_LEVELS
+        @postcondition: set(return.keys()) == set(traceback_texts)
+    """
+    assert match_level in QUERY_MATCH_LEVELS, (match_level, QUERY_MATCH_LEVELS)
+
+    distinct_texts = sorted(set(traceback_texts))
+    bodies = [
+        {
+            "_source": {"excludes": jira_issue_match.TRACEBACK_FIELDS},
+            "query": generate_query(traceback_text, match_level),
+            "size": jira_issue_match.MAX_MATCHES,
+        }
+        for traceback_text in distinct_texts
+    ]
+    responses = es_util.msearch(
+        es, opentracing.tracer, jira_issue_match.INDEX, jira_issue_match.DOC_TYPE, bodies
+    )
+
+    res: Dict[str, List[JiraIssue]] = {}
+    for traceback_text, raw_es_response in zip(distinct_texts, responses):
+        if raw_es_response is None:
+            res[traceback_text] = []
+            continue
+        res[traceback_text] = [
+            generate_from_source(hit['_source']) for hit in raw_es_response['hits']['hits']
+        ]
+    return res
+
+
+def _get_query_id(traceback_signature:str, match_level:int) -> str:
+    return '%s-%s' % (traceback_signature, match_level)
+
+
+@retry.Retry(exceptions=(elasticsearch.exceptions.ConnectionTimeout,))
+def percolate(es, document:dict) -> Dict[int, Set[str]]:
+    """
+        Finds every stored query that matches the given jira issue document
+
+        Only the L{JIRA_FIELDS} of the document are sent to ES. Pages through the matches with a
+        scroll, since a popular issue may match many signatures.
+
+        Match levels we don't store queries for (see L{QUERY_MATCH_LEVELS}) get an empty set. That
+        includes any queries for them stored before we stopped storing them.
+
+        @return: a dict of match level -> set of traceback signatures whose query matched
+        @postcondition: set(return.keys()) == es_util.ALL_MATCH_LEVELS
+    """
+    res: Dict[int, Set[str]] = {match_level: set() for match_level in es_util.ALL_MATCH_LEVELS}
+    body = {
+        "_source": ["traceback_signature", "match_level"],
+        "query": {
+            "bool": {
+                "must": {
+                    "percolate": {
+                        "field": "query",
+                        "document": {field: document.get(field) for field in JIRA_FIELDS},
+                    }
+                },
+                "filter": {"terms": {"match_level": list(QUERY_MATCH_LEVELS)}},
+            }
+        }
+    }
+    try:
+        for raw_query in elasticsearch.helpers.scan(
+                es, index=INDEX, doc_type=DOC_TYPE, query=body
+        ):
+            res[raw_query['_source']['match_level']].add(
+                raw_query['_source']['traceback_signature']
+            )
+    except elasticsearch.exceptions.NotFoundError:
+        logger.warning('traceback query index not found. has it been created?')
+    return res
@@ -0,0 +1,109 @@
+"""
+    Splits a date range into the time buckets of our traceback occurrence time series.
+
+    Buckets are in UTC and line up with the buckets of an ES date_histogram with the same interval:
+    hours and days start on the hour and at midnight, weeks start on Monday and months on the 1st.
+    Every bucket covers its whole interval, so the first and last bucket of a range may start
+    before or end after the range itself. That's what lets us cache each bucket on its own.
+"""
+import datetime
+import typing
+
+
+INTERVALS = ('hour', 'day', 'week', 'month')
+"""
+    The bucket sizes we support. Also the names ES's date_histogram uses for them
+"""
+
+MAX_BUCKETS = 2000
+"""
+    Max number of buckets we return for a single time series
+"""
+
+
+def get_buckets(interval:str, start_date:datetime.date, end_date:datetime.date
+) -> typing.List[typing.Tuple[datetime.datetime, datetime.datetime]]:
+    """
+        Returns the (start, end) of each bucket that covers start_date to end_date (inclusive), in
+        order. A bucket includes its start and excludes its end
+
+        @precondition: interval in INTERVALS
+        @precondition: start_date <= end_date
+        @postcondition: len(return) <= MAX_BUCKETS
+    """
+    assert interval in INTERVALS, (interval, INTERVALS)
+    assert start_date <= end_date, (start_date, end_date)
+
+    range_start = datetime.datetime.combine(start_date, datetime.time(tzinfo=datetime.timezone.utc))
+    range_end = range_start + datetime.timedelta(days=(end_date - start_date).days + 1)
+
+    buckets: typing.List[typing.Tuple[datetime.datetime, datetime.datetime]] = []
+    bucket_start = get_bucket_start(interval, range_start)
+    while bucket_start < range_end:
+        if len(buckets) == MAX_BUCKETS:
+            raise ValueError('more than %s %s buckets from %s to %s' % (
+                MAX_BUCKETS, interval, start_date, end_date
+            ))
+        bucket_end = _get_next_bucket_start(interval, bucket_start)
+        buckets.append((bucket_start, bucket_end))
+        bucket_start = bucket_end
+    return buckets
+
+
+def get_bucket_start(interval:str, timestamp:datetime.datetime) -> datetime.datetime:
+    """
+        Returns the start of the bucket the given timestamp falls in. Timestamps without a timezone
+        are taken to be in UTC, like ES does
+
+        @precondition: interval in INTERVALS
+    """
+    assert interval in INTERVALS, (interval, INTERVALS)
+
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    timestamp = timestamp.astimezone(datetime.timezone.utc)
+
+    if interval == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == 'day':
+        return day
+    if interval == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def get_bucket_end(interval:str, bucket_start:datetime.datetime) -> datetime.datetime:
+    """
+        Returns the end of the bucket that starts at bucket_start, which is excluded from it
+
+        @precondition: interval in INTERVALS
+    """
+    assert interval in INTERVALS, (interval, INTERVALS)
+    return _get_next_bucket_start(interval, bucket_start)
+
+
+def _get_next_bucket_start(interval:str, bucket_start:datetime.datetime) -> datetime.datetime:
+    if interval == 'hour':
+        return bucket_start + datetime.timedelta(hours=1)
+    if interval == 'day':
+        return bucket_start + datetime.timedelta(days=1)
+    if interval == 'week':
+        return bucket_start + datetime.timedelta(weeks=1)
+    if bucket_start.month == 12:
+        return bucket_start.replace(year=bucket_start.year + 1, month=1)
+    return bucket_start.replace(month=bucket_start.month + 1)
+
+
+def get_cache_key(signature:str, interval:str, bucket_start:datetime.datetime) -> str:
+    """
+        Returns the key we cache the occurrence count of the given signature's bucket under
+    """
+    return '%s:%s:%s' % (signature, interval, format_timestamp(bucket_start))
+
+
+def format_timestamp(timestamp:datetime.datetime) -> str:
+    """
+        Formats a bucket's UTC timestamp the way our time series API returns it
+    """
+    return timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')
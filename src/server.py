@@ -11,20 +11,21 @@ import time
 import traceback
 import urllib
 
-import certifi
 import flask
 import opentracing
+import prometheus_client
+import prometheus_client.multiprocess
 import redis
 from flask_bootstrap import Bootstrap
 from flask_env import MetaFlaskEnv
 from flask_kvsession import KVSessionExtension
-from elasticsearch import Elasticsearch
 from simplekv.memory.redisstore import RedisStore
 from simplekv.decorator import PrefixDecorator
 
 from opentracing_instrumentation.request_context import span_in_context
 
 from common_util import (
+    elasticsearch_config,
     es_util,
     logging_util,
 )
@@ -42,10 +43,13 @@ from lib.papertrail import (
 from lib.traceback import (
     traceback_db,
     traceback_formatter,
+    traceback_timeseries,
 )
+from lib.traceback.traceback import generate_signature
 from webapp import (
     api_aservice,
     healthz,
+    page_cache,
     text_keys,
     tracing,
 )
@@ -69,7 +73,8 @@ logger = logging.getLogger()
 Bootstrap(app)
 
 # set up database
-ES = Elasticsearch([app.config['ES_ADDRESS']], ca_certs=certifi.where())
+ES = elasticsearch_config.get_db('web')
+traceback_db.register_text_loader(ES)
 
 # use redis for our session storage (ie: server side cookies)
 REDIS = redis.StrictRedis(host=app.config['REDIS_ADDRESS'])
@@ -83,7 +88,9 @@ healthz.add_healthcheck_endpoint(app, ES, REDIS)
 # config
 DEBUG_TIMING = True
 
-FILTERS = ['All Tracebacks', 'Has Ticket', 'Has Open Ticket', 'No Ticket', 'No Recent Ticket']
+MATCH_LEVELS = {'exact': es_util.EXACT_MATCH, 'similar': es_util.SIMILAR_MATCH}
+
+DEFAULT_TIMESERIES_DAYS = 30
 
 
 @app.route("/", methods=['GET'])
@@ -100,28 +107,35 @@ def index():
     filter_text = flask.request.args.get('filter')
     if filter_text is not None:
         filter_text = urllib.parse.unquote_plus(filter_text)
-        if filter_text not in FILTERS:
+        if filter_text not in api_aservice.FILTERS:
             return 'bad filter: %s' % filter_text, 400
     if filter_text is None:
         filter_text = 'All Tracebacks'
 
-    # create a set of traceback ids that match all the traceback texts the user has hidden
     span = flask.g.tracer_root_span
     tracer = opentracing.tracer
-    with span_in_context(span):
-        # TODO: do we need to set something to declare what this span block is doing?
-        hidden_traceback_ids = set()
-        if flask.session.get(text_keys.HIDDEN_TRACEBACK) is not None:
-            for traceback_text in flask.session.get(text_keys.HIDDEN_TRACEBACK):
-                for tb in traceback_db.get_matching_tracebacks(
-                        ES, tracer, traceback_text, es_util.EXACT_MATCH, 10000
-                ):
-                    hidden_traceback_ids.add(tb.origin_papertrail_id)
-            logger.info('found %s traceback ids we need to hide', len(hidden_traceback_ids))
+    span.set_tag('filter', filter_text)
+    # the user hides tracebacks by their text. we hide every traceback with the same signature
+    hidden_signatures = tuple(sorted(set(
+        generate_signature(traceback_text)
+        for traceback_text in flask.session.get(text_keys.HIDDEN_TRACEBACK) or ()
+    )))
+
+    # may run in a background thread, after this request is over
+    @flask.copy_current_request_context
+    def render():
+        with span_in_context(span):
+            return api_aservice.render_main_page(
+                ES, tracer, days_ago_int, filter_text, hidden_signatures
+            )
 
-    with span_in_context(span):
-        span.set_tag('filter', filter_text)
-        return api_aservice.render_main_page(ES, tracer, days_ago_int, filter_text, set())
+    key = page_cache.get_day_view_key(
+        api_aservice.get_date_to_analyze(days_ago_int),
+        days_ago_int,
+        filter_text,
+        hidden_signatures,
+    )
+    return page_cache.get_page(key, render)
 
 
 @app.route("/api/parse_s3", methods=['POST'])
@@ -181,8 +195,10 @@ def parse_s3_date_range():
         Takes a JSON containing these fields:
         - start_date: starting day to parse. string, in YYYY-MM-DD form
         - end_date: starting day to parse. string, in YYYY-MM-DD form
+        - bulk_load: optional. if True, parses the files in a single job, with the indices we
+          write to in bulk load mode. use for large historical backfills
 
-        All fields are required.
+        start_date and end_date are required.
 
         Returns a 400 error on bad input. Returns a 202 after we queue the jobs to be run
         asyncronously.
@@ -205,6 +221,12 @@ def parse_s3_date_range():
     except ValueError:
         return 'failed to parse date from params', 400
 
+    if json_request.get('bulk_load') is True:
+        tasks.bulk_load_s3_date_range.delay(
+            start_date_str, end_date_str, app.config['S3_BUCKET'], app.config['S3_KEY_PREFIX']
+        )
+        return 'job queued', 202
+
     # iterate through all dates between start_date and end_date
     date_ = start_date
     while date_ <= end_date:
@@ -343,10 +365,11 @@ def jira_formatted_list(traceback_origin_id):
     tb = traceback_db.get_traceback(ES, traceback_id)
 
     # find a list of tracebacks that use the given traceback text
-    tracebacks = traceback_db.get_matching_tracebacks(
-        ES, opentracing.tracer, tb.traceback_text, es_util.EXACT_MATCH, 100
+    # sorted into a new list: cached results are shared, and mustn't be modified
+    tracebacks = sorted(
+        api_aservice.get_latest_hits(ES, opentracing.tracer, tb, 100),
+        key=lambda tb: int(tb.origin_papertrail_id), reverse=True
     )
-    tracebacks.sort(key=lambda tb: int(tb.origin_papertrail_id), reverse=True)
 
     return (
         traceback_formatter.create_hits_list(tracebacks, traceback_formatter.jira_formatted_string),
@@ -355,6 +378,110 @@ def jira_formatted_list(traceback_origin_id):
     )
 
 
+@app.route("/api/jira_issues_referencing/<papertrail_id>", methods=['GET'])
+def jira_issues_referencing_api(papertrail_id):
+    """
+        Returns the jira issues whose description or comments reference the given papertrail id
+
+        Returns a JSON object with a list of issues, each with its key, url, summary and status.
+        Returns a 400 error on a bad id.
+    """
+    try:
+        papertrail_id = int(papertrail_id)
+    except ValueError:
+        return 'bad papertrail id', 400
+
+    span = flask.g.tracer_root_span
+    with span_in_context(span):
+        jira_issues = jira_issue_db.get_jira_issues_referencing(
+            ES, opentracing.tracer, papertrail_id
+        )
+    return flask.jsonify({
+        "issues": [
+            {
+                "key": issue.key,
+                "url": issue.url,
+                "summary": issue.summary,
+                "status": issue.status,
+            }
+            for issue in sorted(jira_issues, key=lambda issue: issue.key)
+        ],
+    })
+
+
+@app.route("/api/traceback_timeseries", methods=['GET'])
+def traceback_timeseries_api():
+    """
+        Returns the number of tracebacks seen in each time bucket of a date range, for one or more
+        traceback signatures
+
+        Takes query params with these fields:
+        - signature: a traceback signature to count. may be given more than once
+        - text: a traceback text. we count the signatures that match it at match_level
+        - match_level: optional. 'exact' (the default) or 'similar'. only used with `text`
+        - interval: optional. bucket size: 'hour', 'day' (the default), 'week' or 'month'
+        - start_date: optional. first day to count. string, in YYYY-MM-DD form. defaults to
+          DEFAULT_TIMESERIES_DAYS before end_date
+        - end_date: optional. last day to count. string, in YYYY-MM-DD form. defaults to today
+
+        At least one signature or a text is required. Buckets are in UTC and always cover their
+        whole interval, so the first and last week or month may reach past the date range.
+
+        Returns a JSON object with the interval and a list of series, one per signature, each with
+        its buckets' start time and count. Returns a 400 error on bad input.
+    """
+    signatures = set(flask.request.args.getlist('signature'))
+    text = flask.request.args.get('text')
+    if not signatures and not text:
+        return 'missing params', 400
+    match_level = MATCH_LEVELS.get(flask.request.args.get('match_level', 'exact'))
+    if match_level is None:
+        return 'bad match_level', 400
+    interval = flask.request.args.get('interval', 'day')
+    if interval not in traceback_timeseries.INTERVALS:
+        return 'bad interval', 400
+    end_date_str = flask.request.args.get('end_date', datetime.date.today().isoformat())
+    start_date_str = flask.request.args.get('start_date')
+    try:
+        end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        if start_date_str is not None:
+            start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        else:
+            start_date = end_date - datetime.timedelta(days=DEFAULT_TIMESERIES_DAYS - 1)
+    except ValueError:
+        return 'failed to parse date from params', 400
+    if start_date > end_date:
+        return 'start_date is after end_date', 400
+
+    span = flask.g.tracer_root_span
+    tracer = opentracing.tracer
+    with span_in_context(span):
+        if text:
+            signatures.update(traceback_db.get_matching_signatures(ES, tracer, text, match_level))
+        try:
+            counts = traceback_db.get_occurrence_counts(
+                ES, tracer, signatures, interval, start_date, end_date
+            )
+        except ValueError as e:
+            return str(e), 400
+
+    return flask.jsonify({
+        "interval": interval,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "series": [
+            {
+                "signature": signature,
+                "buckets": [
+                    {"start": traceback_timeseries.format_timestamp(bucket_start), "count": count}
+                    for bucket_start, count in buckets
+                ],
+            }
+            for signature, buckets in sorted(counts.items())
+        ],
+    })
+
+
 @app.route("/slack-callback", methods=['POST'])
 def slack_callback():
     data = flask.request.get_data()
@@ -447,6 +574,81 @@ def update_jira_db():
         return 'job queued', 202
 
 
+@app.route("/api/backfill_traceback_signatures", methods=['PUT'])
+def backfill_traceback_signatures():
+    """
+        Queue a job that adds a traceback_signature to every traceback that doesn't have one yet
+    """
+    tasks.backfill_traceback_signatures.delay()
+    return 'job queued', 202
+
+
+@app.route("/api/rebuild_traceback_groups", methods=['PUT'])
+def rebuild_traceback_groups():
+    """
+        Queue a job that rebuilds the traceback group index from every saved traceback
+    """
+    tasks.rebuild_traceback_groups.delay()
+    return 'job queued', 202
+
+
+@app.route("/api/migrate_legacy_traceback_index", methods=['PUT'])
+def migrate_legacy_traceback_index():
+    """
+        Queue a job that copies our legacy unpartitioned traceback index into monthly partitions
+
+        Takes an optional JSON payload with the following field:
+        - delete_legacy_index: if True, deletes the legacy index once the copy succeeds
+    """
+    json_request = flask.request.get_json()
+    delete_legacy_index = bool(json_request and json_request.get('delete_legacy_index') is True)
+    tasks.migrate_legacy_traceback_index.delay(delete_legacy_index)
+    return 'job queued', 202
+
+
+@app.route("/api/reindex_traceback_partitions", methods=['PUT'])
+def reindex_traceback_partitions():
+    """
+        Queue a job that reindexes every traceback partition that uses an older mapping, one month
+        at a time, while ingestion keeps running
+
+        Takes an optional JSON payload with the following field:
+        - keep_old_partitions: if True, old partitions are only removed from the read alias
+    """
+    json_request = flask.request.get_json()
+    keep_old_partitions = bool(json_request and json_request.get('keep_old_partitions') is True)
+    tasks.reindex_traceback_partitions.delay(not keep_old_partitions)
+    return 'job queued', 202
+
+
+@app.route("/api/drop_expired_traceback_partitions", methods=['PUT'])
+def drop_expired_traceback_partitions():
+    """
+        Queue a job that deletes the traceback partitions older than TRACEBACK_RETENTION_MONTHS
+    """
+    tasks.drop_expired_traceback_partitions.delay()
+    return 'job queued', 202
+
+
+@app.route("/api/drain_ingest_spool", methods=['PUT'])
+def drain_ingest_spool():
+    """
+        Queue a job that replays the tracebacks and api calls we spooled while ES was unavailable
+    """
+    tasks.drain_ingest_spool.delay()
+    return 'job queued', 202
+
+
+@app.route("/api/archive_traceback_partitions", methods=['PUT'])
+def archive_traceback_partitions():
+    """
+        Queue a job that moves the traceback partitions older than TRACEBACK_ARCHIVE_MONTHS to our
+        cold tier archive
+    """
+    tasks.archive_traceback_partitions.delay()
+    return 'job queued', 202
+
+
 @app.route("/api/invalidate_cache", methods=['PUT'])
 @app.route("/api/invalidate_cache/<cache>", methods=['PUT'])
 def invalidate_cache(cache=None):
@@ -465,6 +667,25 @@ def purge_celery_queue():
     return 'success'
 
 
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """
+        Our prometheus metrics, in prometheus's text format
+
+        Each gunicorn worker keeps its own metrics. Set the prometheus_multiproc_dir environment
+        variable to collect every worker's metrics here, instead of just this worker's
+    """
+    registry = prometheus_client.REGISTRY
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        prometheus_client.multiprocess.MultiProcessCollector(registry)
+    return (
+        prometheus_client.generate_latest(registry),
+        200,
+        {'Content-Type': prometheus_client.CONTENT_TYPE_LATEST}
+    )
+
+
 @app.route("/admin", methods=['GET'])
 def admin():
     error = False
@@ -1,20 +1,22 @@
 import datetime
 import logging
+import typing
 
 import pytz
 import redis
 
-from elasticsearch import Elasticsearch
 import celery
-import certifi
 
 from common_util import (
+    bulk_load_util,
     config_util,
+    elasticsearch_config,
     logging_util,
 )
 from lib.api_call import api_call_db
 from lib.common import (
     cache_util,
+    ingest_spool,
 )
 from lib.jira import (
     jira_issue_aservice,
@@ -37,12 +39,17 @@ from webapp import (
 )
 
 REDIS_ADDRESS = config_util.get('REDIS_ADDRESS')
-ES_ADDRESS = config_util.get('ES_ADDRESS')
+
+BULK_LOAD_MAX_CONCURRENCY = 4
+"""
+    Max number of log files we parse at the same time during a bulk load
+"""
 
 app = celery.Celery('tasks', broker='redis://'+REDIS_ADDRESS)
 
 # set up database
-ES = Elasticsearch([ES_ADDRESS], ca_certs=certifi.where())
+ES = elasticsearch_config.get_db('worker')
+traceback_db.register_text_loader(ES)
 REDIS = redis.StrictRedis(host=REDIS_ADDRESS)
 
 logger = logging.getLogger()
@@ -90,28 +97,185 @@ def parse_log_file(bucket, key):
     """
         takes a bucket and key refering to a logfile on s3 and parses that file
     """
+    # save_tracebacks invalidates the traceback cache for us, so we only need to kick off a
+    # re-hydration
+    if __parse_log_file(bucket, key) > 0:
+        hydrate_cache.apply_async(tuple(), expires=60) # expire after a minute
+
+
+@app.task
+def bulk_load_s3_date_range(start_date_str, end_date_str, bucket, key_prefix):
+    """
+        parses every log file on s3 between the given dates (inclusive, in YYYY-MM-DD form) with
+        the indices we write to in bulk load mode
+
+        used for historical backfills. see L{bulk_load_util} for what bulk load mode changes. the
+        current month's indices are left alone, since our realtime updater writes to them
+    """
+    start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date()
+    end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date()
+
+    # tracebacks near a month boundary may be saved in the next or previous month's partition
+    first_day = start_date - datetime.timedelta(days=1)
+    last_day = end_date + datetime.timedelta(days=1)
+    current_month = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m')
+    indices = [
+        index for index in (
+            traceback_db.get_partitions_for_date_range(first_day, last_day)
+            + api_call_db.get_indices_for_date_range(first_day, last_day)
+        )
+        if not index.endswith(current_month)
+    ]
+
+    keys = []
+    date_ = start_date
+    while date_ <= end_date:
+        keys.extend(api_aservice.get_s3_keys_for_date(date_, key_prefix))
+        date_ += datetime.timedelta(days=1)
+
+    logger.info("bulk loading %s log files. %s to %s", len(keys), start_date, end_date)
+    with bulk_load_util.bulk_load_mode(ES, indices):
+        counts = bulk_load_util.run_throttled(
+            ES, __parse_log_file, ((bucket, key) for key in keys), BULK_LOAD_MAX_CONCURRENCY
+        )
+    # the indices weren't refreshed while we loaded, so time series counts taken meanwhile (and
+    # cached) may be missing what we loaded
+    traceback_db.invalidate_timeseries_cache()
+    logger.info(
+        "bulk loaded %s tracebacks from %s log files. %s files failed",
+        sum(count for count in counts if count), len(keys),
+        len([count for count in counts if count is None]),
+    )
+    hydrate_cache.apply_async(tuple(), expires=60) # expire after a minute
+
+
+def __parse_log_file(bucket, key) -> typing.Optional[int]:
+    """
+        parses the given s3 log file and saves its tracebacks and api calls
+
+        returns the number of tracebacks saved, or None if we couldn't download the file
+    """
     logger.info("parsing log file. bucket: %s, key: %s", bucket, key)
 
     # use our powerful parser to run checks on the requested file
     tracebacks, api_calls = s3.parse_s3_file(bucket, key)
     if tracebacks is None:
         logger.error("unable to download log file from s3. bucket: %s, key: %s", bucket, key)
-        return
+        return None
 
-    # save the tracebacks to the database
-    count = 0
-    for tb in tracebacks:
-        count += 1
-        traceback_db.save_traceback(ES, tb)
-    logger.info("saved %s tracebacks. bucket: %s, key: %s", count, bucket, key)
-    cache_util.invalidate_cache('traceback')
+    # save the tracebacks to the database. we spool whatever ES can't take right now
+    traceback_count, spooled_count, errors = ingest_spool.save_tracebacks(ES, tracebacks)
+    logger.info(
+        "saved %s tracebacks, spooled %s. bucket: %s, key: %s",
+        traceback_count, spooled_count, bucket, key
+    )
+    if errors:
+        logger.error("failed to save %s tracebacks. bucket: %s, key: %s", len(errors), bucket, key)
 
     # save the api calls to the database
     logger.info("found %s api_calls. bucket: %s, key: %s", len(api_calls), bucket, key)
-    if api_call_db.save(ES, api_calls):
-        logger.info("saved %s api_calls. bucket: %s, key: %s", len(api_calls), bucket, key)
-    else:
-        logger.error('failed to save api_calls. %s, key: %s', bucket, key)
+    count, spooled_count, errors = ingest_spool.save_api_calls(ES, api_calls)
+    logger.info(
+        "saved %s api_calls, spooled %s. bucket: %s, key: %s", count, spooled_count, bucket, key
+    )
+    if errors:
+        logger.error('failed to save %s api_calls. %s, key: %s', len(errors), bucket, key)
+
+    if traceback_count and ingest_spool.get_segments():
+        # ES took our writes, so it can take the ones we spooled earlier too
+        drain_ingest_spool.apply_async(tuple(), expires=60) # expire after a minute
+    return traceback_count
+
+
+@app.task
+def backfill_traceback_signatures():
+    """
+        Adds a traceback_signature to every traceback saved before we started generating them
+    """
+    logger.info("backfilling traceback signatures")
+    count = traceback_db.backfill_signatures(ES)
+    logger.info("backfilled %s traceback signatures", count)
+    if count > 0:
+        hydrate_cache.apply_async(tuple(), expires=60) # expire after a minute
+
+
+@app.task
+def rebuild_traceback_groups():
+    """
+        Rebuilds the traceback group index from all the tracebacks we've saved
+    """
+    logger.info("rebuilding traceback groups")
+    count = traceback_db.rebuild_traceback_groups(ES)
+    logger.info("rebuilt traceback groups from %s tracebacks", count)
+    jira_issue_db.match_all_jira_issues(ES)
+    hydrate_cache.apply_async(tuple(), expires=60) # expire after a minute
+
+
+@app.task
+def migrate_legacy_traceback_index(delete_legacy_index):
+    """
+        Copies the tracebacks in our legacy unpartitioned index into their monthly partitions
+    """
+    logger.info("migrating legacy traceback index")
+    status = traceback_db.migrate_legacy_index(ES, delete_legacy_index)
+    logger.info("finished migrating legacy traceback index: %s", status)
+    hydrate_cache.apply_async(tuple(), expires=60) # expire after a minute
+
+
+@app.task
+def reindex_traceback_partitions(delete_old_partitions):
+    """
+        Copies the traceback partitions that use an older mapping into partitions that use our
+        current mapping
+    """
+    logger.info("reindexing traceback partitions")
+    reindexed = traceback_db.reindex_partitions(ES, delete_old_partitions)
+    logger.info("reindexed %s traceback partitions: %s", len(reindexed), reindexed)
+
+
+@app.task
+def drop_expired_traceback_partitions():
+    """
+        Deletes the traceback partitions that are older than our retention period
+    """
+    dropped = traceback_db.drop_expired_partitions(ES)
+    logger.info("dropped %s expired traceback partitions: %s", len(dropped), dropped)
+
+
+@app.task
+def drain_ingest_spool():
+    """
+        Replays the tracebacks and api calls we spooled while ES was unavailable
+    """
+    count = ingest_spool.drain(ES)
+    logger.info(
+        "replayed %s spooled items. %s segments left", count, len(ingest_spool.get_segments())
+    )
+    if count > 0:
+        hydrate_cache.apply_async(tuple(), expires=60) # expire after a minute
+
+
+app.conf.beat_schedule = {
+    'drain-ingest-spool': {
+        'task': drain_ingest_spool.name,
+        'schedule': ingest_spool.DRAIN_INTERVAL_SECONDS,
+        'options': {'expires': ingest_spool.DRAIN_INTERVAL_SECONDS},
+    },
+}
+"""
+    Run by our single celery beat (see kubernetes/celery-beat-deployment.yaml). Drains the spool
+    even when no new logs come in to trigger it
+"""
+
+
+@app.task
+def archive_traceback_partitions():
+    """
+        Moves the traceback partitions that are older than our archive threshold out of ES and
+        into our cold tier
+    """
+    archived = traceback_db.archive_partitions(ES)
+    logger.info("archived %s traceback partitions: %s", len(archived), archived)
 
 
 @app.task
@@ -17,11 +17,15 @@ from lib.jira import (
     jira_issue_aservice,
     jira_issue_db,
 )
+from lib.jira.jira_issue import JiraIssue
 from lib.slack import slack_channel
 from lib.traceback import (
     traceback_db,
+    traceback_group_db,
 )
+from lib.traceback.traceback import Traceback
 from webapp import (
+    page_cache,
     text_keys,
 )
 import tasks
@@ -31,6 +35,16 @@ logger = logging.getLogger()
 
 TWO_WEEKS_AGO = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=14)
 
+FILTERS = ['All Tracebacks', 'Has Ticket', 'Has Open Ticket', 'No Ticket', 'No Recent Ticket']
+"""
+    The filters of our day view, as given in its `filter` query param
+"""
+
+MAX_TRACEBACKS_PER_DAY = 100
+"""
+    Max number of tracebacks we show for a day, due to the performance issues of having more
+"""
+
 
 class TracebackPlusMetadata():
     """
@@ -43,116 +57,236 @@ class TracebackPlusMetadata():
         self.jira_issues = None
         self.similar_jira_issues = None
         self.similar_tracebacks = None
+        self.hit_count = None
+        self.day_count = None
 
     __slots__ = [
         'traceback',
         'jira_issues',
         'similar_jira_issues',
         'similar_tracebacks',
+        'hit_count',
+        'day_count',
     ]
 
 
 def get_tracebacks_for_day(
-        ES, tracer, date_to_analyze:datetime.date, filter_text:str, hidden_traceback_ids:set,
+        ES, tracer, date_to_analyze:datetime.date, filter_text:str, hidden_signatures:tuple,
 ) -> typing.List[TracebackPlusMetadata]:
     """
         Retrieves the Tracebacks for the given date_to_analyze date.
 
         If provided, only returns Tracebacks which match filter_text.
 
-        Only returns Tracebacks whose ids aren't in hidden_traceback_ids.
+        Only returns Tracebacks whose signatures aren't in hidden_signatures.
+    """
+    return get_tracebacks_and_filter_counts_for_day(
+        ES, tracer, date_to_analyze, filter_text, hidden_signatures
+    )[0]
+
+
+def get_tracebacks_and_filter_counts_for_day(
+        ES, tracer, date_to_analyze:datetime.date, filter_text:str, hidden_signatures:tuple,
+) -> typing.Tuple[typing.List[TracebackPlusMetadata], typing.Dict[str, int]]:
+    """
+        L{get_tracebacks_for_day}, plus the number of tracebacks on that day that match each of our
+        L{FILTERS}
+
+        The counts cover every traceback of the day, not just the ones we return. They come from a
+        terms aggregation on the day's search, and the jira issue keys of every signature seen that
+        day. Tracebacks we don't have a group for yet only count as having a ticket if they're one
+        of the tracebacks we return. Hidden tracebacks are left out of the counts.
+
+        @return: a tuple of (list of tracebacks, dict of filter -> count)
     """
     tracer = tracer or opentracing.tracer
     root_span = get_current_span()
 
-    # get all tracebacks
+    # get all tracebacks the user hasn't hidden, and count every one of the day by signature
     with tracer.start_span('get all tracebacks', child_of=root_span) as span:
         with span_in_context(span):
-            tracebacks = traceback_db.get_tracebacks(ES, tracer, date_to_analyze, date_to_analyze)
+            tracebacks, day_total, day_counts = traceback_db.get_tracebacks_with_counts(
+                ES, tracer, date_to_analyze, date_to_analyze, hidden_signatures=hidden_signatures
+            )
     logger.debug('found %s tracebacks', len(tracebacks))
 
-    # filter out tracebacks the user has hidden. we use a namedlist to store each traceback + some
-    # metadata we'll use when rendering the html page
-    tb_meta = [
-        TracebackPlusMetadata(traceback=t) for t in tracebacks
-        if t.origin_papertrail_id not in hidden_traceback_ids
-    ]
+    # we use a namedlist to store each traceback + some metadata we'll use when rendering the html
+    # page
+    tb_meta = [TracebackPlusMetadata(traceback=t) for t in tracebacks]
+    for tb in tb_meta:
+        tb.day_count = day_counts.get(tb.traceback.traceback_signature)
 
-    # get a list of matching jira issues
-    with tracer.start_span('for each traceback, get matching jira issues', child_of=root_span) as span:
+    # get the traceback groups. they hold our similar tracebacks and the keys of the jira issues
+    # that match each traceback. for the filter counts we also need the jira issue keys of every
+    # signature seen today
+    with tracer.start_span('get traceback groups', child_of=root_span) as span:
         with span_in_context(span):
-            for tb in tb_meta:
-                tb.jira_issues = jira_issue_db.get_matching_jira_issues(
-                    ES, tracer, tb.traceback.traceback_text, es_util.EXACT_MATCH
+            groups = traceback_group_db.get_traceback_groups(
+                ES, tracer, tuple(sorted(set(tb.traceback.traceback_signature for tb in tb_meta)))
+            )
+            day_jira_issue_keys = traceback_group_db.get_jira_issue_keys(
+                ES, tracer, tuple(sorted(day_counts))
+            )
+    ungrouped_texts = tuple(sorted(set(
+        tb.traceback.traceback_text for tb in tb_meta
+        if tb.traceback.traceback_signature not in groups
+    )))
+
+    # get the matching jira issues. grouped tracebacks only need a lookup of the jira issues by key;
+    # we only search for the jira issues of any traceback we don't have a group for yet
+    with tracer.start_span(
+            'for each traceback, get matching jira issues', child_of=root_span
+    ) as span:
+        with span_in_context(span):
+            jira_issue_keys = set()
+            for group in groups.values():
+                jira_issue_keys.update(group.jira_issue_keys)
+                jira_issue_keys.update(group.similar_jira_issue_keys)
+            for keys in day_jira_issue_keys.values():
+                jira_issue_keys.update(keys)
+            jira_issues_by_key = jira_issue_db.get_jira_issues(
+                ES, tracer, tuple(sorted(jira_issue_keys))
+            )
+            exact_jira_issues: typing.Dict[str, typing.List[JiraIssue]] = {}
+            similar_jira_issues: typing.Dict[str, typing.List[JiraIssue]] = {}
+            if ungrouped_texts:
+                exact_jira_issues = jira_issue_db.get_matching_jira_issues_for_texts(
+                    ES, tracer, ungrouped_texts, es_util.EXACT_MATCH
                 )
-                matching_jira_keys = set(jira_issue.key for jira_issue in tb.jira_issues)
-                similar_jira_issues = jira_issue_db.get_matching_jira_issues(
-                    ES, tracer, tb.traceback.traceback_text, es_util.SIMILAR_MATCH
+                similar_jira_issues = jira_issue_db.get_matching_jira_issues_for_texts(
+                    ES, tracer, ungrouped_texts, es_util.SIMILAR_MATCH
                 )
-                tb.similar_jira_issues = [similar_jira_issue for similar_jira_issue in similar_jira_issues
-                                        if similar_jira_issue.key not in matching_jira_keys]
-
-    # apply user's filters
-    if filter_text == 'Has Ticket':
-        tb_meta = [tb for tb in tb_meta if tb.jira_issues]
-    elif filter_text == 'No Ticket':
-        tb_meta = [tb for tb in tb_meta if not tb.jira_issues]
-    elif filter_text == 'No Recent Ticket':
-        tb_meta_without_recent_ticket = []
-        for tb in tb_meta:
-            has_recent_issues = False
-            for issue in tb.jira_issues:
-                if issue.updated > TWO_WEEKS_AGO:
-                    has_recent_issues = True
-                    break
-            if not has_recent_issues:
-                tb_meta_without_recent_ticket.append(tb)
-        tb_meta = tb_meta_without_recent_ticket
-    elif filter_text == 'Has Open Ticket':
-        tb_meta = [
-            tb for tb in tb_meta if
-            [issue for issue in tb.jira_issues if issue.status != 'Closed']
-        ]
-    else:
-        tb_meta = tb_meta
+            for tb in tb_meta:
+                group = groups.get(tb.traceback.traceback_signature)
+                if group is not None:
+                    tb.jira_issues = [
+                        jira_issues_by_key[key] for key in group.jira_issue_keys
+                        if key in jira_issues_by_key
+                    ]
+                    similar_issues = [
+                        jira_issues_by_key[key] for key in group.similar_jira_issue_keys
+                        if key in jira_issues_by_key
+                    ]
+                else:
+                    tb.jira_issues = exact_jira_issues[tb.traceback.traceback_text]
+                    similar_issues = similar_jira_issues[tb.traceback.traceback_text]
+                matching_jira_keys = set(jira_issue.key for jira_issue in tb.jira_issues)
+                tb.similar_jira_issues = [
+                    similar_jira_issue for similar_jira_issue in similar_issues
+                    if similar_jira_issue.key not in matching_jira_keys
+                ]
+
+    # count the day's tracebacks that match each filter, then apply the user's filter
+    jira_issues_by_signature = {
+        signature: [jira_issues_by_key[key] for key in keys if key in jira_issues_by_key]
+        for signature, keys in day_jira_issue_keys.items()
+    }
+    for tb in tb_meta:
+        jira_issues_by_signature[tb.traceback.traceback_signature] = tb.jira_issues
+    filter_counts = {
+        filter_: sum(
+            count for signature, count in day_counts.items()
+            if _matches_filter(filter_, jira_issues_by_signature.get(signature, []))
+        )
+        for filter_ in FILTERS
+    }
+    # the total also counts any signatures past the aggregation's limit
+    filter_counts['All Tracebacks'] = day_total
+    tb_meta = [tb for tb in tb_meta if _matches_filter(filter_text, tb.jira_issues)]
 
-    # we take at most 100 tracebacks, due to performance issues of having more
-    tb_meta = tb_meta[:100]
+    tb_meta = tb_meta[:MAX_TRACEBACKS_PER_DAY]
 
-    # for each traceback, get all similar tracebacks
+    # for each traceback, get all similar tracebacks. we read them from the traceback groups, and
+    # only query for the matching tracebacks of any traceback we don't have a group for yet
     with tracer.start_span('for each traceback, get similar tracebacks', child_of=root_span) as span:
         with span_in_context(span):
-            for tb in tb_meta:
-                tb.similar_tracebacks = []
-                tb.similar_tracebacks = traceback_db.get_matching_tracebacks(
-                    ES, tracer, tb.traceback.traceback_text, es_util.EXACT_MATCH, 100
+            ungrouped_texts = tuple(sorted(set(
+                tb.traceback.traceback_text for tb in tb_meta
+                if tb.traceback.traceback_signature not in groups
+            )))
+            ungrouped_tracebacks: typing.Dict[str, typing.Tuple[typing.List[Traceback], int]] = {}
+            if ungrouped_texts:
+                ungrouped_tracebacks = traceback_db.get_matching_tracebacks_with_counts_for_texts(
+                    ES, tracer, ungrouped_texts, es_util.EXACT_MATCH, 100
                 )
+            for tb in tb_meta:
+                group = groups.get(tb.traceback.traceback_signature)
+                if group is not None:
+                    tb.similar_tracebacks = group.occurrences()
+                    tb.hit_count = group.total_count
+                else:
+                    tb.similar_tracebacks, tb.hit_count = ungrouped_tracebacks[
+                        tb.traceback.traceback_text
+                    ]
+
+    return tb_meta, filter_counts
+
 
-    return tb_meta
+def _matches_filter(filter_text:str, jira_issues:typing.List[JiraIssue]) -> bool:
+    """
+        Returns True if a traceback with the given matching jira issues passes the given filter
+    """
+    if filter_text == 'Has Ticket':
+        return bool(jira_issues)
+    if filter_text == 'No Ticket':
+        return not jira_issues
+    if filter_text == 'No Recent Ticket':
+        return not any(issue.updated > TWO_WEEKS_AGO for issue in jira_issues)
+    if filter_text == 'Has Open Ticket':
+        return any(issue.status != 'Closed' for issue in jira_issues)
+    return True
+
+
+def get_latest_hits(ES, tracer, traceback:Traceback, num_hits:int) -> typing.List[Traceback]:
+    """
+        Returns the latest L{num_hits} tracebacks that share the given traceback's text
+
+        Reads them from the traceback's group. If we don't have a group for it yet, we fall back to
+        querying for the matching tracebacks.
+    """
+    group = traceback_group_db.get_traceback_group(ES, traceback.traceback_signature)
+    if group is not None:
+        return group.occurrences()[:num_hits]
+    return traceback_db.get_matching_tracebacks(
+        ES, tracer, traceback.traceback_text, es_util.EXACT_MATCH, num_hits
+    )
+
+
+def get_date_to_analyze(days_ago:int) -> datetime.date:
+    """
+        Returns the day our index page shows for the given days_ago
+    """
+    # our papertrail logs are saved in Eastern Time
+    today = datetime.datetime.now(pytz.timezone('US/Eastern')).date()
+    return today - datetime.timedelta(days=days_ago)
 
 
-def render_main_page(ES, tracer, days_ago:int, filter_text:str, hidden_traceback_ids:set):
+def render_main_page(ES, tracer, days_ago:int, filter_text:str, hidden_signatures:tuple):
     """
         Renders our index page with all the Trackbacks for the specified day and filter.
+
+        The page shows its age as L{page_cache.RENDER_AGE_PLACEHOLDER}, for L{page_cache} to fill in
     """
     tracer = tracer or opentracing.tracer
     root_span = get_current_span()
 
-    # our papertrail logs are saved in Eastern Time
-    today = datetime.datetime.now(pytz.timezone('US/Eastern')).date()
-    date_to_analyze = today - datetime.timedelta(days=days_ago)
+    date_to_analyze = get_date_to_analyze(days_ago)
 
-    tb_meta = get_tracebacks_for_day(ES, tracer, date_to_analyze, filter_text, hidden_traceback_ids)
+    tb_meta, filter_counts = get_tracebacks_and_filter_counts_for_day(
+        ES, tracer, date_to_analyze, filter_text, hidden_signatures
+    )
 
     with tracer.start_span('render page', child_of=root_span) as span:
         with span_in_context(span):
             render = flask.render_template(
                 'index.html',
                 tb_meta=tb_meta,
-                show_restore_button=len(hidden_traceback_ids) > 0,
+                filter_counts=filter_counts,
+                show_restore_button=len(hidden_signatures) > 0,
                 date_to_analyze=date_to_analyze,
                 days_ago=days_ago,
-                filter_text=filter_text
+                filter_text=filter_text,
+                render_age=page_cache.RENDER_AGE_PLACEHOLDER,
             )
     return render
 
@@ -168,13 +302,21 @@ def parse_s3_for_date(date_, bucket, key_prefix):
     """
         Queues jobs to parse s3 for the given date
     """
-    for hour in range(0, 24):
-        filename_string = 'dt=%s/%s-%02d.tsv.gz' % (date_, date_, hour)
-        key = '/'.join((key_prefix, filename_string))
+    for key in get_s3_keys_for_date(date_, key_prefix):
         logger.info("adding to s3 parse queue. bucket: '%s', key: '%s'", bucket, key)
         tasks.parse_log_file.delay(bucket, key)
 
 
+def get_s3_keys_for_date(date_, key_prefix) -> typing.List[str]:
+    """
+        Returns the s3 keys of the hourly log files for the given date
+    """
+    return [
+        '/'.join((key_prefix, 'dt=%s/%s-%02d.tsv.gz' % (date_, date_, hour)))
+        for hour in range(0, 24)
+    ]
+
+
 def create_ticket(
         ES, origin_papertrail_id:int, assign_to:typing.Optional[str], reject_if_ticket_exists:bool
 ) -> str:
@@ -194,12 +336,10 @@ def create_ticket(
             tasks.tell_slack_about_error(channel, "Issue has already been created as %s" % key)
 
     # find a list of tracebacks that use that text
-    similar_tracebacks = traceback_db.get_matching_tracebacks(
-        ES, opentracing.tracer, traceback.traceback_text, es_util.EXACT_MATCH, 50
-    )
+    similar_tracebacks = get_latest_hits(ES, opentracing.tracer, traceback, 50)
 
     # create a description using the list of tracebacks
-    description = jira_issue_aservice.create_description(similar_tracebacks)
+    description = jira_issue_aservice.create_description(traceback, similar_tracebacks)
 
     # create a title using the traceback text
     title = jira_issue_aservice.create_title(traceback.traceback_text)
@@ -228,9 +368,7 @@ def create_comment_on_existing_ticket(
     traceback = traceback_db.get_traceback(ES, origin_papertrail_id)
 
     # find a list of tracebacks that use that text
-    similar_tracebacks = traceback_db.get_matching_tracebacks(
-        ES, opentracing.tracer, traceback.traceback_text, es_util.EXACT_MATCH, 50
-    )
+    similar_tracebacks = get_latest_hits(ES, opentracing.tracer, traceback, 50)
 
     # get the list of jira issues that this traceback matches. if our given issue key comes back in
     # the set of matching jira issues, it means that the full traceback.text is already on our
@@ -248,7 +386,7 @@ def create_comment_on_existing_ticket(
     if existing_issue:
         # we need only need to post the new hits. filter out any tracebacks that are after the
         # latest one already on that ticket
-        latest = jira_issue_aservice.find_latest_referenced_id(existing_issue)
+        latest = existing_issue.latest_referenced_id
         if latest is not None:
             tracebacks_to_comment = [
                 tb for tb in similar_tracebacks
@@ -262,7 +400,7 @@ def create_comment_on_existing_ticket(
         comment = jira_issue_aservice.create_comment_with_hits_list(tracebacks_to_comment)
     else:
         # we need a full comment with the traceback description and all hits
-        comment = jira_issue_aservice.create_description(similar_tracebacks)
+        comment = jira_issue_aservice.create_description(traceback, similar_tracebacks)
 
     # leave the comment
     jira_issue = jira_issue_aservice.get_issue(existing_jira_issue_key)
@@ -1,13 +1,16 @@
 import healthcheck
-from elasticsearch import Elasticsearch
-import certifi
 import redis
 
+from common_util import (
+    elasticsearch_config,
+    redis_util,
+)
+
 
 def add_healthcheck_endpoint(app, ES, REDIS):
     health = healthcheck.HealthCheck(app, "/healthz")
 
-    ES = Elasticsearch([app.config['ES_ADDRESS']], ca_certs=certifi.where(), timeout=1.0)
+    ES = elasticsearch_config.get_db('healthcheck')
     REDIS = redis.StrictRedis(
         host=app.config['REDIS_ADDRESS'], socket_connect_timeout=1, socket_timeout=1
     )
@@ -32,4 +35,6 @@ def add_healthcheck_endpoint(app, ES, REDIS):
     # removing for now due to it taking too long with many Traceback errors in the system
     # health.add_check(main_page_renders)
 
-    _ = healthcheck.EnvironmentDump(app, "/environment")
+    envdump = healthcheck.EnvironmentDump(app, "/environment")
+    envdump.add_section("elasticsearch_pools", elasticsearch_config.get_pool_metrics)
+    envdump.add_section("dogpile_caches", redis_util.get_cache_metrics)
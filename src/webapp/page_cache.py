@@ -0,0 +1,191 @@
+"""
+    Caches the rendered html of our day view, and serves it stale while we render it again.
+
+    Rendering a day runs its queries (mostly cached by dogpile) and then Jinja over up to a hundred
+    tracebacks with their hits and jira issues. We keep each render in redis, shared by all our web
+    workers, under the day, filter and hidden tracebacks it shows (see L{get_day_view_key}).
+
+    L{get_page} serves a render right away if it's younger than L{MAX_STALE_SECONDS}. Once it's
+    older than L{FRESH_SECONDS}, or our dogpile regions were invalidated since, one of our workers
+    renders the page again in a background thread while we keep serving the old render. Only
+    renders older than L{MAX_STALE_SECONDS}, or pages nobody has asked for yet, are rendered while
+    the user waits.
+
+    Turned off (every request renders its page) when USE_DOGPILE_CACHE is off.
+"""
+from typing import (
+    Callable,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+import datetime
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import prometheus_client
+
+from common_util import (
+    cache_serializer,
+    config_util,
+    redis_util,
+)
+from lib.jira import (
+    jira_issue_db,
+)
+from lib.traceback import (
+    traceback_db,
+    traceback_group_db,
+)
+
+
+FRESH_SECONDS = config_util.get('PAGE_CACHE_FRESH_SECONDS')
+"""
+    How long we serve a render without rendering the page again
+"""
+
+MAX_STALE_SECONDS = config_util.get('PAGE_CACHE_MAX_STALE_SECONDS')
+"""
+    The oldest render we serve. Older renders are thrown out, and the page rendered while the user
+    waits
+"""
+
+REFRESH_TIMEOUT_SECONDS = 120
+"""
+    How long a worker may take to render a page again before another worker may try
+"""
+
+KEY_PREFIX = 'page-cache'
+REFRESH_LOCK_TEMPLATE = 'page-cache-refresh:%s'
+
+REGION_PREFIXES = (
+    traceback_db.DOGPILE_REGION_PREFIX,
+    traceback_group_db.DOGPILE_REGION_PREFIX,
+    jira_issue_db.DOGPILE_REGION_PREFIX,
+)
+"""
+    The dogpile regions our day view reads from. A render from before one of them was invalidated
+    is stale, whatever its age
+"""
+
+RENDER_AGE_PLACEHOLDER = '__RENDER_AGE__'
+"""
+    Pages render this where they show their age. We replace it with the render's age as we serve it
+"""
+
+PAGE_CACHE_REQUESTS = prometheus_client.Counter(
+    'page_cache_requests', 'Requests for a cached page, by whether we served a render we had',
+    ['result'],
+)
+
+logger = logging.getLogger()
+
+
+def get_day_view_key(date_to_analyze:datetime.date, days_ago:int, filter_text:str,
+                     hidden_signatures:Iterable[str]) -> str:
+    """
+        Returns the key we cache the given day view under
+
+        The view's links are relative to days_ago, so a day rendered as today is cached apart from
+        the same day rendered as yesterday. The signatures the user has hidden are hashed, in order
+    """
+    hidden_hash = hashlib.sha1(
+        json.dumps(sorted(hidden_signatures)).encode('utf-8')
+    ).hexdigest()
+    return '%s:day:%s:%s:%s:%s' % (
+        KEY_PREFIX, date_to_analyze.isoformat(), days_ago, filter_text, hidden_hash
+    )
+
+
+def get_page(key:str, render:Callable[[], str]) -> str:
+    """
+        Returns the page cached under the given key, rendering it with L{render} if we have to
+
+        L{render} may be called from a background thread, after our request is over. It must
+        render the page with its age as L{RENDER_AGE_PLACEHOLDER}
+    """
+    if not redis_util.USE_DOGPILE_CACHE:
+        return _show_age(render(), 0)
+
+    generations = _get_generations()
+    cached = _load(key)
+    now = time.time()
+    if cached is None or now - cached[0] > MAX_STALE_SECONDS:
+        PAGE_CACHE_REQUESTS.labels('miss').inc()
+        html = render()
+        _save(key, now, generations, html)
+        return _show_age(html, 0)
+
+    rendered_at, cached_generations, html = cached
+    if now - rendered_at > FRESH_SECONDS or cached_generations != generations:
+        PAGE_CACHE_REQUESTS.labels('stale').inc()
+        _refresh_in_background(key, render)
+    else:
+        PAGE_CACHE_REQUESTS.labels('fresh').inc()
+    return _show_age(html, now - rendered_at)
+
+
+def _get_generations() -> List[int]:
+    return [redis_util.get_generation(prefix) for prefix in REGION_PREFIXES]
+
+
+def _load(key:str) -> Optional[Tuple[float, List[int], str]]:
+    """
+        Returns the (time rendered at, region generations, html) cached under the given key, if any
+    """
+    data = redis_util.REDIS.get(key)
+    if data is None:
+        return None
+    try:
+        return cache_serializer.loads(data)
+    except ValueError as e:
+        logger.info('ignoring cached page %s: %s', key, e)
+        return None
+
+
+def _save(key:str, rendered_at:float, generations:List[int], html:str):
+    redis_util.REDIS.set(
+        key,
+        cache_serializer.dumps((rendered_at, generations, html)),
+        ex=MAX_STALE_SECONDS,
+    )
+
+
+def _refresh_in_background(key:str, render:Callable[[], str]):
+    """
+        Starts rendering the given page again, unless one of our workers already is
+    """
+    lock_key = REFRESH_LOCK_TEMPLATE % key
+    if not redis_util.REDIS.set(lock_key, 1, nx=True, ex=REFRESH_TIMEOUT_SECONDS):
+        return
+    threading.Thread(
+        target=_refresh, args=(key, render, lock_key), name='page-cache-refresh', daemon=True
+    ).start()
+
+
+def _refresh(key:str, render:Callable[[], str], lock_key:str):
+    try:
+        # read the generations first, so a render that races an invalidation counts as stale
+        generations = _get_generations()
+        rendered_at = time.time()
+        _save(key, rendered_at, generations, render())
+        logger.info('rendered %s again in %.2fs', key, time.time() - rendered_at)
+    except Exception:
+        # we keep serving the render we have until it's too old
+        logger.error('failed to render %s again', key, exc_info=True)
+    finally:
+        redis_util.REDIS.delete(lock_key)
+
+
+def _show_age(html:str, age_seconds:float) -> str:
+    return html.replace(RENDER_AGE_PLACEHOLDER, _format_age(age_seconds), 1)
+
+
+def _format_age(age_seconds:float) -> str:
+    if age_seconds < 60:
+        return '%ds' % age_seconds
+    return '%dm %ds' % divmod(age_seconds, 60)
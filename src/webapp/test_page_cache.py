@@ -0,0 +1,82 @@
+import datetime
+import threading
+import unittest
+
+from common_util import redis_util
+from common_util.testing_util import FakeRedis
+from webapp import page_cache
+
+
+def wait_for_refreshes():
+    for thread in threading.enumerate():
+        if thread.name == 'page-cache-refresh':
+            thread.join()
+
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.original_redis = redis_util.REDIS
+        self.original_use_cache = redis_util.USE_DOGPILE_CACHE
+        redis_util.REDIS = FakeRedis()
+        redis_util.USE_DOGPILE_CACHE = True
+        redis_util._generations.clear()
+        self.renders = 0
+        self.key = page_cache.get_day_view_key(
+            datetime.date(2018, 4, 1), 0, 'All Tracebacks', set()
+        )
+
+    def tearDown(self):
+        redis_util.REDIS = self.original_redis
+        redis_util.USE_DOGPILE_CACHE = self.original_use_cache
+        redis_util._generations.clear()
+
+    def render(self):
+        self.renders += 1
+        return 'render %s, %s old' % (self.renders, page_cache.RENDER_AGE_PLACEHOLDER)
+
+    def age_render(self, seconds):
+        rendered_at, generations, html = page_cache._load(self.key)
+        page_cache._save(self.key, rendered_at - seconds, generations, html)
+
+    def test_keys(self):
+        self.assertEqual(
+            page_cache.get_day_view_key(datetime.date(2018, 4, 1), 0, 'No Ticket', ['a', 'b']),
+            page_cache.get_day_view_key(datetime.date(2018, 4, 1), 0, 'No Ticket', {'b', 'a'}),
+        )
+        self.assertNotEqual(
+            self.key, page_cache.get_day_view_key(datetime.date(2018, 4, 1), 0, 'No Ticket', ())
+        )
+
+    def test_serves_stale_while_rendering(self):
+        self.assertEqual(page_cache.get_page(self.key, self.render), 'render 1, 0s old')
+        self.assertEqual(redis_util.REDIS.expirations[self.key], page_cache.MAX_STALE_SECONDS)
+        self.assertEqual(page_cache.get_page(self.key, self.render), 'render 1, 0s old')
+
+        self.age_render(page_cache.FRESH_SECONDS + 5)
+        self.assertEqual(page_cache.get_page(self.key, self.render), 'render 1, 35s old')
+        wait_for_refreshes()
+        self.assertEqual(self.renders, 2)
+        self.assertEqual(page_cache.get_page(self.key, self.render), 'render 2, 0s old')
+
+    def test_invalidation_makes_render_stale(self):
+        page_cache.get_page(self.key, self.render)
+        redis_util.force_redis_cache_invalidation(page_cache.REGION_PREFIXES[0])
+        self.assertEqual(page_cache.get_page(self.key, self.render), 'render 1, 0s old')
+        wait_for_refreshes()
+        self.assertEqual(page_cache.get_page(self.key, self.render), 'render 2, 0s old')
+
+    def test_max_staleness(self):
+        page_cache.get_page(self.key, self.render)
+        self.age_render(page_cache.MAX_STALE_SECONDS + 1)
+        self.assertEqual(page_cache.get_page(self.key, self.render), 'render 2, 0s old')
+
+    def test_failed_refresh_keeps_render(self):
+        def fail():
+            raise ValueError('es is down')
+
+        page_cache.get_page(self.key, self.render)
+        self.age_render(page_cache.FRESH_SECONDS + 5)
+        self.assertEqual(page_cache.get_page(self.key, fail), 'render 1, 35s old')
+        wait_for_refreshes()
+        self.assertEqual(page_cache.get_page(self.key, self.render), 'render 1, 35s old')
+        wait_for_refreshes()